@@ -1,5 +1,60 @@
 name = 'benchmark'
 #import profiler
-from .benchmark import *
-from .benchmark_data import *
 #import utils
+
+# The package's names are loaded from their modules when first used, so that
+# importing benchmark, or a light submodule like benchmark.phases from a
+# profiled script, does not import numpy, the profiler and the database client.
+_exports = {
+    'Profiler': 'benchmark',
+    'profile_function': 'benchmark',
+    'profile_script': 'benchmark',
+    'BenchmarkDataManager': 'benchmark_data',
+    'ResourceProfiler': 'profiler',
+    'CgroupSampler': 'cgroup',
+    'LogCapture': 'logcapture',
+    'Repetition': 'repetition',
+    'ScalingStudy': 'scaling',
+    'Sweep': 'sweep',
+    'IOBenchmark': 'iobench',
+    'HostBenchmark': 'hostbench',
+    'fingerprint': 'hostinfo',
+}
+__all__ = sorted(_exports)
+
+
+def __getattr__(attr):
+    from importlib import import_module
+
+    if attr.startswith('__'):
+        raise AttributeError(attr)
+    if attr in _exports:
+        value = getattr(import_module('.' + _exports[attr], __name__), attr)
+    else:
+        # Anything else 'from .benchmark import *' used to provide, and the
+        # submodules, which importing them all used to make attributes
+        try:
+            value = getattr(import_module('.benchmark', __name__), attr)
+        except AttributeError:
+            try:
+                value = import_module('.' + attr, __name__)
+            except ImportError as e:
+                # Only a missing submodule, not a failed import inside one
+                if getattr(e, 'name', __name__ + '.' + attr) != __name__ + '.' + attr:
+                    raise
+                raise AttributeError("module {!r} has no attribute {!r}".format(__name__, attr))
+    globals()[attr] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+import sys as _sys
+if _sys.version_info < (3, 7):
+    # No module __getattr__ before Python 3.7, import everything up front
+    from .benchmark import *
+    from .benchmark_data import *
+    for _attr in __all__:
+        __getattr__(_attr)
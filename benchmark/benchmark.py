@@ -2,49 +2,169 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import subprocess
-import csv
 from datetime import datetime
-import concurrent.futures
+from timeit import default_timer
+from contextlib import contextmanager
 from .profiler import ResourceProfiler
 from .benchmark_data import BenchmarkDataManager
-import numpy as np
+# The other modules, e.g. the storage backends and benchmarks, are imported by the
+# methods that use them, so that importing the package stays light
 
-from .utils import dbclient_tunnel
 
-
-def profile_function( fn, *args):
+def profile_function( fn, *args, **options):
         """
         Use the Profile context manager to record the runtime performance profile of a 
         users-suplied function
 
         Args:
             fn: A callable function that takes as many arguments as passed in '*args'
+            **options: Keyword arguments passed to ResourceProfiler, e.g. trace_path, 
+                except phase_path, the file to keep the phase markers in.
             
         Returns:
             rprof: An object with a list of arrays, each one representing a runtime 
-            profile of a performance variable
+            profile of a performance variable, with the phases marked during the 
+            run (see benchmark.phases) in rprof.phases
 
         Raises:
             Exception: If fn(*args) raises for any values.
         """
-
-        with ResourceProfiler(dt=0.1) as rprof:
-            fn(*args)
+        from .phases import recording
+
+        phase_path = options.pop('phase_path', None)
+        options.setdefault('dt', 0.1)
+        with recording(phase_path) as phases:
+            with ResourceProfiler(**options) as rprof:
+                fn(*args)
+        rprof.phases = phases
         return rprof
 
 
-def profile_script( cl_arg, *args):
+def profile_script( cl_arg, *args, **options):
         """
         Use the Profile context manager to record the runtime performance profile of a 
         users-suplied script
+
+        Args:
+            cl_arg: The command line to run in a shell.
+            **options: Keyword arguments passed to ResourceProfiler, e.g. trace_path, 
+                except log_path, log_tail and log_parsers, which are passed to 
+                _run_script, and phase_path as for profile_function.
+
+        Returns:
+            rprof: As for profile_function, with the last lines of output of the 
+            script in rprof.log and its exit code in rprof.returncode
         """
+        from .phases import recording
+
+        log_options = _log_options(options)
+        phase_path = options.pop('phase_path', None)
+        options.setdefault('dt', 0.1)
+        env = dict(os.environ)
+        with recording(phase_path, env) as phases:
+            with ResourceProfiler(**options) as rprof:
+                capture, log_phases, returncode = _run_script(cl_arg, env=env, **log_options)
+        rprof.log = list(capture.tail)
+        rprof.returncode = returncode
+        rprof.phases = sorted(phases + log_phases, key=lambda p: p.start)
+        return rprof
+
+
+def _log_options( options ):
+        """Remove the LogCapture options from the keyword arguments of a profiler"""
+        return dict((key, options.pop(key)) for key in ('log_path', 'log_tail', 'log_parsers')
+                    if key in options)
+
+
+def _run_script( cl_arg, log_path=None, log_tail=100, log_parsers=(), env=None ):
+        """Run a command line, streaming its output line by line to the console and to 
+        log_path, and find the phases in it with log_parsers (see benchmark.logparse).  
+        env is the environment of the command, by default that of this process.
+
+        Returns:
+            tuple: The LogCapture, the list of phases found in the output and the exit 
+            code of the command.
+        """
+        from .logcapture import LogCapture
+        from .logparse import get_parser
+
+        parsers = [get_parser(parser) for parser in log_parsers or ()]
+        phases = []
+
+        def parse(line):
+            for parser in parsers:
+                phases.extend(parser.feed(line))
+
+        for parser in parsers:
+            parser.reset()
+        capture = LogCapture(path=log_path, tail=log_tail, handler=parse if parsers else None)
+        returncode = capture.run(cl_arg, env=env)
+        for parser in parsers:
+            phases.extend(parser.close())
+        return capture, phases, returncode
+
+
+def _allotted_cores():
+        """Number of cores the current process may run on, limited by the CPU quota of 
+        its cgroup"""
+        from .cgroup import CgroupSampler
+
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            import multiprocessing
+            cores = multiprocessing.cpu_count()
+        if CgroupSampler.available():
+            quota = CgroupSampler().cpu_quota()
+            if quota:
+                return min(cores, quota)
+        return cores
+
+
+# Persistent resource profilers of a session worker process, keyed by their options
+_worker_profilers = {}
+
+
+def _worker_profiler( options ):
+        """Return the worker's persistent ResourceProfiler for these options, so its 
+        tracker is reused across executions"""
+        options = dict(options, persistent=True)
+        options.setdefault('dt', 0.1)
+        key = repr(sorted(options.items()))
+        rprof = _worker_profilers.get(key)
+        if rprof is None:
+            rprof = _worker_profilers[key] = ResourceProfiler(**options)
+        return rprof
+
+
+def _session_function( options, fn, *args ):
+        from .phases import recording
 
-        with ResourceProfiler(dt=0.1) as rprof:
-            proc = subprocess.Popen(cl_arg, stdout=subprocess.PIPE, stderr = subprocess.PIPE, shell=True)
-            out, err = proc.communicate()
-            print( out, err )
+        options = dict(options)
+        phase_path = options.pop('phase_path', None)
+        with recording(phase_path) as phases:
+            with _worker_profiler(options) as rprof:
+                fn(*args)
+        rprof.phases = phases
         return rprof
 
+
+def _session_script( options, cl_arg ):
+        from .phases import recording
+
+        options = dict(options)
+        log_options = _log_options(options)
+        phase_path = options.pop('phase_path', None)
+        env = dict(os.environ)
+        with recording(phase_path, env) as phases:
+            with _worker_profiler(options) as rprof:
+                capture, log_phases, returncode = _run_script(cl_arg, env=env, **log_options)
+        rprof.log = list(capture.tail)
+        rprof.returncode = returncode
+        rprof.phases = sorted(phases + log_phases, key=lambda p: p.start)
+        return rprof
+
+
 class Profiler:
     """
     Profiling for Astronomy Pipelines
@@ -60,50 +180,144 @@ class Profiler:
             information that is not automatically included.  Will be passed as-is to 
             the database.  Defaults to empty string.
         profile (boolean, optional): Turn off runtime profiling.  Defaults to True. 
-        dt_profile (float, optional): Change the profiling time interval.  Defaults to 
-            1 second.
+        dt_profile (float, optional): Change the profiling time interval, unless 
+            profile_options sets 'dt'.  Defaults to 0.1 seconds.
+        profile_options (dict, optional): Extra keyword arguments for the 
+            ResourceProfiler of each execution, e.g. {'adaptive': True} or 
+            {'cheap': True}.  Defaults to None.
+        backend (str, optional): 'process' runs each execution in a fresh worker 
+            process with a separate tracker process.  'thread' runs it in the calling 
+            process with a tracker thread, which has far less start-up cost for short 
+            functions.  Defaults to 'process'.
+        cores (int, optional): Number of cores allotted to the task, used for the CPU 
+            efficiency.  Defaults to the CPU affinity of the current process.
+        trace_path (str, optional): Record the resource samples of each execution to 
+            this trace file as they are taken, see Profiler.load_trace.  In a session, 
+            the executions after the first of a worker go to <trace_path>.1, .2, ... 
+            (see ResourceProfiler).  Defaults to None.
+        log_path (str, optional): Append the output of scripts to this file as it is 
+            written, each line stamped with the time it was written (see 
+            benchmark.logcapture).  Defaults to None.
+        log_tail (int, optional): Number of final output lines of a script kept in 
+            Profiler.log and written to the database.  Defaults to 100.
+        container_runtime (str, optional): Command that runs a program in the container, 
+            called as '<container_runtime> <container_path> <exec_path> <script>'.  
+            Defaults to 'singularity exec'.
+        phase_path (str, optional): Also keep the phase markers of each execution in 
+            this file (see benchmark.phases), which is emptied when the execution 
+            starts.  By default they are recorded in a temporary file.  Defaults to 
+            None.
+        log_parsers (list, optional): Parsers that find phases in the output of 
+            scripts, e.g. ['casa'] or ['wsclean'] or benchmark.logparse.RegexParser 
+            objects.  Defaults to None.
+        host_benchmark (bool or dict, optional): Measure the memory bandwidth and
+            compute throughput of the node and attach them to every record, see
+            characterize_host.  A dict holds options of HostBenchmark.  Defaults to None.
+        storage (str or StorageBackend, optional): Where write_to_database writes, 
+            e.g. 'mongo', 'sqlite:results.db' or 'csv:results.csv' (see 
+            benchmark.storage).  Defaults to $BENCHMARK_STORAGE, or 'mongo'.
 
     """
     
-    bench_dict = {}
     path_out = "sysinfo.csv"
+    # Number of most sampled Python stacks written to the database
+    max_stacks = 100
     fieldnames = ['Date', 'Time', 'TestID', 'RunTime', 'Container', 'DDIOTestSize (MB)', 
                   'DDIORead (MB/s)', 'DDIOWrite (MB/s)', 'Architecture', 'CPU(s)',
                   'Thread(s) per core', 'CPU MHz', 'MemAvailable', 'MemFree', 'Description', 
                   'MemMax', 'MemMean', 'MemTot', 'CPUMax', 'CPUMean', 'IOMeanR', 'IOMeanW', 
-                  'IOTotR', 'IOTotW']
+                  'IOTotR', 'IOTotW', 'SampleRate', 'SampleCost', 'CPUUser', 'CPUSystem',
+                  'CPUEfficiency', 'IOWaitMean', 'CtxVol', 'CtxInvol', 'ThreadsMax',
+                  'CgroupMemMax', 'CgroupMemLimit', 'CgroupFileMax', 'CgroupCPU',
+                  'CgroupThrottled', 'CgroupThrottleTime', 'CgroupIOTotR', 'CgroupIOTotW',
+                  'ContainerStartup', 'PayloadTime', 'Repetitions', 'RunTimeMAD',
+                  'RunTimeCILow', 'RunTimeCIHigh', 'SweepID', 'SweepPoint',
+                  'IORandRead (IOPS)', 'IORandReadP99 (ms)', 'IORandWrite (IOPS)',
+                  'IOMmapRead (MB/s)', 'IOFsync (ms)', 'IOParallelRead (MB/s)',
+                  'IOParallelWrite (MB/s)', 'StreamTriad1 (MB/s)', 'StreamTriadAll (MB/s)',
+                  'Gemm1 (GFLOP/s)', 'GemmAll (GFLOP/s)', 'FFTAll (GFLOP/s)', 'MemLatency (ns)',
+                  'NormRunTime', 'HostID', 'Hostname', 'CPUModel', 'Sockets', 'NUMANodes',
+                  'Kernel', 'ContainerDigest', 'ExitCode']
                   # 'Core(s) per socket', 'Socket(s)', 'Model', 'Model name', 
     
-    def __init__(self, container_path = None, exec_path = "python", testid = "", description = "", profile=True, dt_profile=1.0):
+    def __init__(self, container_path = None, exec_path = "python", testid = "", description = "", profile=True, dt_profile=None, trace_path=None, profile_options=None, backend='process', cores=None, container_runtime='singularity exec', log_path=None, log_tail=100, phase_path=None, log_parsers=None, host_benchmark=None, storage=None):
+        from .hostinfo import fingerprint
+
+        self.bench_dict = {}
+        self.hostinfo = fingerprint()
         self.bench_dict.update(self._sysinfo())
         self.bench_dict.update(self._meminfo())
         self.graphs = []
         self.stats = {}
+        self.top_processes = {}
+        self.log = []
+        self.phases = []
+        self.stacks = []
+        self.allocations = {}
+        self.io = []
+        self.host = {}
+        self.repetition = None
+        self.scaling = None
+        # Exit code of the last script run by execute_script
+        self.exit_code = None
 
         # Set test properties
         self.container_path = container_path
+        self.container_runtime = container_runtime
+        self.log_path = log_path
+        self.log_tail = log_tail
+        self.phase_path = phase_path
+        self.log_parsers = log_parsers or []
         self.exec_path = exec_path
         self.testid = testid
         self.description = description
         self.do_profile = profile
         self.dt_profile = dt_profile
+        self.trace_path = trace_path
+        self.profile_options = profile_options or {}
+        self.backend = backend
+        self.cores = cores
+        self._executor = None
 
-        self.collection = dbclient_tunnel()
+        if host_benchmark:
+            self.characterize_host(**(host_benchmark if isinstance(host_benchmark, dict) else {}))
+
+        # Resolved on first use, see storage
+        self.storage = storage
 
         
-    def _sysinfo(self):
-        """Capture environment system information"""
-        sys = subprocess.check_output(['lscpu'])
-        sys_info = sys.split(b'\n')
-        sys_dict = {}
-        for info in sys_info[:-1]:
-            field, data = info.split(b":")
-            sys_dict[field] = data.strip()
+    @property
+    def storage(self):
+        """Backend the records are written to, from the storage spec given"""
+        if self._backend is None:
+            from .storage import get_backend
 
-        return sys_dict
+            self._backend = get_backend(self._storage)
+        return self._backend
+
+    @storage.setter
+    def storage(self, storage):
+        self._storage = storage
+        self._backend = None
+
+    def _sysinfo(self):
+        """Capture environment system information from the host fingerprint"""
+        info = self.hostinfo
+        return {'Architecture': info['architecture'],
+                'CPU(s)': info['cpus'],
+                'Thread(s) per core': info['threads_per_core'],
+                'CPU MHz': info['cpu_mhz'],
+                'CPUModel': info['cpu_model'],
+                'Sockets': info['sockets'],
+                'NUMANodes': info['numa_nodes'],
+                'Kernel': info['kernel'],
+                'Hostname': info['hostname'],
+                'HostID': info['host_id']}
 
     def _meminfo(self):
         """Capture environment memory information"""
+        from .cgroup import CgroupSampler
+
         file_handler = open('/proc/meminfo', 'r')
         mem_info = file_handler.readlines()
         mem_dict = {}
@@ -112,123 +326,240 @@ class Profiler:
             field, data = info.split(":")
             mem_dict[field] = data.strip()
 
+        # /proc/meminfo is host-wide, a container may only get part of it
+        if CgroupSampler.available():
+            limit = CgroupSampler().sample().limit
+            if limit < float('inf'):
+                mem_dict['CgroupMemLimit'] = "{:.2f}".format(limit / 1e6)
+
         return mem_dict
 
-    def ddio_test(self, n=5, bs='100M'):
+    def ddio_test(self, n=5, bs='100M', path='.', **options):
         '''
-        Simulation of input/output using DD Read and Write
+        Benchmark the file system of path (see benchmark.iobench).
+
+        The DDIO fields hold the sequential throughput at the largest block size, 
+        with O_DIRECT where the file system supports it, and the IO fields the 
+        random, mmap, fsync and parallel results.  All results are written to the 
+        database with the next record.
+
+        Args:
+            n (int, optional): Runs of each test, the first is discarded.
+            bs (str, optional): Size of the test file, e.g. '100M'.
+            path (str, optional): Directory to test.
+            **options: Keyword arguments of IOBenchmark, e.g. block_sizes=['4k', '1M'], 
+                streams=8.
         '''
+        from .iobench import IOBenchmark, select
+
+        bench = IOBenchmark(path, size=bs, repeats=n, **options)
+        results = bench.run()
+        block_size = max(bench.block_sizes)
+        small = min(bench.block_sizes)
+        direct = select(results, 'seq_read', block_size, True) is not None
+
+        def field(test, key='throughput', block_size=block_size, direct=direct):
+            result = select(results, test, block_size, direct)
+            if result is None or 'error' in result:
+                return ''
+            value = result['latency'][key] if key in ('p50', 'p99') else result[key]
+            return "{:.2f}".format(value)
+
         self.update_bench_dict({"DDIOTestSize (MB)": bs})
-        ddio_dict = {}
-        write_times = []
-        call = 'rm testfile; dd if=/dev/zero of=testfile bs=' + bs + ' count=1 oflag=direct'
-        for i in range(1,n+1):
-            proc = subprocess.Popen(call, stdout=subprocess.PIPE,
-                    stderr = subprocess.PIPE, shell=True)
-            out, err = proc.communicate()
-            write_times.append(err.replace(' ','').split(',')[-1].replace('\n',''))
-        #first write time is removed
-        write_times = write_times[1:]
-        write_ave = self._ddio_mem_average(write_times)
-        self.update_bench_dict({"DDIOWrite (MB/s)": write_ave})
-        read_times = []
-        for i in range(1,n+1):
-            call = 'dd if=testfile of=/dev/null bs='+bs
-            proc = subprocess.Popen(call, stdout=subprocess.PIPE,
-                    stderr = subprocess.PIPE, shell=True)
-            out, err = proc.communicate()
-            read_times.append(err.replace(' ','').split(',')[-1].replace('\n',''))
-        #first read time is removed
-        read_times = read_times[1:]
-        read_ave = self._ddio_mem_average(read_times)
-        self.update_bench_dict({"DDIORead (MB/s)": read_ave})
-
-
-    def _ddio_mem_average(self, rw_times):
-        """Convert a list of values from ddio runtimes to an average with units MB/s"""
-        r_value = []
-        for i in rw_times:
-            if (i[-4] == 'k'):
-                r_value.append(float(i[:-4])*1024)
-            if (i[-4] == 'M'):
-                r_value.append(float(i[:-4])*(1024**2))
-            if (i[-4] == 'G'):
-                r_value.append(float(i[:-4])*(1024**3))
-            if (i[-4] == 'T'):
-                r_value.append(float(i[:-4])*(1024**4))
-        summ = 0.0
-        for k in r_value:
-            summ = summ + k  
-
-        ave_rw_time = summ/len(r_value)/(1024.**2)
-        return ("%0.2f" % ave_rw_time)
+        self.update_bench_dict({"DDIOWrite (MB/s)": field('seq_write')})
+        self.update_bench_dict({"DDIORead (MB/s)": field('seq_read')})
+        self.update_bench_dict({"IORandRead (IOPS)": field('rand_read', 'iops', small)})
+        self.update_bench_dict({"IORandReadP99 (ms)": field('rand_read', 'p99', small)})
+        self.update_bench_dict({"IORandWrite (IOPS)": field('rand_write', 'iops', small)})
+        self.update_bench_dict({"IOMmapRead (MB/s)": field('mmap_read', direct=False)})
+        self.update_bench_dict({"IOFsync (ms)": field('fsync', 'p50', 4 * 1024, False)})
+        self.update_bench_dict({"IOParallelRead (MB/s)": field('parallel_read')})
+        self.update_bench_dict({"IOParallelWrite (MB/s)": field('parallel_write')})
+        self.io = results
+        return results
+
+    def characterize_host(self, **options):
+        '''
+        Measure the memory bandwidth, compute throughput and memory latency of this 
+        node (see benchmark.hostbench) and attach them to every following record.
+
+        The measurements are taken once per process and options, later calls reuse 
+        them.
+
+        Args:
+            **options: Keyword arguments of HostBenchmark, e.g. all_cores=False.
+
+        Returns:
+            dict: The measurements, see HostBenchmark.run.
+        '''
+        from .hostbench import HostBenchmark
+
+        self.host = HostBenchmark(**options).cached()
+        for key, value in self.host.items():
+            if key in self.fieldnames:
+                self.update_bench_dict({key: "{:.2f}".format(value)})
+        return self.host
+
+    def normalized_runtime(self, reference, metric='StreamTriadAll (MB/s)'):
+        '''
+        Scale the RunTime of the last run to a reference node and store it as 
+        NormRunTime.
+
+        Args:
+            reference (dict): The characterize_host measurements of the reference node.
+            metric (str, optional): The measurement that limits the task, e.g. 
+                'GemmAll (GFLOP/s)' for compute bound tasks.
+
+        Returns:
+            float: The expected run time on the reference node.
+        '''
+        from .hostbench import normalized_runtime
+
+        if not self.host:
+            self.characterize_host()
+        norm = normalized_runtime(self.bench_dict['RunTime'], self.host, reference, metric)
+        self.update_bench_dict({'NormRunTime': "{:.3f}".format(norm)})
+        return norm
 
     def write_to_csv(self):
-        write = False
-        data = self.bench_dict
-        path = self.path_out
-        fieldnames = self.fieldnames
-        """Select write/append"""
-        if os.path.exists(path):
-            append_write = 'ab' # append if already exists
-        else:
-            append_write = 'wb' # make a new file if not
-            write = True
-        with open(path, append_write) as out_file:
-            writer = csv.DictWriter(out_file, delimiter=',', fieldnames=fieldnames, extrasaction='ignore')
-            if write:
-                writer.writeheader()
-                writer.writerow(data)
-            else:
-                writer.writerow(data)
+        """Append the fields of bench_dict to the CSV file path_out"""
+        from .storage import CSVBackend
+        CSVBackend(self.path_out, self.fieldnames).write(self.bench_dict)
 
     def write_to_database(self):
-        # write data to mongodb
+        """Write bench_dict and the detailed results to the storage backend"""
         data = self.bench_dict
         dbdict = {}
         for fn in self.fieldnames:
             dbdict[fn] = data.get(fn, '')
         dbdict['graphs'] = self.graphs
-        self.collection.insert_one( dbdict )
+        dbdict['processes'] = self.top_processes
+        dbdict['log'] = [list(line) for line in self.log]
+        dbdict['phases'] = self.phases
+        dbdict['stacks'] = self.stacks
+        dbdict['allocations'] = self.allocations
+        dbdict['repetition'] = self.repetition
+        dbdict['scaling'] = self.scaling
+        dbdict['io'] = self.io
+        dbdict['host'] = self.host
+        dbdict['hostinfo'] = self.hostinfo
+        return self.storage.write( dbdict )
+
+
+    def compute_stats(self, top=5):
+        """Compute summary statistics of the profiled run and store them in bench_dict.
 
+        Args:
+            top (int, optional): Number of processes reported per resource in
+                top_processes.  Defaults to 5.
 
-    def compute_stats(self):
+        Returns:
+            dict: The statistics, including 'TopProcesses' which maps each of 'cpu' 
+            (CPU seconds), 'rmem', 'umem' (peak MB), 'rio' and 'wio' (MB) to the 
+            processes that used most of it, when the processes were sampled 
+            separately (profile_options={'per_process': True}).  The 'Cgroup' 
+            statistics are NaN, and the cgroup counters left out of graphs, unless the 
+            cgroup was sampled (profile_options={'cgroup': True}); the memory limit of 
+            the cgroup, 'CgroupMemLimit' (MB), is read when the Profiler is created 
+            and is only set if there is one.  'Phases' holds the statistics of each 
+            phase marked during the run, see _phase_stats, and 'StacksAtMemPeak' the 
+            Python stacks sampled while memory rose to its peak.  
+            'Allocations' holds the top allocation sites at the RSS peak ('peak'), 
+            those that grew the most during the run ('growth'), every snapshot and 
+            the time spent taking them ('cost'), for functions run with allocation 
+            tracing.
+        """
+        import numpy as np
 
-        # First store the graphs as a dictionary of arrays 
+        # Column arrays of the samples, stored as lists with the results, leaving out 
+        # the columns that were not sampled (all NaN), e.g. the cgroup counters 
+        # unless the cgroup was sampled
         res = self.results.results
-        rdata = {
-            't': [r.time for r in res],
-            'cpu': [r.cpu for r in res],
-            'pmem': [r.umem for r in res],
-            'rmem': [r.umem for r in res],
-            'umem': [r.umem for r in res],
-            'smem': [r.umem for r in res],
-            'rio': [r.rio for r in res],
-            'wio': [r.wio for r in res],
-            'nrio': [r.nrio for r in res],
-            'nwio': [r.nwio for r in res]
-
-        }
-        self.graphs = rdata
+        self.graphs = dict((c, res.column(c).tolist()) for c in res.columns
+                           if c == 'time' or not np.all(np.isnan(res.column(c))))
+        self.graphs['t'] = self.graphs.pop('time')
+
+        # USS is not sampled in cheap mode, fall back to RSS
+        mem_metric = 'umem'
+        if np.all(np.isnan(res.umem)):
+            mem_metric = 'rmem'
+        mem = res.column(mem_metric)
 
         # memory alocation integrated over time [MB * s]
-        t_diff = np.diff(rdata['t'])
-        tot_memory = np.sum([ v_i*t_i for v_i, t_i in zip(t_diff, rdata['umem'][1:])])
+        t_diff = np.diff(res.time)
+        tot_memory = np.sum(t_diff * mem[1:])
         
+        # Samples may be unevenly spaced (adaptive sampling), so means are weighted by 
+        # the time since the previous sample
+        duration = res.time[-1] - res.time[0]
+
         # Memory
-        max_memory = np.amax(rdata['umem'])
-        mean_memory = np.mean(rdata['umem'])
+        max_memory = np.amax(mem)
+        mean_memory = tot_memory / duration if duration > 0 else np.mean(mem)
         
         # mean cpu
-        mean_cpu = np.mean(rdata['cpu'])
-        max_cpu = np.amax(rdata['cpu'])
+        mean_cpu = np.sum(t_diff * res.cpu[1:]) / duration if duration > 0 else np.mean(res.cpu)
+        max_cpu = np.amax(res.cpu)
         
-        # mean IO Reads
-        mean_rio = np.average(list(np.diff(rdata['rio'])), axis=0, weights=1./t_diff)
-        mean_wio = np.average(list(np.diff(rdata['wio'])), axis=0, weights=1./t_diff)
+        # mean IO Reads and Writes [MB/s]
+        mean_rio = (res.rio[-1] - res.rio[0]) / duration if duration > 0 else 0.
+        mean_wio = (res.wio[-1] - res.wio[0]) / duration if duration > 0 else 0.
         
-        tot_rio = rdata['rio'][-1] - rdata['rio'][0]
-        tot_wio = rdata['wio'][-1] - rdata['wio'][0]
+        tot_rio = res.rio[-1] - res.rio[0]
+        tot_wio = res.wio[-1] - res.wio[0]
+
+        # Largest consumers of each resource among the sampled processes
+        self.top_processes = dict((metric, self.results.top_processes(metric, top))
+                                  for metric in ('cpu', 'rmem', 'umem', 'rio', 'wio'))
+
+        # CPU time split and efficiency: CPU-seconds / (wall time * allotted cores)
+        cpu_user = res.utime[-1] - res.utime[0]
+        cpu_system = res.stime[-1] - res.stime[0]
+        cores = self.cores or _allotted_cores()
+        cpu_efficiency = (cpu_user + cpu_system) / (duration * cores) if duration > 0 else 0.
+        mean_iowait = np.sum(t_diff * res.iowait[1:]) / duration if duration > 0 else 0.
+        ctx_vol = res.ctx_vol[-1] - res.ctx_vol[0]
+        ctx_invol = res.ctx_invol[-1] - res.ctx_invol[0]
+        max_threads = np.amax(res.threads)
+
+        # System-wide mean utilisation of each core [%]
+        core_mean = []
+        cores_res = self.results.core_results
+        if cores_res is not None and len(cores_res) > 1:
+            core_t = np.diff(cores_res.time)
+            core_mean = [float(np.sum(core_t * cores_res.column(c)[1:]) / np.sum(core_t))
+                         for c in cores_res.columns[1:]]
+
+        # Accounting of the cgroup the task ran in: memory including page cache, the 
+        # fraction of CFS periods in which the CPU quota throttled it, and block I/O
+        cg_mem_max = np.nanmax(res.cg_mem) if not np.all(np.isnan(res.cg_mem)) else np.nan
+        cg_file_max = np.nanmax(res.cg_file) if not np.all(np.isnan(res.cg_file)) else np.nan
+        cg_cpu = res.cg_cpu[-1] - res.cg_cpu[0]
+        cg_periods = res.cg_periods[-1] - res.cg_periods[0]
+        cg_throttled = (res.cg_throttled[-1] - res.cg_throttled[0]) / cg_periods if cg_periods > 0 else np.nan
+        cg_throttle_time = res.cg_throttle_time[-1] - res.cg_throttle_time[0]
+        cg_rio = res.cg_rio[-1] - res.cg_rio[0]
+        cg_wio = res.cg_wio[-1] - res.cg_wio[0]
+
+        # Statistics of the phases marked during the run
+        self.phases = self._phase_stats(res, self.results.phases, mem_metric)
+
+        # Python code running while memory rose to its peak, and the most sampled 
+        # stacks of the run, if stacks were sampled (profile_options={'stack_interval': dt})
+        peak_stacks = self.results.peak_stacks(mem_metric, top)
+        if self.results.stacks is not None:
+            self.stacks = [{'stack': stack, 'count': count}
+                           for stack, count in self.results.stacks.collapsed()[:self.max_stacks]]
+
+        # Python allocation sites at the RSS peak and those that grew the most, if 
+        # allocations were traced (profile_options={'allocation_interval': dt})
+        tracer = self.results.allocations
+        if tracer is not None:
+            self.allocations = {'peak': tracer.peak, 'growth': tracer.growth,
+                                'snapshots': tracer.snapshots, 'cost': tracer.cost}
+
+        # Achieved sampling rate and the tracker's own cost per sample
+        sampling = self.results.sampling_stats()
         
         self.update_bench_dict({"MemMax": "{:.2f}".format(max_memory)})
         self.update_bench_dict({"MemMean": "{:.2f}".format(mean_memory)})
@@ -242,6 +573,25 @@ class Profiler:
         
         self.update_bench_dict({"IOTotR": "{:.2f}".format(tot_rio)})
         self.update_bench_dict({"IOTotW": "{:.2f}".format(tot_wio)})
+
+        self.update_bench_dict({"SampleRate": "{:.2f}".format(sampling['rate'])})
+        self.update_bench_dict({"SampleCost": "{:.6f}".format(sampling['mean_cost'])})
+
+        self.update_bench_dict({"CPUUser": "{:.2f}".format(cpu_user)})
+        self.update_bench_dict({"CPUSystem": "{:.2f}".format(cpu_system)})
+        self.update_bench_dict({"CPUEfficiency": "{:.3f}".format(cpu_efficiency)})
+        self.update_bench_dict({"IOWaitMean": "{:.2f}".format(mean_iowait)})
+        self.update_bench_dict({"CtxVol": "{:.0f}".format(ctx_vol)})
+        self.update_bench_dict({"CtxInvol": "{:.0f}".format(ctx_invol)})
+        self.update_bench_dict({"ThreadsMax": "{:.0f}".format(max_threads)})
+
+        self.update_bench_dict({"CgroupMemMax": "{:.2f}".format(cg_mem_max)})
+        self.update_bench_dict({"CgroupFileMax": "{:.2f}".format(cg_file_max)})
+        self.update_bench_dict({"CgroupCPU": "{:.2f}".format(cg_cpu)})
+        self.update_bench_dict({"CgroupThrottled": "{:.3f}".format(cg_throttled)})
+        self.update_bench_dict({"CgroupThrottleTime": "{:.2f}".format(cg_throttle_time)})
+        self.update_bench_dict({"CgroupIOTotR": "{:.2f}".format(cg_rio)})
+        self.update_bench_dict({"CgroupIOTotW": "{:.2f}".format(cg_wio)})
         
         rstats = {"MemMax": max_memory,
                   "MemMean": mean_memory,
@@ -251,64 +601,169 @@ class Profiler:
                   "IOMeanR": mean_rio,
                   "IOMeanW": mean_wio,
                   "IOTotR": tot_rio,
-                  "IOTotW": tot_wio}
+                  "IOTotW": tot_wio,
+                  "SampleRate": sampling['rate'],
+                  "SampleCost": sampling['mean_cost'],
+                  "CPUUser": cpu_user,
+                  "CPUSystem": cpu_system,
+                  "CPUEfficiency": cpu_efficiency,
+                  "IOWaitMean": mean_iowait,
+                  "CtxVol": ctx_vol,
+                  "CtxInvol": ctx_invol,
+                  "ThreadsMax": max_threads,
+                  "CoreMean": core_mean,
+                  "CgroupMemMax": cg_mem_max,
+                  "CgroupFileMax": cg_file_max,
+                  "CgroupCPU": cg_cpu,
+                  "CgroupThrottled": cg_throttled,
+                  "CgroupThrottleTime": cg_throttle_time,
+                  "CgroupIOTotR": cg_rio,
+                  "CgroupIOTotW": cg_wio,
+                  "TopProcesses": self.top_processes,
+                  "Phases": self.phases,
+                  "StacksAtMemPeak": peak_stacks,
+                  "Allocations": self.allocations}
         
         return rstats
 
+    def _phase_stats(self, res, phases, mem_metric='rmem'):
+        """Split the samples of a run by phase.
+
+        Cumulative counters are interpolated to the phase boundaries, so phases 
+        shorter than the sampling interval still get their share of CPU time and I/O.
+
+        Args:
+            res (SampleBuffer): ResourceData samples of the run.
+            phases (list of Phase): Phases marked during the run.
+            mem_metric (str, optional): Memory column for MemMax, the one the run's 
+                MemMax uses.  Defaults to 'rmem'.
+
+        Returns:
+            list: A dict per phase that overlaps the run with its 'Name', 'Start' 
+            (seconds since the first sample), 'Duration' (s), 'CPUTime' (CPU seconds), 
+            'CPUMean' (%), 'MemMax' (MB, as the run's MemMax), 'IOTotR' and 'IOTotW' 
+            (MB).
+        """
+        import numpy as np
+
+        stats = []
+        if len(res) < 2:
+            return stats
+        t = res.time
+        cpu_time = res.utime + res.stime
+        series = res.column(mem_metric)
+        for phase in phases:
+            # A phase that never ended lasts until the end of the run
+            start = max(phase.start, t[0])
+            end = min(t[-1] if phase.end is None else phase.end, t[-1])
+            if end < start:
+                continue
+            duration = end - start
+            inside = (t >= start) & (t <= end)
+            mem = np.concatenate((series[inside], np.interp([start, end], t, series)))
+            used = np.interp(end, t, cpu_time) - np.interp(start, t, cpu_time)
+            stats.append({"Name": phase.name,
+                          "Start": start - t[0],
+                          "Duration": duration,
+                          "CPUTime": used,
+                          "CPUMean": 100. * used / duration if duration > 0 else 0.,
+                          "MemMax": float(np.amax(mem)),
+                          "IOTotR": np.interp(end, t, res.rio) - np.interp(start, t, res.rio),
+                          "IOTotW": np.interp(end, t, res.wio) - np.interp(start, t, res.wio)})
+        return stats
+
 
     def execute_script(self, script_name ):
+        """Run and profile a script, inside the container if container_path is set.
+
+        A containerised run is profiled in the same way as a plain one.  The time the 
+        container runtime takes to start a container that does nothing is measured 
+        first and stored as ContainerStartup, and PayloadTime is the run time minus 
+        that start-up overhead.
+
+        Args:
+            script_name (str): The script and its arguments, appended to exec_path.
+
+        Returns:
+            bool: True if successful, False if the script exited with a non-zero code 
+            or the container does not exist.  The exit code is stored in exit_code and 
+            ExitCode.
+        """
+        import concurrent.futures
+        from .hostinfo import image_digest
 
         self.bench_dict["TestID"] = self.testid
         self.bench_dict["Description"] = self.description
         self.bench_dict["Time"] = datetime.now().strftime('%H:%M:%S')
         self.bench_dict["Date"] = datetime.now().strftime('%Y-%m-%d')
+        self.repetition = None
+        self.scaling = None
+        self.exit_code = None
 
         if self.container_path:
-            if os.path.isfile(self.container_path):
-                self.update_bench_dict({"Container": self.container_path.split("/")[-1]})
-
-                args = 'singularity exec'
-                args += ' ' + self.container_path + ' ' + self.exec_path + ' ' + script_name
-                print( "Exectuing command: " + args )
-
-                time_start = datetime.now()
-                proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr = subprocess.PIPE, shell=True)
-                out, err = proc.communicate()
-                time_end = datetime.now()
-
-                time_diff = time_end - time_start
-                test_time = "{:.3f}".format( (time_diff.seconds + time_diff.microseconds / 1000000.) )
-                self.update_bench_dict({'RunTime': test_time })
-                print( 'Test finished - RunTime (s): ' + test_time )
-                print( out, err )
-                return True
-            else:
+            if not os.path.isfile(self.container_path):
                 return False
+            self.update_bench_dict({"Container": self.container_path.split("/")[-1]})
+            self.update_bench_dict({"ContainerDigest": image_digest(self.container_path)})
+            startup = self._container_startup()
+            args = self.container_runtime + ' ' + self.container_path + ' ' + self.exec_path + ' ' + script_name
         else:
+            startup = 0.
+            self.update_bench_dict({"ContainerDigest": self._own_container_digest()})
             args = self.exec_path + ' ' + script_name
-            print( "Exectuing command: " + args )
-
-            time_start = datetime.now()
-            if self.do_profile:
-                with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
-                    result = executor.submit( profile_script, args ).result()
-            else:
-                proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr = subprocess.PIPE, shell=True)
-                out, err = proc.communicate()
-                print( out, err )
-                result = None
-            time_end = datetime.now()
-
-            time_diff = time_end - time_start
-            test_time = "{:.3f}".format( (time_diff.seconds + time_diff.microseconds / 1000000.) )
-            print( 'Test finished - RunTime (s): ' + test_time )
-            self.bench_dict["Runtime"] = test_time
-            
-            # Compute and store graphs and stats
-            self.results = result
+        print( "Exectuing command: " + args )
+
+        time_start = datetime.now()
+        options = dict(self._profile_options(), log_path=self.log_path, log_tail=self.log_tail,
+                       log_parsers=self.log_parsers)
+        if self.do_profile and self._executor is not None:
+            result = self._executor.submit( _session_script, options, args ).result()
+        elif self.do_profile and self.backend == 'thread':
+            result = profile_script( args, **options )
+        elif self.do_profile:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit( profile_script, args, **options ).result()
+        else:
+            capture, _, self.exit_code = _run_script(args, self.log_path, self.log_tail)
+            self.log = list(capture.tail)
+            result = None
+        time_end = datetime.now()
+
+        time_diff = time_end - time_start
+        run_time = time_diff.seconds + time_diff.microseconds / 1000000.
+        test_time = "{:.3f}".format( run_time )
+        print( 'Test finished - RunTime (s): ' + test_time )
+        self.update_bench_dict({'RunTime': test_time })
+        self.update_bench_dict({'ContainerStartup': "{:.3f}".format( startup )})
+        self.update_bench_dict({'PayloadTime': "{:.3f}".format( max(run_time - startup, 0.) )})
+
+        # Compute and store graphs and stats
+        self.results = result
+        if result is not None:
+            self.log = result.log
+            self.exit_code = result.returncode
             self.stats = self.compute_stats()
-            
-            return True 
+        self.update_bench_dict({'ExitCode': self.exit_code})
+        if self.exit_code != 0:
+            print( 'Script failed with exit code {}'.format( self.exit_code ) )
+
+        return self.exit_code == 0
+
+    def _own_container_digest(self):
+        """Digest of the container image this process runs in, if known"""
+        container = self.hostinfo.get('container')
+        return container and container.get('digest')
+
+    def _container_startup(self, n=1):
+        """Time in seconds to start and stop the container running a no-op command, the 
+        smallest of n runs"""
+        args = self.container_runtime + ' ' + self.container_path + ' true'
+        times = []
+        for i in range(n):
+            time_start = default_timer()
+            subprocess.call(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+            times.append(default_timer() - time_start)
+        return min(times)
 
 
     def distributed_function(self, function):
@@ -346,18 +801,28 @@ class Profiler:
         myprofile.execute_function( lambda: test_function(4), profile=True )
 
         """
+        import concurrent.futures
 
         self.update_bench_dict({"TestID": self.testid})
         self.update_bench_dict({"Description": self.description})
         self.update_bench_dict({"Container": os.environ.get('SINGULARITY_NAME')})
+        self.update_bench_dict({"ContainerDigest": self._own_container_digest()})
         self.bench_dict["Time"] = datetime.now().strftime('%H:%M:%S')
         self.bench_dict["Date"] = datetime.now().strftime('%Y-%m-%d')
+        self.repetition = None
+        self.scaling = None
+        self.exit_code = None
+        self.bench_dict.pop('ExitCode', None)
 
         # This is the context manager that runs the function
         time_start = datetime.now()
-        if self.do_profile:
+        if self.do_profile and self._executor is not None:
+            result = self._executor.submit( _session_function, self._profile_options(), function, *args ).result()
+        elif self.do_profile and self.backend == 'thread':
+            result = profile_function( function, *args, **self._profile_options() )
+        elif self.do_profile:
             with concurrent.futures.ProcessPoolExecutor() as executor:
-                result = executor.submit( profile_function, function, *args ).result()    
+                result = executor.submit( profile_function, function, *args, **self._profile_options() ).result()
         else:
             function(*args)
             result = None
@@ -368,12 +833,160 @@ class Profiler:
         print( 'Test finished - RunTime (s): ' + test_time )
 
         self.update_bench_dict({ 'RunTime': test_time })
+
+        # Compute and store graphs and stats
         self.results = result
+        if result is not None:
+            self.stats = self.compute_stats()
+
+        return True
+
+
+    def repeat(self, execute, *args, **options):
+        """Run an execution repeatedly and store the runs as one grouped result.
+
+        Warm-up runs are discarded, outliers rejected and the run time and every 
+        numeric statistic summarised (see benchmark.repetition).  bench_dict then 
+        holds the median of each statistic, the MAD and confidence interval of the 
+        run time and the number of Repetitions, and the grouped result is written to 
+        the database with the last run.
+
+        Args:
+            execute (method): execute_function or execute_script of this profiler.
+            *args: The arguments of execute.
+            **options: Keyword arguments of Repetition, e.g. warmup=1, runs=5, 
+                max_runs=30, rel_ci=0.02.
+
+        Returns:
+            dict: The grouped result, see Repetition.run.
 
+        ex.:
+        myprofile.repeat( myprofile.execute_function, test_function, runs=10 )
+        """
+        from .repetition import Repetition
+
+        repetition = Repetition(self, **options).run(execute, *args)
+        for key, summary in repetition['Metrics'].items():
+            if key in self.fieldnames:
+                self.update_bench_dict({key: "{:.2f}".format(summary['median'])})
+        run_time = repetition['RunTime']
+        self.update_bench_dict({'RunTime': "{:.3f}".format(run_time['median'])})
+        self.update_bench_dict({'RunTimeMAD': "{:.3f}".format(run_time['mad'])})
+        self.update_bench_dict({'RunTimeCILow': "{:.3f}".format(run_time['ci'][0])})
+        self.update_bench_dict({'RunTimeCIHigh': "{:.3f}".format(run_time['ci'][1])})
+        self.update_bench_dict({'Repetitions': repetition['Runs']})
+        self.repetition = repetition
+        return repetition
+
+    def scaling_study(self, run, counts=None, mode='strong', **options):
+        """Run a function or script over thread counts and compute its scaling.
+
+        The speedup, parallel efficiency and Karp-Flatt serial fraction of each 
+        count are written to the database with the last run (see 
+        benchmark.scaling), and can be plotted with profile_visualize.plot_scaling.
+
+        Args:
+            run (str or callable): A script command line with a {threads} field, 
+                run with execute_script, or a function called as run(threads).
+            counts (list of int, optional): Thread counts.  Defaults to powers of 
+                two up to the cores available.
+            mode (str, optional): 'strong' or 'weak' scaling.  Defaults to 'strong'.
+            **options: pin=False to not pin the runs to cores, and keyword 
+                arguments of Repetition, e.g. runs=3.
+
+        Returns:
+            dict: The scaling result, see ScalingStudy.run.
+
+        ex.:
+        myprofile.scaling_study( 'image_script_tclean.py --threads {threads}', counts=[1, 2, 4, 8] )
+        """
+        from .scaling import ScalingStudy
+
+        scaling = ScalingStudy(self, counts, mode, **options).run(run)
+        self.scaling = scaling
+        return scaling
+
+    def start_session(self, workers=1):
+        """Keep a pool of profiling workers alive across executions.
+
+        Until shutdown() is called, execute_function and execute_script run in these 
+        workers, and each worker reuses its resource tracker, instead of starting a 
+        new process pool and tracker for every call.  Functions must be picklable.
+
+        Args:
+            workers (int, optional): Number of worker processes.  Defaults to 1.
+        """
+        import concurrent.futures
+
+        self.shutdown()
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+    def shutdown(self):
+        """Stop the session workers started by start_session, with their trackers"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @contextmanager
+    def session(self, workers=1):
+        """Context manager around start_session and shutdown
+
+        ex.:
+        with myprofile.session():
+            for i in range(100):
+                myprofile.execute_function( test_function )
+        """
+        self.start_session(workers)
+        try:
+            yield self
+        finally:
+            self.shutdown()
+
+    def _profile_options(self):
+        """Keyword arguments for the ResourceProfiler of an execution, plus the 
+        phase_path taken by profile_function and profile_script"""
+        options = dict(self.profile_options)
+        options['backend'] = self.backend
+        if self.dt_profile is not None:
+            options.setdefault('dt', self.dt_profile)
+        if self.trace_path:
+            options['trace_path'] = self.trace_path
+        if self.phase_path:
+            options['phase_path'] = self.phase_path
+        return options
+
+    def load_trace(self, path):
+        """Load the resource samples of a (possibly interrupted) run from a trace file
+        and compute its statistics.
+
+        Args:
+            path (str): Trace file written by a profiler created with trace_path.
+
+        Returns:
+            dict: The statistics returned by compute_stats.
+        """
+        self.results = ResourceProfiler.from_trace(path)
         self.stats = self.compute_stats()
+        return self.stats
 
-        return True
+    def parse_log(self, path, parser='casa'):
+        """Add the phases found in a log file to the current run and recompute its 
+        statistics.
+
+        Args:
+            path (str): Log file written during the run, by LogCapture (see log_path) 
+                or by the logging tool itself.
+            parser (str or parser, optional): See log_parsers.  Defaults to 'casa'.
 
+        Returns:
+            list: The statistics of each phase of the run, see _phase_stats.
+        """
+        from .logparse import parse_file
+
+        phases = self.results.phases + parse_file(parser, path)
+        self.results.phases = sorted(phases, key=lambda p: p.start)
+        self.stats = self.compute_stats()
+        return self.phases
 
     def visualize(self):
         self.results.visualize()
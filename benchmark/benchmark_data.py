@@ -1,18 +1,38 @@
 from __future__ import absolute_import, division, print_function
 
-from .utils import dbclient, dbclient_tunnel
-import collections
-import pymongo
+
+try:
+    from collections.abc import Iterable, Mapping
+except ImportError:
+    from collections import Iterable, Mapping
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
 
 
 class BenchmarkDataManager:
     
     benchmark_list = []
     
-    def __init__(self):
-        
-        self.collection = dbclient_tunnel()
-        self.colnames = self.getcolnames()
+    def __init__(self, storage=None):
+        '''
+        storage: backend or spec of the records to query, e.g. 'mongo' or 'sqlite:results.db' 
+        (see benchmark.storage), default $BENCHMARK_STORAGE or 'mongo'
+        '''
+        from .storage import get_backend
+
+        self.storage = get_backend(storage)
+        self._colnames = None
+
+    @property
+    def colnames(self):
+        # Queried on first use, not when the manager is created, and again while
+        # the store is empty
+        if not self._colnames:
+            self._colnames = self.getcolnames()
+        return self._colnames
     
     def query(self, query, sortby = False, columns = ['TestID', 'Description', 'Date', 'CPUMax', 'MemMax', 'IOTotW', 'IOTotR'], ascending = False, limit = 100):
         '''
@@ -22,42 +42,19 @@ class BenchmarkDataManager:
         ascending: boolean to set sortby ascending/descending
         limit: integer number of entries returned by the query, 0 for all
         '''   
-        coldict = {}
         if columns:
             colnames = self.getcolnames()
             for key in columns:
-                if key in colnames:
-                    coldict[key] = 1
-                else:
+                if not key in colnames:
                     print("Error:\tThe column list item: '{}'.\n\tThis is not a columns in this collection.".format(key))
                     return False
+        elif sortby:
+            if not(sortby in self.getcolnames()):
+                print("Error:\tThe sortby column provided was: '{}'.\n\tThis is not a columns in this collection.".format(sortby))
+                return False
 
-            if sortby:
-                if ascending:
-                    for result in self.collection.find(query,coldict).sort([(sortby, pymongo.ASCENDING)]).limit(limit):
-                        self.benchmark_list.append(result)
-                else:
-                    for result in self.collection.find(query,coldict).sort([(sortby, pymongo.DESCENDING)]).limit(limit):
-                        self.benchmark_list.append(result)
-            else:
-                for result in self.collection.find(query,coldict).limit(limit):
-                    self.benchmark_list.append(result)
-        else:
-            if sortby:
-                if not(sortby in self.getcolnames()):
-                    print("Error:\tThe sortby column provided was: '{}'.\n\tThis is not a columns in this collection.".format(sortby))
-                    return False
-
-                if ascending:
-                    for result in self.collection.find(query).sort([(sortby, pymongo.ASCENDING)]).limit(limit):
-                        self.benchmark_list.append(result)
-                else:
-                    for result in self.collection.find(query).sort([(sortby, pymongo.DESCENDING)]).limit(limit):
-                        self.benchmark_list.append(result)
-            else:
-                for result in self.collection.find(query).limit(limit):
-                    self.benchmark_list.append(result)
-
+        self.benchmark_list.extend(self.storage.query(query, columns=columns, sortby=sortby,
+                                                      ascending=ascending, limit=limit))
         return self.benchmark_list
     
     def getcolnames(self, query = {}):
@@ -68,18 +65,20 @@ class BenchmarkDataManager:
         query: dictionary of keys and values to search on 
         '''
         l = []
-        result = self.collection.find_one(query)
-        for key in result.keys():
+        results = self.storage.query(query, limit=1)
+        if not results:
+            return l
+        for key in results[0].keys():
             l.append(str(key))
         l.sort()
         return l
     
     def convert(self, data):
-        if isinstance(data, basestring):
+        if isinstance(data, string_types):
             return str(data)
-        elif isinstance(data, self.collections.Mapping):
-            return dict(map(self.convert, data.iteritems()))
-        elif isinstance(data, self.collections.Iterable):
+        elif isinstance(data, Mapping):
+            return dict(map(self.convert, data.items()))
+        elif isinstance(data, Iterable):
             return type(data)(map(self.convert, data))
         else:
             return data
@@ -87,7 +86,7 @@ class BenchmarkDataManager:
     def distinct(self, query):
         '''
         '''
-        return self.convert(self.collection.distinct(query))
+        return self.convert(self.storage.distinct(query))
     
     #def visualize():
         
@@ -0,0 +1,226 @@
+""" Resource accounting of a control group
+
+Processes run by Singularity, batch schedulers or systemd live in a control
+group (cgroup), and the kernel accounts for the group as a whole: its memory
+includes the page cache charged to it, it may have a memory limit well below
+the host's memory and a CPU quota that throttles it.  None of this is visible
+from the per-process counters in ``/proc``.
+
+``CgroupSampler`` reads these counters for one cgroup, on either the unified
+(v2) hierarchy or the per-controller (v1) hierarchies.
+
+Files read per tick:
+    v2                      v1
+    memory.current          memory/memory.usage_in_bytes
+    memory.max              memory/memory.limit_in_bytes
+    memory.stat             memory/memory.stat
+    cpu.stat                cpu/cpu.stat, cpuacct/cpuacct.usage
+    io.stat                 blkio/blkio.throttle.io_service_bytes
+
+A file that does not exist, e.g. because a controller is not enabled for the
+cgroup, is reported as NaN.
+
+Example:
+    sampler = CgroupSampler()
+    sample = sampler.sample()
+    print(sample.mem, sample.limit)
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+from collections import namedtuple
+
+NAN = float('nan')
+INF = float('inf')
+
+# Memory limits of v1 cgroups without a limit are a page-rounded LONG_MAX
+_V1_UNLIMITED = 2 ** 62
+
+# Counters of a cgroup at one tick.  Memory and I/O are in bytes and times in
+# seconds.  ``file`` is the page cache and ``anon`` the anonymous memory charged
+# to the cgroup, ``limit`` is inf without a memory limit.  All other fields are
+# cumulative: the CPU time used, the number of CFS enforcement periods, the
+# periods in which the cgroup was throttled and the time it spent throttled,
+# and the bytes read from and written to block devices.
+CgroupSample = namedtuple('CgroupSample', ('mem', 'limit', 'file', 'anon', 'cpu_time',
+                                           'nr_periods', 'nr_throttled', 'throttled_time',
+                                           'rio', 'wio'))
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_keyed(path):
+    """Read a flat ``key value`` file such as memory.stat or cpu.stat"""
+    values = {}
+    for line in _read(path).splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            values[fields[0].decode('ascii')] = int(fields[1])
+    return values
+
+
+def _read_int(path):
+    value = _read(path).strip()
+    if value == b'max':
+        return INF
+    return int(value)
+
+
+def process_cgroups(pid='self', procfs='/proc'):
+    """Return the cgroup paths of a process.
+
+    Returns:
+        dict: mapping each v1 controller to the path of the process's cgroup in
+        its hierarchy, and '' to its path in the v2 hierarchy.
+    """
+    paths = {}
+    for line in _read(os.path.join(procfs, str(pid), 'cgroup')).decode('utf-8').splitlines():
+        _, controllers, path = line.split(':', 2)
+        for controller in controllers.split(','):
+            paths[controller] = path
+    return paths
+
+
+class CgroupSampler(object):
+    """Sample the resource counters of a cgroup.
+
+    Args:
+        root (str, optional): Mount point of the cgroup filesystem.  Defaults
+            to '/sys/fs/cgroup'.
+        pid (int, optional): Sample the cgroup of this process.  Defaults to
+            the current process.
+        path (str, optional): Path of the cgroup below ``root`` (below each
+            controller's hierarchy for v1).  Defaults to the cgroup of ``pid``
+            as listed in ``/proc/<pid>/cgroup``.  A path that is not visible
+            under ``root``, as happens inside a container with its own cgroup
+            namespace or mount, falls back to the root cgroup.
+        procfs (str, optional): Mount point of the proc filesystem.  Defaults to
+            '/proc'.
+    """
+
+    def __init__(self, root='/sys/fs/cgroup', pid=None, path=None, procfs='/proc'):
+        self.root = root
+        self.version = 2 if os.path.exists(os.path.join(root, 'cgroup.controllers')) else 1
+        if path is None:
+            try:
+                paths = process_cgroups(pid or 'self', procfs)
+            except (IOError, OSError):
+                paths = {}
+        else:
+            paths = None
+        if self.version == 2:
+            self._dirs = {'': self._cgroup_dir(root, paths.get('', '/') if paths is not None else path)}
+        else:
+            self._dirs = {}
+            for controller in ('memory', 'cpu', 'cpuacct', 'blkio'):
+                hierarchy = os.path.join(root, controller)
+                self._dirs[controller] = self._cgroup_dir(
+                    hierarchy, paths.get(controller, '/') if paths is not None else path)
+
+    @staticmethod
+    def available(root='/sys/fs/cgroup'):
+        return (os.path.exists(os.path.join(root, 'cgroup.controllers')) or
+                os.path.isdir(os.path.join(root, 'memory')))
+
+    @staticmethod
+    def _cgroup_dir(hierarchy, path):
+        cgroup = os.path.join(hierarchy, path.lstrip('/'))
+        return cgroup if os.path.isdir(cgroup) else hierarchy
+
+    def _path(self, controller, name):
+        return os.path.join(self._dirs['' if self.version == 2 else controller], name)
+
+    def _get(self, reader, controller, name):
+        try:
+            return reader(self._path(controller, name))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _memory(self):
+        if self.version == 2:
+            mem = self._get(_read_int, 'memory', 'memory.current')
+            limit = self._get(_read_int, 'memory', 'memory.max')
+            stat = self._get(_read_keyed, 'memory', 'memory.stat') or {}
+            file_, anon = stat.get('file', NAN), stat.get('anon', NAN)
+        else:
+            mem = self._get(_read_int, 'memory', 'memory.usage_in_bytes')
+            limit = self._get(_read_int, 'memory', 'memory.limit_in_bytes')
+            if limit is not None and limit >= _V1_UNLIMITED:
+                limit = INF
+            stat = self._get(_read_keyed, 'memory', 'memory.stat') or {}
+            # the total_ counters include the child cgroups, like v2 does
+            file_ = stat.get('total_cache', stat.get('cache', NAN))
+            anon = stat.get('total_rss', stat.get('rss', NAN))
+        return (NAN if mem is None else mem, NAN if limit is None else limit, file_, anon)
+
+    def _cpu(self):
+        stat = self._get(_read_keyed, 'cpu', 'cpu.stat') or {}
+        if self.version == 2:
+            cpu_time = stat.get('usage_usec', NAN) / 1e6
+            throttled_time = stat.get('throttled_usec', NAN) / 1e6
+        else:
+            usage = self._get(_read_int, 'cpuacct', 'cpuacct.usage')
+            cpu_time = NAN if usage is None else usage / 1e9
+            throttled_time = stat.get('throttled_time', NAN) / 1e9
+        return (cpu_time, stat.get('nr_periods', NAN), stat.get('nr_throttled', NAN),
+                throttled_time)
+
+    def _io(self):
+        if self.version == 2:
+            try:
+                raw = _read(self._path('io', 'io.stat'))
+            except (IOError, OSError):
+                return NAN, NAN
+            rio = wio = 0
+            # one line per device: "8:0 rbytes=1 wbytes=2 rios=3 wios=4 ..."
+            for line in raw.splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition(b'=')
+                    if key == b'rbytes':
+                        rio += int(value)
+                    elif key == b'wbytes':
+                        wio += int(value)
+            return rio, wio
+        try:
+            raw = _read(self._path('blkio', 'blkio.throttle.io_service_bytes'))
+        except (IOError, OSError):
+            return NAN, NAN
+        rio = wio = 0
+        # one line per device and operation: "8:0 Read 4096", plus a "Total" line
+        for line in raw.splitlines():
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            if fields[1] == b'Read':
+                rio += int(fields[2])
+            elif fields[1] == b'Write':
+                wio += int(fields[2])
+        return rio, wio
+
+    def cpu_quota(self):
+        """Return the CPU quota of the cgroup in cores, or None without a quota"""
+        try:
+            if self.version == 2:
+                quota, period = _read(self._path('cpu', 'cpu.max')).split()
+                if quota == b'max':
+                    return None
+                return int(quota) / int(period)
+            quota = _read_int(self._path('cpu', 'cpu.cfs_quota_us'))
+            if quota < 0:
+                return None
+            return quota / _read_int(self._path('cpu', 'cpu.cfs_period_us'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def sample(self):
+        """Read the counters of the cgroup.
+
+        Returns:
+            CgroupSample
+        """
+        return CgroupSample(*(self._memory() + self._cpu() + self._io()))
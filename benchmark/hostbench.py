@@ -0,0 +1,253 @@
+""" Micro-benchmarks of the memory bandwidth and compute throughput of a host
+
+The CPU model and memory size of a node say little about how fast it runs a
+task.  ``HostBenchmark`` measures what the node delivers:
+
+    stream     STREAM-style copy, scale, add and triad with NumPy (MB/s)
+    gemm       dense matrix multiplication with NumPy/BLAS (GFLOP/s)
+    fft        complex FFT with NumPy (GFLOP/s, counted as 5 N log2 N)
+    latency    memory latency by chasing pointers through a random cycle (ns)
+
+on a single core and on all cores at once.  Each kernel runs in a fresh
+Python process with OMP_NUM_THREADS, OPENBLAS_NUM_THREADS and MKL_NUM_THREADS
+set to 1 and pinned to one core; for all cores one such process runs on every
+core at the same time and their throughputs are added, so the results do not
+depend on how the BLAS library of the node was built.
+
+NumPy computes the triad in two passes (a = s * c, then a += b), so it moves
+more data than the STREAM convention used for the bandwidths; compare triads
+with each other, not with the figures of the C STREAM benchmark.  The latency
+is measured from Python, with the interpreter's cost per step, measured on a
+working set that fits in the L1 cache, subtracted.
+
+``normalized_runtime`` scales a run time measured on one node to a reference
+node with the ratio of one of these measurements.
+
+Example:
+    host = HostBenchmark().run()
+    print(host['StreamTriadAll (MB/s)'], host['GemmAll (GFLOP/s)'])
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import math
+import multiprocessing
+import os
+import subprocess
+import sys
+from array import array
+from timeit import default_timer
+
+import numpy as np
+
+# Bytes moved per element by each STREAM kernel, by the STREAM convention
+STREAM_BYTES = {'Copy': 16, 'Scale': 16, 'Add': 24, 'Triad': 24}
+
+_THREAD_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# Results of this process, by options
+_cache = {}
+
+
+def _best(run, repeats):
+    times = []
+    for i in range(repeats):
+        tic = default_timer()
+        run()
+        times.append(default_timer() - tic)
+    return min(times)
+
+
+def stream(n, repeats):
+    """STREAM bandwidths in MB/s over arrays of n doubles, best of repeats"""
+    a = np.full(n, 1.)
+    b = np.full(n, 2.)
+    c = np.zeros(n)
+    s = 3.
+
+    def triad():
+        np.multiply(c, s, out=a)
+        np.add(a, b, out=a)
+
+    kernels = (('Copy', lambda: np.copyto(c, a)),
+               ('Scale', lambda: np.multiply(c, s, out=b)),
+               ('Add', lambda: np.add(a, b, out=c)),
+               ('Triad', triad))
+    return dict((name, STREAM_BYTES[name] * n / _best(kernel, repeats) / 1e6)
+                for name, kernel in kernels)
+
+
+def gemm(n, repeats):
+    """GFLOP/s of the product of two n x n matrices"""
+    a = np.random.RandomState(0).rand(n, n)
+    b = np.random.RandomState(1).rand(n, n)
+    return 2. * n ** 3 / _best(lambda: np.dot(a, b), repeats) / 1e9
+
+
+def fft(n, repeats):
+    """GFLOP/s of a complex FFT of length n"""
+    x = np.random.RandomState(0).rand(n) + 1j
+    return 5. * n * math.log(n, 2) / _best(lambda: np.fft.fft(x), repeats) / 1e9
+
+
+def _chase(nxt, steps):
+    i = 0
+    tic = default_timer()
+    for _ in range(steps):
+        i = nxt[i]
+    return (default_timer() - tic) / steps
+
+
+def _cycle(n, seed=0):
+    # Visit the elements in a random order: link each element of a random
+    # permutation to the next one, and the last back to the first
+    order = np.random.RandomState(seed).permutation(n)
+    nxt = np.empty(n, dtype=np.dtype('l'))
+    nxt[order[:-1]] = order[1:]
+    nxt[order[-1]] = order[0]
+    del order
+    # One load per step from a flat array, unlike a list of int objects.  The
+    # C longs are copied as bytes, a list of them would take several GB.
+    return array('l', nxt.tobytes())
+
+
+def latency(size, steps):
+    """Load-to-load latency in ns through a random cycle over size bytes"""
+    small = _cycle(512)
+    large = _cycle(size // 8)
+    base = min(_chase(small, steps) for i in range(3))
+    chased = min(_chase(large, steps) for i in range(3))
+    return max(chased - base, 0.) * 1e9
+
+
+KERNELS = {'stream': stream, 'gemm': gemm, 'fft': fft, 'latency': latency}
+
+
+def _worker(kernel, args, core=None):
+    env = dict(os.environ, **dict((v, '1') for v in _THREAD_VARIABLES))
+    # Run as a module of the package: run as a script, the package directory
+    # would come first on sys.path and its modules (e.g. trace) would shadow
+    # the standard library's
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([package_root] + [p for p in [env.get('PYTHONPATH')] if p])
+    cmd = [sys.executable, '-m', 'benchmark.hostbench', kernel, json.dumps(args)]
+    if core is not None:
+        cmd += [str(core)]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env)
+
+
+def _result(proc):
+    out, _ = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("Host benchmark worker failed with exit code {}".format(
+            proc.returncode))
+    return json.loads(out.decode())
+
+
+def _cores():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(multiprocessing.cpu_count()))
+
+
+class HostBenchmark(object):
+    """Measure the memory bandwidth, compute throughput and memory latency.
+
+    Args:
+        stream_size (int, optional): Elements of each STREAM array, large
+            enough to not fit in the caches.  Defaults to 2**24 (128 MiB).
+        gemm_size (int, optional): Size of the matrices.  Defaults to 1024.
+        fft_size (int, optional): Length of the FFT.  Defaults to 2**20.
+        latency_size (int, optional): Bytes of the pointer-chasing cycle.
+            Defaults to 256 MiB.
+        latency_steps (int, optional): Pointers chased.  Defaults to 10**6.
+        repeats (int, optional): The best of this many runs of each kernel
+            is kept.  Defaults to 5.
+        all_cores (bool, optional): Also run on all cores at once.  Defaults
+            to True.
+    """
+
+    def __init__(self, stream_size=2 ** 24, gemm_size=1024, fft_size=2 ** 20,
+                 latency_size=256 * 1024 ** 2, latency_steps=10 ** 6, repeats=5, all_cores=True):
+        self.stream_size = stream_size
+        self.gemm_size = gemm_size
+        self.fft_size = fft_size
+        self.latency_size = latency_size
+        self.latency_steps = latency_steps
+        self.repeats = repeats
+        self.all_cores = all_cores
+
+    def _args(self, kernel):
+        return {'stream': [self.stream_size, self.repeats],
+                'gemm': [self.gemm_size, self.repeats],
+                'fft': [self.fft_size, self.repeats],
+                'latency': [self.latency_size, self.latency_steps]}[kernel]
+
+    def _run(self, kernel, cores):
+        """Run a kernel on each core at once and add up the results"""
+        procs = [_worker(kernel, self._args(kernel), core) for core in cores]
+        results = [_result(proc) for proc in procs]
+        if isinstance(results[0], dict):
+            return dict((k, sum(r[k] for r in results)) for k in results[0])
+        return sum(results)
+
+    def run(self):
+        """Run the kernels on one core, then on all cores.
+
+        Returns:
+            dict: 'Cores' and for each measurement a field with the single core
+            ('1') and all cores ('All') result, e.g. 'StreamTriad1 (MB/s)',
+            'StreamTriadAll (MB/s)', 'Gemm1 (GFLOP/s)', 'FFTAll (GFLOP/s)' and
+            'MemLatency (ns)' (single core only).
+        """
+        cores = _cores()
+        runs = [('1', cores[:1])] + ([('All', cores)] if self.all_cores and len(cores) > 1 else [])
+        host = {'Cores': len(cores)}
+        for suffix, run_cores in runs:
+            for name, value in self._run('stream', run_cores).items():
+                host['Stream{}{} (MB/s)'.format(name, suffix)] = value
+            host['Gemm{} (GFLOP/s)'.format(suffix)] = self._run('gemm', run_cores)
+            host['FFT{} (GFLOP/s)'.format(suffix)] = self._run('fft', run_cores)
+        if len(cores) == 1:
+            # A single core is all cores
+            host.update(dict((k.replace('1 (', 'All ('), v) for k, v in list(host.items())
+                             if '1 (' in k))
+        host['MemLatency (ns)'] = self._run('latency', cores[:1])
+        return host
+
+    def cached(self):
+        """Run once per process and options, then return the same results"""
+        key = json.dumps(self.__dict__, sort_keys=True)
+        if key not in _cache:
+            _cache[key] = self.run()
+        return _cache[key]
+
+
+def normalized_runtime(run_time, host, reference, metric='StreamTriadAll (MB/s)'):
+    """Scale a run time to the reference node.
+
+    Args:
+        run_time (float): Run time measured on host.
+        host (dict): HostBenchmark results of the node of the run.
+        reference (dict): HostBenchmark results of the reference node.
+        metric (str, optional): The measurement that limits the task, e.g.
+            'StreamTriadAll (MB/s)' for memory bound tasks (the default) or
+            'GemmAll (GFLOP/s)' for compute bound ones.  For 'MemLatency (ns)'
+            lower is faster.
+
+    Returns:
+        float: The expected run time on the reference node.
+    """
+    if metric == 'MemLatency (ns)':
+        return float(run_time) * reference[metric] / host[metric]
+    return float(run_time) * host[metric] / reference[metric]
+
+
+if __name__ == '__main__':
+    # Worker: python -m benchmark.hostbench <kernel> <json arguments> [core]
+    if len(sys.argv) > 3 and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, [int(sys.argv[3])])
+    print(json.dumps(KERNELS[sys.argv[1]](*json.loads(sys.argv[2]))))
@@ -0,0 +1,253 @@
+""" Structured fingerprint of the host hardware and software
+
+``fingerprint`` describes the node a benchmark runs on with typed values: CPU
+model, sockets, cores, threads, NUMA nodes, cache and memory sizes in bytes,
+kernel, operating system and the container image this process runs in.  The
+values come from sysfs and procfs rather than parsing ``lscpu`` output.
+
+The hardware of a node does not change while it is up, so the fingerprint is
+collected once per boot and cached in a JSON file keyed by the kernel's boot
+ID; later processes on the same host read the file, and constructing a
+``Profiler`` does not start any subprocess.  The cache directory is
+``~/.cache/benchmark`` or ``$BENCHMARK_CACHE_DIR``, and the file name includes
+the host name, as home directories are often shared by the nodes of a cluster.
+
+``host_id`` hashes the hardware fields only, so records of identical nodes can
+be grouped.  ``image_digest`` is the SHA-256 of a container image file, cached
+by the image's path, size and modification time.
+
+Example:
+    info = fingerprint()
+    print(info['cpu_model'], info['sockets'], info['caches']['L3'], info['host_id'])
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import socket
+
+from .iobench import parse_size
+
+# Fields that identify the hardware of a host
+HARDWARE_FIELDS = ('architecture', 'cpu_model', 'sockets', 'cores_per_socket', 'threads_per_core',
+                   'cpus', 'numa_nodes', 'caches', 'memory')
+
+# Fingerprint of this process, once collected or read
+_fingerprint = None
+
+
+def cache_dir():
+    return os.environ.get('BENCHMARK_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'benchmark'))
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def _cpu_list(text):
+    """CPU numbers of a sysfs list like '0-3,8'"""
+    cpus = []
+    for part in (text or '').split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def boot_id():
+    """Identifier of the current boot of the host, None if unknown"""
+    return _read('/proc/sys/kernel/random/boot_id')
+
+
+def _cpuinfo():
+    info = {}
+    text = _read('/proc/cpuinfo', '')
+    for line in text.split('\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            info.setdefault(key.strip(), value.strip())
+    return info
+
+
+def _topology():
+    cpus = _cpu_list(_read('/sys/devices/system/cpu/online'))
+    packages, cores = set(), set()
+    for cpu in cpus:
+        base = '/sys/devices/system/cpu/cpu{}/topology/'.format(cpu)
+        package = _read(base + 'physical_package_id')
+        packages.add(package)
+        cores.add((package, _read(base + 'core_id', str(cpu))))
+    sockets = len(packages) or None
+    return {'cpus': len(cpus) or multiprocessing.cpu_count(),
+            'sockets': sockets,
+            'cores_per_socket': len(cores) // sockets if sockets else None,
+            'threads_per_core': len(cpus) // len(cores) if cores else None}
+
+
+def _caches():
+    caches = {}
+    for index in sorted(glob.glob('/sys/devices/system/cpu/cpu0/cache/index*')):
+        level = _read(os.path.join(index, 'level'))
+        kind = _read(os.path.join(index, 'type'), '')
+        size = _read(os.path.join(index, 'size'))
+        if level is None or size is None:
+            continue
+        name = 'L' + level + {'Data': 'd', 'Instruction': 'i'}.get(kind, '')
+        caches[name] = parse_size(size)
+    return caches
+
+
+def _memory():
+    for line in _read('/proc/meminfo', '').split('\n'):
+        if line.startswith('MemTotal:'):
+            return parse_size(line.split(':')[1].replace(' ', ''))
+    return None
+
+
+def _cpu_mhz(cpuinfo):
+    freq = _read('/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq')
+    if freq is not None:
+        return int(freq) / 1000.
+    mhz = cpuinfo.get('cpu MHz')
+    return float(mhz) if mhz else None
+
+
+def _os_release():
+    for line in _read('/etc/os-release', '').split('\n'):
+        if line.startswith('PRETTY_NAME='):
+            return line.split('=', 1)[1].strip('"')
+    return platform.platform()
+
+
+def _container(digests):
+    image = os.environ.get('SINGULARITY_CONTAINER') or os.environ.get('APPTAINER_CONTAINER')
+    if image:
+        return {'runtime': 'singularity', 'image': image,
+                'name': os.environ.get('SINGULARITY_NAME') or os.environ.get('APPTAINER_NAME'),
+                'digest': image_digest(image, digests) if os.path.isfile(image) else None}
+    if os.path.exists('/.dockerenv'):
+        return {'runtime': 'docker', 'image': None, 'name': socket.gethostname(),
+                'digest': None}
+    return None
+
+
+def host_id(info):
+    """Short hash of the hardware fields of a fingerprint"""
+    hardware = dict((k, info.get(k)) for k in HARDWARE_FIELDS)
+    return hashlib.sha1(json.dumps(hardware, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _collect():
+    cpuinfo = _cpuinfo()
+    info = {'hostname': socket.gethostname(),
+            'kernel': platform.release(),
+            'architecture': platform.machine(),
+            'cpu_model': cpuinfo.get('model name') or cpuinfo.get('cpu') or platform.processor(),
+            'cpu_mhz': _cpu_mhz(cpuinfo),
+            'numa_nodes': len(glob.glob('/sys/devices/system/node/node[0-9]*')) or None,
+            'caches': _caches(),
+            'memory': _memory(),
+            'boot_id': boot_id()}
+    info.update(_topology())
+    info['host_id'] = host_id(info)
+    return info
+
+
+def _cache_path():
+    return os.path.join(cache_dir(), 'hostinfo-{}.json'.format(socket.gethostname()))
+
+
+def _load_cache():
+    try:
+        with open(_cache_path()) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    path = _cache_path()
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp = '{}.{}'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, sort_keys=True)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        # e.g. a read-only home directory, collect again next time
+        pass
+
+
+def image_digest(path, digests=None):
+    """SHA-256 of a container image file.
+
+    Args:
+        path (str): The image file.
+        digests (dict, optional): Digests already computed, by path, size and
+            modification time.  Defaults to those in the cache file, which is
+            updated.
+    """
+    stat = os.stat(path)
+    key = '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, int(stat.st_mtime))
+    save = digests is None
+    if save:
+        cache = _load_cache()
+        digests = cache.setdefault('digests', {})
+    if key not in digests:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digests[key] = 'sha256:' + sha.hexdigest()
+        if save:
+            _save_cache(cache)
+    return digests[key]
+
+
+def fingerprint(cache=True):
+    """Fingerprint of this host.
+
+    The operating system and container are those of this process, which can
+    differ between processes on the same host, and are not cached.
+
+    Args:
+        cache (bool, optional): Read and write the fingerprint of the current
+            boot from the cache file.  Defaults to True.
+
+    Returns:
+        dict: 'hostname', 'kernel', 'os', 'architecture', 'cpu_model',
+        'cpu_mhz' (maximum frequency where known), 'sockets',
+        'cores_per_socket', 'threads_per_core', 'cpus' (online), 'numa_nodes',
+        'caches' (bytes by level, e.g. 'L1d', 'L2', 'L3'), 'memory' (bytes),
+        'container' (None, or its 'runtime', 'image', 'name' and 'digest'),
+        'boot_id' and 'host_id'.  Values that cannot be determined are None.
+    """
+    global _fingerprint
+    if cache and _fingerprint is not None:
+        return _fingerprint
+    stored = _load_cache() if cache else {}
+    before = json.dumps(stored, sort_keys=True)
+    info = stored.get('fingerprint')
+    if info is None or info.get('boot_id') is None or info['boot_id'] != boot_id():
+        info = _collect()
+        stored['fingerprint'] = info
+    info = dict(info, os=_os_release(), container=_container(stored.setdefault('digests', {})))
+    if cache:
+        if json.dumps(stored, sort_keys=True) != before:
+            _save_cache(stored)
+        _fingerprint = info
+    return info
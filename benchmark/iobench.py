@@ -0,0 +1,338 @@
+""" File system I/O benchmark
+
+``IOBenchmark`` measures what a file system delivers for the access patterns
+of our tasks, in place of a single ``dd`` of one block size.  For each block
+size, buffered and with ``O_DIRECT``, it runs:
+
+    seq_write    write a file front to back, fsync included
+    seq_read     read it front to back
+    strided_read read one block out of every ``stride``, as when reading one
+                 column of a MeasurementSet
+    rand_read    read blocks at random offsets
+    rand_write   overwrite blocks at random offsets, fsync included
+    mmap_read    copy the file out of a memory map (buffered only)
+    parallel_write, parallel_read
+                 sequential writes and reads of ``streams`` files at once,
+                 one thread per file
+
+and the latency of a 4 KiB write followed by ``fsync``.  Every test times
+each operation, and reports the throughput and the latency percentiles.
+
+Buffered reads would mostly measure the page cache, so before each read test
+the file's pages are dropped from the cache with ``posix_fadvise`` where it
+is available (Python 3.3 or later).  ``O_DIRECT`` bypasses the cache, but not
+every file system supports it (e.g. tmpfs before Linux 6.6); direct tests are
+then skipped.
+
+Example:
+    bench = IOBenchmark('/scratch/user', size='1G', streams=8)
+    for result in bench.run():
+        print(result['test'], result['block_size'], result['throughput'])
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import io
+import mmap
+import os
+import re
+import threading
+from timeit import default_timer
+
+import numpy as np
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+KB = 1024
+MB = 1024 ** 2
+
+_UNITS = {'': 1, 'K': KB, 'M': MB, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Size in bytes of an int or a string like '100M' or '4k'"""
+    if isinstance(size, string_types):
+        match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)i?B?\s*$', size)
+        if match is None:
+            raise ValueError("Cannot parse size {!r}".format(size))
+        return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+    return int(size)
+
+
+def select(results, test, block_size=None, direct=None):
+    """Return the first result of a test, or None"""
+    for result in results:
+        if (result['test'] == test and
+                (block_size is None or result['block_size'] == block_size) and
+                (direct is None or result['direct'] == direct)):
+            return result
+    return None
+
+
+def _drop_cache(path):
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def _summary(test, block_size, direct, streams, nbytes, elapsed, latencies):
+    latencies = np.concatenate(latencies) * 1e3
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {'test': test, 'block_size': block_size, 'direct': direct, 'streams': streams,
+            'bytes': nbytes, 'time': elapsed,
+            'throughput': nbytes / MB / elapsed,
+            'iops': len(latencies) / elapsed,
+            'latency': {'p50': float(p50), 'p90': float(p90), 'p99': float(p99),
+                        'max': float(latencies.max()), 'mean': float(latencies.mean())}}
+
+
+class IOBenchmark(object):
+    """Benchmark the file system of a directory.
+
+    Throughputs are in MiB/s and latencies in ms.
+
+    Args:
+        path (str, optional): Directory to test.  Defaults to the current one.
+        size (int or str, optional): Size of the test file, e.g. '256M'.
+            Defaults to 256 MiB.
+        block_sizes (list, optional): Block sizes of the tests.  Defaults to
+            4 KiB, 1 MiB and 16 MiB.
+        direct (bool, optional): Also run the tests with O_DIRECT.  Defaults to
+            True.
+        streams (int, optional): Files written and read at once by the
+            parallel tests.  Defaults to 4.
+        stride (int, optional): The strided read reads one block out of this
+            many.  Defaults to 8.
+        max_ops (int, optional): Maximum operations per test, bounding the
+            time taken by small blocks.  Defaults to 16384.
+        fsyncs (int, optional): Number of write and fsync pairs timed.
+            Defaults to 100.
+        repeats (int, optional): Runs of each test; the first is discarded as
+            a warm-up when there are several.  Defaults to 3.
+        seed (int, optional): Seed of the random offsets.
+    """
+
+    def __init__(self, path='.', size=256 * MB, block_sizes=(4 * KB, MB, 16 * MB), direct=True,
+                 streams=4, stride=8, max_ops=16384, fsyncs=100, repeats=3, seed=0):
+        self.path = path
+        self.size = parse_size(size)
+        self.block_sizes = [parse_size(bs) for bs in block_sizes]
+        self.direct = direct
+        self.streams = streams
+        self.stride = stride
+        self.max_ops = max_ops
+        self.fsyncs = fsyncs
+        self.repeats = repeats
+        self.seed = seed
+        self.results = []
+
+    def _file(self, i=0):
+        return os.path.join(self.path, '.iobench-{}-{}'.format(os.getpid(), i))
+
+    def _buffer(self, block_size):
+        # Anonymous maps are page aligned, as O_DIRECT requires
+        buf = mmap.mmap(-1, block_size)
+        buf.write(os.urandom(block_size))
+        return buf
+
+    def direct_supported(self):
+        """Whether the file system of ``path`` can be opened with O_DIRECT"""
+        if not hasattr(os, 'O_DIRECT'):
+            return False
+        path = self._file('direct')
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_DIRECT, 0o600)
+            os.close(fd)
+            return True
+        except OSError as e:
+            if e.errno == errno.EINVAL:
+                return False
+            raise
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _transfer(self, path, block_size, offsets, direct, write, create=False):
+        """Read or write a block at each offset, returning the time of each and
+        the total time, including the final fsync of writes"""
+        flags = os.O_RDWR if write else os.O_RDONLY
+        if create:
+            flags |= os.O_CREAT | os.O_TRUNC
+        if direct:
+            flags |= os.O_DIRECT
+        buf = self._buffer(block_size)
+        latencies = np.empty(len(offsets))
+        start = default_timer()
+        fd = os.open(path, flags, 0o600)
+        f = io.FileIO(fd, 'r+' if write else 'r', closefd=False)
+        try:
+            for i, offset in enumerate(offsets):
+                tic = default_timer()
+                f.seek(offset)
+                if write:
+                    f.write(buf)
+                else:
+                    f.readinto(buf)
+                latencies[i] = default_timer() - tic
+            if write:
+                os.fsync(fd)
+        finally:
+            f.close()
+            os.close(fd)
+            buf.close()
+        return latencies, default_timer() - start
+
+    def _blocks(self, block_size, size=None):
+        return max(1, min((size or self.size) // block_size, self.max_ops))
+
+    def _offsets(self, test, block_size):
+        # The file written by seq_write
+        nblocks = self._blocks(block_size)
+        if test == 'strided_read':
+            return [i * block_size for i in range(0, nblocks, self.stride)]
+        if test in ('rand_read', 'rand_write'):
+            rng = np.random.RandomState(self.seed)
+            return (rng.randint(0, nblocks, size=nblocks) * block_size).tolist()
+        return [i * block_size for i in range(nblocks)]
+
+    def _repeat(self, run):
+        runs = [run() for i in range(self.repeats)]
+        return runs[1:] if len(runs) > 1 else runs
+
+    def _single(self, test, block_size, direct):
+        path = self._file()
+        write = test in ('seq_write', 'rand_write')
+        offsets = self._offsets(test, block_size)
+
+        def run():
+            if not write:
+                _drop_cache(path)
+            return self._transfer(path, block_size, offsets, direct, write,
+                                  create=test == 'seq_write')
+
+        runs = self._repeat(run)
+        return _summary(test, block_size, direct, 1, len(offsets) * block_size * len(runs),
+                        sum(t for l, t in runs), [l for l, t in runs])
+
+    def _mmap_read(self, block_size):
+        path = self._file()
+
+        def run():
+            _drop_cache(path)
+            start = default_timer()
+            with open(path, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    nblocks = min(len(m) // block_size, self.max_ops)
+                    latencies = np.empty(nblocks)
+                    view = memoryview(bytearray(block_size))
+                    for i in range(nblocks):
+                        tic = default_timer()
+                        view[:] = m[i * block_size:(i + 1) * block_size]
+                        latencies[i] = default_timer() - tic
+                finally:
+                    m.close()
+            return latencies, default_timer() - start
+
+        runs = self._repeat(run)
+        return _summary('mmap_read', block_size, False, 1,
+                        sum(len(l) for l, t in runs) * block_size,
+                        sum(t for l, t in runs), [l for l, t in runs])
+
+    def _parallel(self, test, block_size, direct):
+        write = test == 'parallel_write'
+        offsets = [i * block_size
+                   for i in range(self._blocks(block_size, self.size // self.streams))]
+        paths = [self._file(i + 1) for i in range(self.streams)]
+
+        def run():
+            results = [None] * self.streams
+
+            def stream(i):
+                results[i] = self._transfer(paths[i], block_size, offsets, direct, write,
+                                            create=write)
+
+            if not write:
+                for path in paths:
+                    _drop_cache(path)
+            threads = [threading.Thread(target=stream, args=(i,)) for i in range(self.streams)]
+            start = default_timer()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return [l for l, t in results], default_timer() - start
+
+        runs = self._repeat(run)
+        nbytes = len(offsets) * block_size * self.streams * len(runs)
+        return _summary(test, block_size, direct, self.streams, nbytes,
+                        sum(t for l, t in runs), [l for ls, t in runs for l in ls])
+
+    def _fsync(self):
+        path = self._file()
+        buf = self._buffer(4 * KB)
+        latencies = np.empty(self.fsyncs)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+        start = default_timer()
+        try:
+            for i in range(self.fsyncs):
+                tic = default_timer()
+                os.write(fd, buf)
+                os.fsync(fd)
+                latencies[i] = default_timer() - tic
+        finally:
+            os.close(fd)
+            buf.close()
+        return _summary('fsync', 4 * KB, False, 1, self.fsyncs * 4 * KB,
+                        default_timer() - start, [latencies])
+
+    def run(self):
+        """Run all tests.
+
+        Returns:
+            list of dicts, one per test, block size and mode: the 'test',
+            'block_size', 'direct', number of 'streams', 'bytes' transferred,
+            'time', 'throughput' (MiB/s), 'iops' and the 'latency'
+            percentiles p50, p90, p99, max and mean (ms).  Tests that failed
+            have an 'error' instead of measurements.
+        """
+        modes = [False] + ([True] if self.direct and self.direct_supported() else [])
+        results = []
+        try:
+            for direct in modes:
+                for block_size in self.block_sizes:
+                    for test in ('seq_write', 'seq_read', 'strided_read', 'rand_read',
+                                 'rand_write'):
+                        results.append(self._measure(test, block_size, direct))
+                    if not direct:
+                        results.append(self._measure('mmap_read', block_size, direct))
+                for test in ('parallel_write', 'parallel_read'):
+                    results.append(self._measure(test, max(self.block_sizes), direct))
+            results.append(self._measure('fsync', 4 * KB, False))
+        finally:
+            for i in range(self.streams + 1):
+                if os.path.exists(self._file(i)):
+                    os.remove(self._file(i))
+        self.results = results
+        return results
+
+    def _measure(self, test, block_size, direct):
+        try:
+            if test == 'mmap_read':
+                return self._mmap_read(block_size)
+            elif test.startswith('parallel'):
+                return self._parallel(test, block_size, direct)
+            elif test == 'fsync':
+                return self._fsync()
+            return self._single(test, block_size, direct)
+        except (OSError, IOError) as e:
+            # e.g. a block size that is not aligned for O_DIRECT on this file system
+            return {'test': test, 'block_size': block_size, 'direct': direct, 'error': str(e)}
@@ -0,0 +1,128 @@
+""" Streaming capture of the output of a profiled command
+
+``LogCapture`` runs a command and reads its stdout and stderr line by line as
+they are written, instead of collecting everything with ``communicate``.  Each
+line is stamped with ``timeit.default_timer``, the clock the resource tracker
+uses for its samples, so log messages can be lined up with the resource
+timeline.  Lines are written to a log file and/or passed to a handler as they
+arrive and only the last ``tail`` lines are kept in memory, so a chatty run of
+several hours does not grow the memory of the profiler.
+
+``default_timer`` differs between Python versions (``time.time`` on Python 2,
+``time.perf_counter`` on Python 3), so log files are stamped with the wall
+clock, ``time.time``, instead, and ``read_log`` converts the times back to the
+sample clock of the process reading them.
+
+Log file format, one line per output line:
+    <wall-clock time> <stream> <text>
+
+Example:
+    capture = LogCapture('tclean.log', tail=50)
+    returncode = capture.run('casa --nologger --log2term -c image.py')
+    for line in read_log('tclean.log'):
+        print(line.time, line.text)
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import subprocess
+import sys
+import time
+from collections import deque, namedtuple
+from threading import Lock, Thread
+from timeit import default_timer
+
+# One line of output: the time it was read, 'stdout' or 'stderr', and the text
+# without the line ending
+LogLine = namedtuple('LogLine', ('time', 'stream', 'text'))
+
+
+class LogCapture(object):
+    """Run a command and stream its output.
+
+    Args:
+        path (str, optional): Append the timestamped lines to this file.
+        handler (callable, optional): Called with every ``LogLine`` as it is
+            read, from a reader thread.  Calls are serialised, in the order
+            the lines were read.
+        tail (int, optional): Number of most recent lines to keep in ``tail``.
+            Defaults to 100.
+        echo (bool, optional): Also write the output to this process's stdout
+            and stderr as it arrives.  Defaults to True.
+    """
+
+    def __init__(self, path=None, handler=None, tail=100, echo=True):
+        self.path = path
+        self.handler = handler
+        self.echo = echo
+        self.tail = deque(maxlen=tail)
+        self.lines = 0
+        self._lock = Lock()
+        self._file = None
+        # wall-clock time minus sample-clock time, for the log file
+        self._offset = 0.
+
+    def _emit(self, line):
+        with self._lock:
+            self.lines += 1
+            self.tail.append(line)
+            if self._file is not None:
+                self._file.write('{:.6f} {} {}\n'.format(line.time + self._offset, line.stream,
+                                                         line.text))
+            if self.echo:
+                out = sys.stdout if line.stream == 'stdout' else sys.stderr
+                out.write(line.text + '\n')
+            if self.handler is not None:
+                self.handler(line)
+
+    def _read(self, pipe, stream):
+        for raw in iter(pipe.readline, b''):
+            text = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            self._emit(LogLine(default_timer(), stream, text))
+        pipe.close()
+
+    def run(self, cl_arg, env=None):
+        """Run a command line in a shell until it exits.
+
+        Args:
+            cl_arg (str): The command line.
+            env (dict, optional): Environment of the command.  Defaults to the
+                environment of this process.
+
+        Returns:
+            int: The exit code of the command.
+        """
+        if self.path:
+            self._file = open(self.path, 'a')
+            self._offset = time.time() - default_timer()
+        try:
+            proc = subprocess.Popen(cl_arg, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    shell=True, env=env)
+            readers = [Thread(target=self._read, args=(proc.stdout, 'stdout')),
+                       Thread(target=self._read, args=(proc.stderr, 'stderr'))]
+            for reader in readers:
+                reader.daemon = True
+                reader.start()
+            for reader in readers:
+                reader.join()
+            return proc.wait()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_log(path):
+    """Read a log file written by ``LogCapture``.
+
+    Returns:
+        list of LogLine, with times on the sample clock of this process
+    """
+    offset = time.time() - default_timer()
+    lines = []
+    with open(path) as f:
+        for line in f:
+            wall, stream, text = (line.rstrip('\n') + ' ').split(' ', 2)
+            lines.append(LogLine(float(wall) - offset, stream, text[:-1]))
+    return lines
@@ -0,0 +1,204 @@
+""" Phases from the logs of CASA, WSClean and other tools
+
+Most radio astronomy packages already log when each task or stage begins and
+ends.  A log parser turns those lines into ``Phase`` segments, so the resource
+usage of every task is available without adding markers to the pipeline.
+
+Parsers work on lines captured live by ``LogCapture`` (whose timestamps are on
+the clock of the resource samples), or on the lines of a log file.  Lines
+without a capture timestamp are placed on the sample clock from the wall-clock
+time in their text, which only lines up with the samples when the log was
+written on the same host while the profiler was running.
+
+Parsers:
+    CasaParser      "Begin Task: <task>" / "End Task: <task>" lines
+    WSCleanParser   "== <stage> ==" headers, each stage lasting until the next
+    RegexParser     any begin/end or sectioned log, from regular expressions
+
+Example:
+    phases = parse_file(CasaParser(), 'casa-20190305-101213.log')
+    prof = Profiler(log_parsers=['casa'])
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import calendar
+import re
+import time
+from datetime import datetime
+from timeit import default_timer
+
+from .logcapture import read_log
+from .phases import Phase
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class RegexParser(object):
+    """Find phases in a log with regular expressions.
+
+    Args:
+        begin (str): Pattern of a line that begins a phase.  Its named group
+            ``name`` is the name of the phase, otherwise ``name`` is used.
+        end (str, optional): Pattern of a line that ends a phase, matched to
+            the most recent open phase with the same ``name`` group.  Without
+            it every phase lasts until the next one begins, or the log ends.
+        name (str, optional): Name of the phases when ``begin`` has no ``name``
+            group.  Defaults to 'phase'.
+        time_format (str, optional): ``strptime`` format of the ``time`` group
+            of the patterns, used for lines that were not captured live.
+        utc (bool, optional): The times in the text are UTC rather than local
+            time.  Defaults to False.
+        stamp (str, optional): Pattern with a ``time`` group that matches the
+            timestamp of any line, so that phases without an end pattern end
+            at the last line of a log that was not captured live.
+    """
+
+    def __init__(self, begin, end=None, name='phase', time_format=None, utc=False, stamp=None):
+        self.begin = re.compile(begin)
+        self.end = re.compile(end) if end else None
+        self.stamp = re.compile(stamp) if stamp else None
+        self.name = name
+        self.time_format = time_format
+        self.utc = utc
+        self.reset()
+
+    def reset(self):
+        """Forget the phases of a previous log"""
+        self._open = []
+        self._last_time = None
+        # wall-clock time minus sample-clock time
+        self._offset = time.time() - default_timer()
+
+    def _time(self, line, match):
+        if hasattr(line, 'time'):
+            return line.time
+        text_time = match.groupdict().get('time')
+        if not text_time or not self.time_format:
+            return None
+        dt = datetime.strptime(text_time, self.time_format)
+        if self.utc:
+            wall = calendar.timegm(dt.timetuple())
+        else:
+            wall = time.mktime(dt.timetuple())
+        return wall + dt.microsecond / 1e6 - self._offset
+
+    def _name(self, match):
+        return match.groupdict().get('name') or self.name
+
+    def feed(self, line):
+        """Parse one line, a ``LogLine`` or a string.
+
+        Returns:
+            list of Phase: the phases that ended on this line.
+        """
+        text = getattr(line, 'text', line)
+        done = []
+        match = self.end.search(text) if self.end is not None else None
+        if match:
+            t = self._time(line, match)
+            name = self._name(match)
+            for i in range(len(self._open) - 1, -1, -1):
+                if self._open[i][0] == name:
+                    done.append(Phase(name, self._open.pop(i)[1], t))
+                    break
+        else:
+            match = self.begin.search(text)
+            if match:
+                t = self._time(line, match)
+                if t is not None:
+                    if self.end is None:
+                        done.extend(Phase(n, start, t) for n, start in self._open)
+                        self._open = []
+                    self._open.append((self._name(match), t))
+        if match is None and self.stamp is not None:
+            match = self.stamp.search(text)
+        t = self._time(line, match) if match else getattr(line, 'time', None)
+        if t is not None:
+            self._last_time = t
+        return [p for p in done if p.end is not None]
+
+    def close(self, end=None):
+        """End the log.
+
+        Phases still open end at ``end``, by default the time of the last line
+        seen, for parsers without an end pattern, and are reported without an
+        end (None) otherwise.
+
+        Returns:
+            list of Phase
+        """
+        end = self._last_time if end is None else end
+        if self.end is None:
+            phases = [Phase(n, start, end) for n, start in self._open if end is not None]
+        else:
+            phases = [Phase(n, start, None) for n, start in self._open]
+        self._open = []
+        return phases
+
+
+class CasaParser(RegexParser):
+    """Tasks of a CASA log, from its "Begin Task" and "End Task" lines.
+
+    CASA stamps its log lines in UTC, e.g.
+    ``2019-03-05 10:12:13   INFO    tclean::::casa  ##### Begin Task: tclean #####``
+    """
+
+    def __init__(self, time_format='%Y-%m-%d %H:%M:%S', utc=True):
+        stamp = r'^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)?'
+        RegexParser.__init__(self, stamp + r'.*Begin Task: (?P<name>\w+)',
+                             stamp + r'.*End Task: (?P<name>\w+)',
+                             time_format=time_format, utc=utc)
+
+
+class WSCleanParser(RegexParser):
+    """Stages of a WSClean run, from its ``== <stage> ==`` headers.
+
+    Each stage (e.g. "Constructing PSF", "Deconvolving", "Writing restored
+    image") lasts until the next one begins.  With ``-log-time`` WSClean
+    prefixes every line with the local time, e.g. ``2019-Mar-05 10:12:13.123456``.
+    """
+
+    def __init__(self, time_format='%Y-%b-%d %H:%M:%S.%f', utc=False):
+        stamp = r'^(?P<time>\d{4}-\w{3}-\d\d \d\d:\d\d:\d\d\.\d+)'
+        RegexParser.__init__(self, stamp + r'?.*== (?P<name>[^=]+?) ==',
+                             time_format=time_format, utc=utc, stamp=stamp)
+
+
+PARSERS = {'casa': CasaParser, 'wsclean': WSCleanParser}
+
+
+def get_parser(parser):
+    """Return a parser, creating one of ``PARSERS`` when given its name"""
+    if isinstance(parser, string_types):
+        try:
+            return PARSERS[parser]()
+        except KeyError:
+            raise ValueError("Unknown log parser '{}', use one of {}".format(parser, sorted(PARSERS)))
+    return parser
+
+
+def parse_lines(parser, lines):
+    """Return the phases found in a sequence of lines, ordered by start time"""
+    parser = get_parser(parser)
+    parser.reset()
+    phases = []
+    for line in lines:
+        phases.extend(parser.feed(line))
+    phases.extend(parser.close())
+    return sorted(phases, key=lambda p: p.start)
+
+
+def parse_file(parser, path):
+    """Return the phases found in a log file, either written by ``LogCapture``
+    or by the logging tool itself"""
+    try:
+        lines = read_log(path)
+    except ValueError:
+        with open(path) as f:
+            lines = [line.rstrip('\n') for line in f]
+    return parse_lines(parser, lines)
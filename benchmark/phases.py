@@ -0,0 +1,176 @@
+""" Phase markers for profiled tasks
+
+Pipelines run through distinct phases (gridding, major and minor cycles,
+restoring, ...) and whole-run statistics hide which phase used what.  Code
+being profiled marks where each phase begins and ends, so the resource
+samples can be split by phase afterwards.  Markers are timestamped with the
+wall clock, ``time.time``, which is the same in every process and Python
+version, and converted to the clock of the resource samples,
+``timeit.default_timer``, when they are read.
+
+Markers are appended to the marker file of the current run.  A function
+profiled in this process finds it through ``recording``; a script run by the
+profiler gets it in the ``BENCHMARK_PHASE_FILE`` environment variable and can
+mark phases from Python with ``phase`` or from any other program with
+``python -m benchmark.phases begin|end <name>``.  Each marker is a single
+short append, so markers from several processes do not interleave and cost
+a few microseconds.  Outside a profiled run markers do nothing.
+
+Marker file format, one line per marker:
+    <wall-clock time> begin|end <name>
+
+Example:
+    with phase('gridding'):
+        grid(vis)
+
+    @phase('restore')
+    def restore(image):
+        ...
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer
+
+ENV_VAR = 'BENCHMARK_PHASE_FILE'
+
+# Marker files of the recordings in this process: that of the calling thread,
+# and all of them, most recent last, for threads started by a profiled function
+_local = threading.local()
+_active = []
+
+# A phase of a run, with its start and end time in seconds on the clock of the
+# resource samples.  ``end`` is None for a phase that never ended.
+Phase = namedtuple('Phase', ('name', 'start', 'end'))
+
+
+def mark(event, name, path=None):
+    """Record the beginning or end of a phase.
+
+    Args:
+        event (str): 'begin' or 'end'.
+        name (str): Name of the phase, without line breaks.
+        path (str, optional): Marker file.  Defaults to the file of the current
+            profiled run, if any.
+    """
+    path = (path or getattr(_local, 'path', None) or (_active[-1] if _active else None) or
+            os.environ.get(ENV_VAR))
+    if not path:
+        return
+    with open(path, 'a') as f:
+        f.write('{:.6f} {} {}\n'.format(time.time(), event, name))
+
+
+class phase(object):
+    """Mark a phase around a block of code (context manager) or around every
+    call of a function (decorator).
+
+    Args:
+        name (str): Name of the phase.
+        path (str, optional): Marker file, see ``mark``.
+    """
+
+    def __init__(self, name, path=None):
+        self.name = name
+        self.path = path
+
+    def __enter__(self):
+        mark('begin', self.name, self.path)
+        return self
+
+    def __exit__(self, *args):
+        mark('end', self.name, self.path)
+
+    def __call__(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(self.name, self.path):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def read_phases(path):
+    """Read the phases recorded in a marker file.
+
+    An ``end`` closes the most recent open phase of the same name, so phases
+    may nest and repeat.  Lines cut short by a crash are skipped.
+
+    Returns:
+        list of Phase, ordered by start time, with times on the sample clock of
+        this process.
+    """
+    # wall-clock time minus sample-clock time
+    offset = time.time() - default_timer()
+    phases = []
+    open_phases = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split(' ', 2)
+            if len(fields) != 3:
+                continue
+            try:
+                t = float(fields[0]) - offset
+            except ValueError:
+                continue
+            event, name = fields[1], fields[2]
+            if event == 'begin':
+                open_phases.setdefault(name, []).append(len(phases))
+                phases.append(Phase(name, t, None))
+            elif event == 'end' and open_phases.get(name):
+                i = open_phases[name].pop()
+                phases[i] = phases[i]._replace(end=t)
+    return sorted(phases, key=lambda p: p.start)
+
+
+@contextmanager
+def recording(path=None, env=None):
+    """Collect the phases marked while the block runs.
+
+    Markers of the calling thread, and of threads without a recording of their
+    own, go to the marker file of the block.  The environment of this process
+    is left alone: child processes get the file through ``env``.  Yields a list
+    that holds the recorded phases once the block exits.
+
+    Args:
+        path (str, optional): Marker file to keep.  It is emptied first, so
+            phases left open by an earlier run do not carry over.  Defaults to
+            a temporary file that is removed afterwards.
+        env (dict, optional): Environment of the processes started in the
+            block, in which ``BENCHMARK_PHASE_FILE`` is set.
+    """
+    remove = path is None
+    if remove:
+        fd, path = tempfile.mkstemp(suffix='.phases')
+        os.close(fd)
+    else:
+        open(path, 'w').close()
+    if env is not None:
+        env[ENV_VAR] = path
+    previous = getattr(_local, 'path', None)
+    _local.path = path
+    _active.append(path)
+    phases = []
+    try:
+        yield phases
+    finally:
+        _local.path = previous
+        _active.remove(path)
+        if os.path.exists(path):
+            phases.extend(read_phases(path))
+            if remove:
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ('begin', 'end'):
+        sys.exit("usage: python -m benchmark.phases begin|end <name>")
+    mark(sys.argv[1], sys.argv[2])
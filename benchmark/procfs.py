@@ -0,0 +1,381 @@
+""" Low-overhead process sampling
+
+This module contains the sampling engine used by the resource tracker.  Each
+call to ``ProcSampler.sample`` reads every ``/proc`` file it needs at most once
+per process, so a tick costs a handful of small reads instead of the repeated
+``memory_full_info`` calls (each of which parses all of ``/proc/<pid>/smaps``)
+that psutil would otherwise make.
+
+``descendants`` finds the current process tree below a root process on every
+tick, so processes spawned while a task runs are sampled too.
+
+Files read per process and tick:
+    /proc/<pid>/stat           CPU time, RSS, threads, parent PID, command name
+    /proc/<pid>/task/*/status  context switches of each thread
+    /proc/<pid>/io             bytes read from and written to storage
+    /proc/<pid>/smaps_rollup   PSS and USS (skipped in "cheap" mode)
+
+plus ``/proc/stat`` (per-core utilisation and iowait) and ``/proc/net/dev``
+once per tick.
+
+On platforms without a Linux-style ``/proc`` the ``PsutilSampler`` provides the
+same interface using ``psutil.Process.oneshot``.
+
+Example:
+    sampler = get_sampler(cheap=True)
+    procs, net = sampler.sample([os.getpid()])
+    print(sampler.last_cost)
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+from collections import namedtuple
+from timeit import default_timer
+
+
+# Resource usage of a single process at one tick.  Memory and I/O are in bytes,
+# CPU times in seconds, ``cpu`` in percent of one core since the last tick and
+# context switches are cumulative counts over the live threads.
+ProcSample = namedtuple('ProcSample', ('pid', 'ppid', 'name', 'cpu', 'cpu_time', 'pmem',
+                                       'rss', 'uss', 'pss', 'rio', 'wio', 'utime', 'stime',
+                                       'ctx_vol', 'ctx_invol', 'threads'))
+
+
+def _cpu_percentages(last, times):
+    """Turn two readings of (busy, iowait, total) CPU times into percentages.
+
+    ``times[0]`` is the whole system and ``times[1:]`` the individual cores.
+
+    Returns:
+        tuple: (system-wide iowait %, list of per-core utilisation %)
+    """
+    if last is None or len(last) != len(times):
+        return 0.0, [0.0] * (len(times) - 1)
+    pct = []
+    for (busy0, iowait0, total0), (busy1, iowait1, total1) in zip(last, times):
+        total = total1 - total0
+        pct.append((100. * (busy1 - busy0) / total if total > 0 else 0.0,
+                    100. * (iowait1 - iowait0) / total if total > 0 else 0.0))
+    return pct[0][1], [busy for busy, _ in pct[1:]]
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class ProcSampler(object):
+    """Sample process resource usage directly from ``/proc``.
+
+    Args:
+        cheap (bool, optional): Skip ``smaps_rollup`` and report USS/PSS as NaN.
+            Defaults to False.
+        procfs (str, optional): Mount point of the proc filesystem.  Defaults to
+            '/proc'.
+    """
+
+    def __init__(self, cheap=False, procfs='/proc'):
+        self.cheap = cheap
+        self.procfs = procfs
+        self.last_cost = 0.0
+        self._clk_tck = float(os.sysconf('SC_CLK_TCK'))
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        self._mem_total = self._read_mem_total()
+        self._rollup = os.path.exists(os.path.join(procfs, 'self', 'smaps_rollup'))
+        # pid -> (starttime, cpu_time, wall time) of the previous tick
+        self._cpu_last = {}
+        # pid -> parent pid of every process seen by ``descendants``
+        self._parents = {}
+        # CPU times of the system and each core at the previous tick
+        self._sys_last = None
+
+    @staticmethod
+    def available(procfs='/proc'):
+        return os.path.exists(os.path.join(procfs, 'self', 'stat'))
+
+    def _read_mem_total(self):
+        for line in _read(os.path.join(self.procfs, 'meminfo')).splitlines():
+            if line.startswith(b'MemTotal:'):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    def _read_stat(self, pid):
+        raw = _read(os.path.join(self.procfs, str(pid), 'stat'))
+        lpar, rpar = raw.index(b'('), raw.rindex(b')')
+        name = raw[lpar + 1:rpar].decode('utf-8', 'replace')
+        fields = raw[rpar + 2:].split()
+        # fields[0] is field 3 (state) in proc(5)
+        utime = int(fields[11]) / self._clk_tck
+        stime = int(fields[12]) / self._clk_tck
+        return {
+            'name': name,
+            'state': fields[0],
+            'ppid': int(fields[1]),
+            'utime': utime,
+            'stime': stime,
+            'cpu_time': utime + stime,
+            'threads': int(fields[17]),
+            'starttime': int(fields[19]),
+            'rss': int(fields[21]) * self._page_size,
+        }
+
+    def _read_status(self, pid):
+        """Return the (voluntary, involuntary) context switches of a process.
+
+        ``/proc/<pid>/status`` only counts the main thread, so the switches of
+        every live thread are added up.  Those of threads that have exited are
+        not included.
+        """
+        vol = invol = 0
+        task = os.path.join(self.procfs, str(pid), 'task')
+        for tid in os.listdir(task):
+            try:
+                raw = _read(os.path.join(task, tid, 'status'))
+            except (IOError, OSError):
+                # The thread exited
+                continue
+            for line in raw.splitlines():
+                if line.startswith(b'voluntary_ctxt_switches:'):
+                    vol += int(line.split()[1])
+                elif line.startswith(b'nonvoluntary_ctxt_switches:'):
+                    invol += int(line.split()[1])
+        return vol, invol
+
+    def _read_io(self, pid):
+        rio = wio = 0
+        try:
+            raw = _read(os.path.join(self.procfs, str(pid), 'io'))
+        except (IOError, OSError):
+            # io is only readable for processes we own
+            return rio, wio
+        for line in raw.splitlines():
+            if line.startswith(b'read_bytes:'):
+                rio = int(line.split()[1])
+            elif line.startswith(b'write_bytes:'):
+                wio = int(line.split()[1])
+        return rio, wio
+
+    def _read_smaps(self, pid):
+        """Return (pss, uss) in bytes, preferring the kernel's pre-summed rollup"""
+        fname = 'smaps_rollup' if self._rollup else 'smaps'
+        raw = _read(os.path.join(self.procfs, str(pid), fname))
+        pss = uss = 0
+        for line in raw.splitlines():
+            if line.startswith(b'Pss:'):
+                pss += int(line.split()[1])
+            elif line.startswith(b'Private_Clean:') or line.startswith(b'Private_Dirty:'):
+                uss += int(line.split()[1])
+        return pss * 1024, uss * 1024
+
+    def read_process(self, pid, now=None):
+        """Sample a single process.
+
+        Returns:
+            ProcSample, or None if the process has exited or is a zombie.
+        """
+        now = default_timer() if now is None else now
+        try:
+            stat = self._read_stat(pid)
+            self._parents[pid] = stat['ppid']
+            if stat['state'] == b'Z':
+                return None
+            ctx_vol, ctx_invol = self._read_status(pid)
+            rio, wio = self._read_io(pid)
+            if self.cheap:
+                pss = uss = float('nan')
+            else:
+                pss, uss = self._read_smaps(pid)
+        except (IOError, OSError, ValueError, IndexError):
+            self._cpu_last.pop(pid, None)
+            return None
+
+        # Like psutil.Process.cpu_percent, the first sample of a process is 0
+        cpu = 0.0
+        last = self._cpu_last.get(pid)
+        if last is not None and last[0] == stat['starttime'] and now > last[2]:
+            cpu = 100. * (stat['cpu_time'] - last[1]) / (now - last[2])
+        self._cpu_last[pid] = (stat['starttime'], stat['cpu_time'], now)
+
+        pmem = 100. * stat['rss'] / self._mem_total if self._mem_total else 0.0
+        return ProcSample(pid, stat['ppid'], stat['name'], cpu, stat['cpu_time'], pmem,
+                          stat['rss'], uss, pss, rio, wio, stat['utime'], stat['stime'],
+                          ctx_vol, ctx_invol, stat['threads'])
+
+    def descendants(self, root, exclude=()):
+        """Return ``root`` followed by all of its live descendants.
+
+        Only processes that appeared since the previous call have their ``stat``
+        read to find their parent, so a call costs one directory listing plus a
+        read per new process.  Processes in ``exclude`` are skipped together
+        with their own descendants.
+        """
+        children = {}
+        parents = {}
+        for entry in os.listdir(self.procfs):
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            ppid = self._parents.get(pid)
+            if ppid is None:
+                try:
+                    ppid = self._read_stat(pid)['ppid']
+                except (IOError, OSError, ValueError, IndexError):
+                    continue
+            parents[pid] = ppid
+            children.setdefault(ppid, []).append(pid)
+        # Forget exited processes so a reused pid is looked up again
+        self._parents = parents
+        return _walk(root, children, exclude)
+
+    def system_cpu(self):
+        """Return the system-wide iowait and per-core utilisation since the last call.
+
+        Returns:
+            tuple: (iowait %, list of utilisation % per core), all zero on the
+            first call.
+        """
+        times = []
+        for line in _read(os.path.join(self.procfs, 'stat')).splitlines():
+            if not line.startswith(b'cpu'):
+                break
+            # user nice system idle iowait irq softirq steal; guest time is
+            # already counted in user
+            fields = [int(f) for f in line.split()[1:9]]
+            total = sum(fields)
+            times.append((total - fields[3] - fields[4], fields[4], total))
+        result = _cpu_percentages(self._sys_last, times)
+        self._sys_last = times
+        return result
+
+    def net_io(self):
+        """Return system-wide (bytes received, bytes sent) from ``/proc/net/dev``"""
+        recv = sent = 0
+        for line in _read(os.path.join(self.procfs, 'net', 'dev')).splitlines()[2:]:
+            fields = line.split(b':', 1)[1].split()
+            recv += int(fields[0])
+            sent += int(fields[8])
+        return recv, sent
+
+    def sample(self, pids):
+        """Sample a list of processes and the network counters.
+
+        The time spent is stored in ``last_cost`` (seconds).
+
+        Returns:
+            tuple: (list of ProcSample for the live processes, (recv, sent))
+        """
+        tic = default_timer()
+        procs = []
+        for pid in pids:
+            p = self.read_process(pid, tic)
+            if p is not None:
+                procs.append(p)
+        net = self.net_io()
+        # Drop the CPU baselines of processes that are no longer sampled
+        if len(self._cpu_last) > len(procs):
+            sampled = set(p.pid for p in procs)
+            for pid in list(self._cpu_last):
+                if pid not in sampled:
+                    del self._cpu_last[pid]
+        self.last_cost = default_timer() - tic
+        return procs, net
+
+
+def _walk(root, children, exclude):
+    pids = []
+    stack = [root]
+    while stack:
+        pid = stack.pop()
+        if pid in exclude:
+            continue
+        pids.append(pid)
+        stack.extend(children.get(pid, ()))
+    return pids
+
+
+class PsutilSampler(object):
+    """Portable fallback for ``ProcSampler`` built on ``psutil.Process.oneshot``"""
+
+    def __init__(self, cheap=False):
+        import psutil
+        self._psutil = psutil
+        self.cheap = cheap
+        self.last_cost = 0.0
+        self._procs = {}
+        self._sys_last = None
+
+    def read_process(self, pid, now=None):
+        psutil = self._psutil
+        p = self._procs.get(pid)
+        try:
+            if p is None:
+                p = self._procs[pid] = psutil.Process(pid)
+            with p.oneshot():
+                if p.status() == psutil.STATUS_ZOMBIE:
+                    return None
+                if self.cheap:
+                    mem = p.memory_info()
+                    uss = pss = float('nan')
+                else:
+                    mem = p.memory_full_info()
+                    uss = mem.uss
+                    pss = getattr(mem, 'pss', float('nan'))
+                try:
+                    io = p.io_counters()
+                    rio, wio = io.read_bytes, io.write_bytes
+                except (AttributeError, psutil.AccessDenied):
+                    rio = wio = 0
+                times = p.cpu_times()
+                ctx = p.num_ctx_switches()
+                return ProcSample(pid, p.ppid(), p.name(), p.cpu_percent(),
+                                  times.user + times.system, p.memory_percent(),
+                                  mem.rss, uss, pss, rio, wio, times.user, times.system,
+                                  ctx.voluntary, ctx.involuntary, p.num_threads())
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            self._procs.pop(pid, None)
+            return None
+
+    def descendants(self, root, exclude=()):
+        psutil = self._psutil
+        children = {}
+        for pid, ppid in psutil.ppid_map().items():
+            children.setdefault(ppid, []).append(pid)
+        # Forget exited processes along with their cpu_percent baselines
+        for pid in list(self._procs):
+            if not psutil.pid_exists(pid):
+                del self._procs[pid]
+        return _walk(root, children, exclude)
+
+    def system_cpu(self):
+        times = []
+        for t in [self._psutil.cpu_times()] + self._psutil.cpu_times(percpu=True):
+            total = sum(t) - getattr(t, 'guest', 0) - getattr(t, 'guest_nice', 0)
+            iowait = getattr(t, 'iowait', 0)
+            times.append((total - t.idle - iowait, iowait, total))
+        result = _cpu_percentages(self._sys_last, times)
+        self._sys_last = times
+        return result
+
+    def net_io(self):
+        net = self._psutil.net_io_counters()
+        return net.bytes_recv, net.bytes_sent
+
+    def sample(self, pids):
+        tic = default_timer()
+        procs = []
+        for pid in pids:
+            p = self.read_process(pid, tic)
+            if p is not None:
+                procs.append(p)
+        net = self.net_io()
+        self.last_cost = default_timer() - tic
+        return procs, net
+
+
+def get_sampler(cheap=False):
+    """Return the fastest sampler available on this platform"""
+    if ProcSampler.available():
+        return ProcSampler(cheap=cheap)
+    return PsutilSampler(cheap=cheap)
@@ -217,16 +217,22 @@ def plot_tasks(results, palette='Viridis', **kwargs):
     return p
 
 
-def plot_resources(results, palette='Viridis', **kwargs):
+def plot_resources(results, palette='Viridis', profiler=None, top=5, **kwargs):
     """Plot resource usage in a bokeh plot.
 
     Parameters
     ----------
-    results : sequence
+    results : SampleBuffer
         Output of ResourceProfiler.results
     palette : string, optional
         Name of the bokeh palette to use, must be a member of
         bokeh.palettes.all_palettes.
+    profiler : ResourceProfiler, optional
+        If it recorded per-process samples, the memory and CPU use of its
+        ``top`` processes are added as separate plots.  The phases marked
+        during its run are shaded in every plot.
+    top : int, optional
+        Number of processes shown in the per-process plots.
     **kwargs
         Other keyword arguments, passed to bokeh.figure. These will override
         all defaults set by plot_resources.
@@ -250,7 +256,9 @@ def plot_resources(results, palette='Viridis', **kwargs):
     defaults.update((k, v) for (k, v) in kwargs.items() if k in
                     _get_figure_keywords())
     if results:
-        t, cpu, pmem, rss, uss, pss, rio, wio, nrio, nwio = zip(*results)
+        t, cpu, pmem, rss, uss, pss, rio, wio, nrio, nwio = (
+            results[c].tolist() for c in ('time', 'cpu', 'pmem', 'rmem', 'umem', 'smem',
+                                          'rio', 'wio', 'nrio', 'nwio'))
         rio = [0] + list(diff(rio))
         wio = [0] + list(diff(wio))	
         nrio = [0] + list(diff(nrio))
@@ -354,10 +362,130 @@ def plot_resources(results, palette='Viridis', **kwargs):
 
     p1.add_tools(hover)
 
-    p = column(p1, p2, p3, p4)
+    plots = [p1, p2, p3, p4]
+    if results and profiler is not None and profiler.process_results:
+        for metric, label in (('rmem', 'RSS Memory (MB)'), ('cpu', '% CPU')):
+            plots.append(_plot_processes(profiler, metric, label, top, palette, left,
+                                         right, defaults))
+    if results and profiler is not None and profiler.phases:
+        _shade_phases(plots, profiler.phases, palette, left, right)
+
+    p = column(*plots)
+    return p
+
+
+def _plot_processes(profiler, metric, label, top, palette, left, right, defaults):
+    """Plot one metric of the ``top`` processes of a ResourceProfiler"""
+    bp = import_required('bokeh.plotting', _BOKEH_MISSING_MSG)
+    from bokeh import palettes
+
+    procs = profiler.process_results
+    ranked = profiler.top_processes('rmem' if metric == 'rmem' else 'cpu', top)
+    palette_lookup = palettes.all_palettes[palette]
+    keys = list(sorted(palette_lookup.keys()))
+    colors = palette_lookup[keys[min(bisect_left(keys, len(ranked)), len(keys) - 1)]]
+
+    peak = 0
+    lines = []
+    for proc in ranked:
+        mask = procs.pid == proc['pid']
+        t = (procs.time[mask] - left).tolist()
+        values = procs.column(metric)[mask].tolist()
+        peak = max([peak] + values)
+        lines.append((t, values, "{} ({})".format(proc['name'], proc['pid'])))
+
+    p = bp.figure(y_range=fix_bounds(0, 1.1*peak, 100),
+                  x_range=fix_bounds(0, right - left, 1),
+                  **defaults)
+    for (t, values, name), color in zip(lines, cycle(colors)):
+        p.line(t, values, color=color, line_width=2, legend=name)
+    p.yaxis.axis_label = label + " by process"
+    p.xaxis.axis_label = "Time (s)"
     return p
 
 
+def _shade_phases(plots, phases, palette, left, right):
+    """Shade the time span of each phase in every plot, labelled in the first"""
+    from bokeh import palettes
+    from bokeh.models import BoxAnnotation, Label
+
+    palette_lookup = palettes.all_palettes[palette]
+    keys = list(sorted(palette_lookup.keys()))
+    colors = palette_lookup[keys[min(bisect_left(keys, len(phases)), len(keys) - 1)]]
+    for phase, color in zip(phases, cycle(colors)):
+        start = max(phase.start, left) - left
+        end = min(right if phase.end is None else phase.end, right) - left
+        if end < start:
+            continue
+        for p in plots:
+            p.add_layout(BoxAnnotation(left=start, right=end, fill_color=color,
+                                       fill_alpha=0.15, line_alpha=0))
+        plots[0].add_layout(Label(x=start, y=0, y_units='screen', text=phase.name,
+                                  text_font_size='8pt'))
+
+
+def plot_scaling(results, palette='Viridis', **kwargs):
+    """Plot the result of scaling studies in a bokeh plot.
+
+    Parameters
+    ----------
+    results : dict or list
+        Output of ScalingStudy.run (or Profiler.scaling_study), or a list of
+        them to compare, e.g. for different containers.
+    palette : string, optional
+        Name of the bokeh palette to use, must be a member of
+        bokeh.palettes.all_palettes.
+    **kwargs
+        Other keyword arguments, passed to bokeh.figure. These will override
+        all defaults set by plot_scaling.
+
+    Returns
+    -------
+    The completed bokeh plot object, with the speedup, the parallel efficiency
+    and the Karp-Flatt serial fraction side by side.
+    """
+    bp = import_required('bokeh.plotting', _BOKEH_MISSING_MSG)
+    from bokeh import palettes
+
+    if isinstance(results, dict):
+        results = [results]
+    defaults = dict(tools="save,reset,wheel_zoom,pan",
+                    toolbar_location='above',
+                    plot_width=400, plot_height=300)
+    defaults.update((k, v) for (k, v) in kwargs.items() if k in
+                    _get_figure_keywords())
+
+    counts = sorted(set(c for r in results for c in r['Counts']))
+    x_range = fix_bounds(0, 1.05 * max(counts), 1)
+    max_speedup = max(max(counts), max(s for r in results for s in r['Speedup']))
+    p1 = bp.figure(title="Speedup", x_range=x_range,
+                   y_range=fix_bounds(0, 1.1 * max_speedup, 1), **defaults)
+    p2 = bp.figure(title="Parallel efficiency", x_range=p1.x_range, y_range=(0, 1.2),
+                   **defaults)
+    p3 = bp.figure(title="Serial fraction (Karp-Flatt)", x_range=p1.x_range, **defaults)
+    p1.line(counts, counts, color='gray', line_dash='dashed', legend="Ideal")
+    p2.line([min(counts), max(counts)], [1, 1], color='gray', line_dash='dashed')
+
+    palette_lookup = palettes.all_palettes[palette]
+    keys = list(sorted(palette_lookup.keys()))
+    colors = palette_lookup[keys[min(bisect_left(keys, len(results)), len(keys) - 1)]]
+    for i, (r, color) in enumerate(zip(results, cycle(colors))):
+        name = r.get('Name', "{} scaling {}".format(r['Mode'], i + 1))
+        serial = [(c, f) for c, f in zip(r['Counts'], r['SerialFraction']) if f == f]
+        for p, values in ((p1, r['Speedup']), (p2, r['Efficiency'])):
+            p.line(r['Counts'], values, color=color, line_width=2, legend=name)
+            p.circle(r['Counts'], values, color=color, size=6)
+        if serial:
+            p3.line([c for c, f in serial], [f for c, f in serial], color=color,
+                    line_width=2, legend=name)
+            p3.circle([c for c, f in serial], [f for c, f in serial], color=color, size=6)
+    for p in (p1, p2, p3):
+        p.xaxis.axis_label = "Threads"
+        p.legend.location = 'top_left'
+    p2.legend.location = 'bottom_left'
+    return bp.gridplot([[p1, p2, p3]])
+
+
 def get_colors(palette, funcs):
     """Get a dict mapping funcs to colors from palette.
 
@@ -1,13 +1,34 @@
 from __future__ import absolute_import, division, print_function
 
+import json
+import logging
+import os
 from collections import namedtuple
-from itertools import starmap
 from timeit import default_timer
-from time import sleep
 from multiprocessing import Process, Pipe, current_process
+from threading import Thread
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:
+    from Queue import Empty, Full, Queue
 
 from importlib import import_module
-import psutil
+import numpy as np
+
+from .cgroup import CgroupSample, CgroupSampler
+from .procfs import get_sampler
+from .sample_buffer import SampleBuffer
+from .stacksampler import StackSampler
+from .allocations import AllocationTracer
+from .trace import TraceWriter, read_header, read_trace
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
 def import_required(mod_name, error_msg):
     """Attempt to import a required dependency.
     Raises a RuntimeError if the requested module is not available.
@@ -18,8 +39,35 @@ def import_required(mod_name, error_msg):
         raise RuntimeError(error_msg)
 
 
-# Stores execution data for each task
-ResourceData = namedtuple('ResourceData', ('time', 'cpu', 'pmem', 'rmem', 'umem', 'smem', 'rio', 'wio', 'nrio', 'nwio'))
+logger = logging.getLogger(__name__)
+
+# Stores execution data for each task.  ``cost`` is the time in seconds the
+# tracker spent taking that sample and ``nproc`` the number of processes sampled.
+# ``utime``/``stime`` (CPU seconds) and the voluntary/involuntary context switches
+# are cumulative, ``threads`` is the current thread count and ``iowait`` the
+# system-wide % of CPU time spent waiting for I/O since the previous sample.
+# The ``cg_`` fields are the counters of the cgroup the task runs in (NaN unless
+# cgroup sampling is enabled): memory, limit, page cache and anonymous memory
+# charged to it in MB, and the cumulative CPU seconds, CFS periods, throttled
+# periods, throttled seconds and MB read and written.
+ResourceData = namedtuple('ResourceData', ('time', 'cpu', 'pmem', 'rmem', 'umem', 'smem', 'rio', 'wio', 'nrio', 'nwio', 'cost', 'nproc',
+                                           'utime', 'stime', 'ctx_vol', 'ctx_invol', 'threads', 'iowait',
+                                           'cg_mem', 'cg_limit', 'cg_file', 'cg_anon', 'cg_cpu', 'cg_periods',
+                                           'cg_throttled', 'cg_throttle_time', 'cg_rio', 'cg_wio'))
+
+# Stores the execution data of a single process at one sample.  ``cpu_time`` is
+# the cumulative user + system CPU time of the process in seconds.
+ProcessData = namedtuple('ProcessData', ('time', 'pid', 'cpu', 'cpu_time', 'rmem', 'umem', 'smem', 'rio', 'wio',
+                                         'utime', 'stime', 'ctx_vol', 'ctx_invol', 'threads'))
+
+# Cumulative ProcSample counters, carried over when a process exits
+_CUMULATIVE = ('rio', 'wio', 'utime', 'stime', 'ctx_vol', 'ctx_invol')
+# Counters the kernel adds to the parent's when it reaps a child.  The utime and
+# stime of /proc/<pid>/stat and the context switches leave out children.
+_REAPED = ('rio', 'wio')
+
+# Reported when the cgroup is not sampled
+_NO_CGROUP = CgroupSample(*[float('nan')] * len(CgroupSample._fields))
 
 
 class ResourceProfiler(object):
@@ -29,6 +77,99 @@ class ResourceProfiler(object):
         1. Time in seconds since the epoch
         2. Memory usage in MB
         3. % CPU usage
+        4. Time spent taking the sample
+
+    The profiled process and all of its descendants are sampled, including
+    processes started after the profiler (the process tree is walked on every
+    sample).  The cumulative I/O of a process that exits is carried over into
+    later samples so the I/O totals never decrease; processes that start and
+    exit between two samples are not seen.
+
+    Parameters
+    ----------
+    dt : float, optional
+        Requested time between samples in seconds.
+    cheap : bool, optional
+        Skip the PSS/USS measurement, which is the most expensive part of a
+        sample for processes with large address spaces.  ``umem`` and ``smem``
+        are reported as NaN.
+
+    stream : bool, optional
+        Deliver samples while the profiler is running.  The tracker flushes a
+        chunk of samples every ``chunk_size`` samples or ``flush_interval``
+        seconds, whichever comes first, and each chunk is passed to the
+        ``on_chunk`` callbacks and to every ``iter_chunks`` iterator.
+    chunk_size : int, optional
+        Maximum number of samples per streamed chunk.
+    flush_interval : float, optional
+        Maximum time in seconds between streamed chunks.
+    on_chunk : callable or list of callables, optional
+        Called from a background thread with each streamed chunk (a
+        ``SampleBuffer``).
+    keep : bool, optional
+        Accumulate the samples in ``results``.  Set to False for long streamed
+        runs where the consumers hold whatever they need, so the memory used by
+        the profiler stays bounded.
+    trace_path : str, optional
+        Also append every sample to this memory-mapped trace file as it is
+        taken, so the samples survive if the profiled task or the parent
+        process dies.  Load it back with ``ResourceProfiler.from_trace``.
+        Per-process samples go to ``<trace_path>.procs`` and the process table
+        to ``<trace_path>.pids``.  Every run of the profiler gets its own
+        files, so the runs of a persistent profiler do not overwrite each
+        other: the first run writes ``trace_path``, the next ones
+        ``<trace_path>.1``, ``<trace_path>.2`` and so on.  ``trace_file`` is
+        the trace file of the current or last run.  Files left by another
+        profiler under the same names are overwritten.
+    adaptive : bool, optional
+        Adapt the time between samples to how fast the metrics change: it is
+        halved (down to ``dt_min``) when CPU or memory change by more than
+        ``threshold`` between samples and grows by half (up to ``dt_max``)
+        while they are steady.  Every sample keeps its exact timestamp, so
+        statistics must be weighted by the time between samples.
+    dt_min, dt_max : float, optional
+        Bounds of the adaptive interval.  Default to ``dt / 10`` and
+        ``dt * 10``.
+    threshold : float, optional
+        Change that counts as fast: a fraction of one core for CPU and a
+        fraction of the current value for memory.
+    backend : {'process', 'thread'}, optional
+        Run the tracker in a separate process (default) or in a daemon thread
+        of the current process.  The thread backend starts much faster, which
+        suits short functions and high-rate microbenchmarks; the results are
+        the same except that the tracker's own CPU use is included.
+    persistent : bool, optional
+        Keep the tracker running after the context manager exits so the next
+        run starts without creating a new one.  Call ``close`` when done.
+    verbose : bool, optional
+        Print the psutil version and tracker PID when a tracker starts.
+    cgroup : bool or str, optional
+        Also sample the cgroup of the profiled process into the ``cg_``
+        columns: the memory charged to it (including page cache), its memory
+        limit, CPU throttling and block I/O.  A string is used as the mount
+        point of the cgroup filesystem instead of ``/sys/fs/cgroup``.
+    stack_interval : float, optional
+        Also sample the Python stacks of the threads of the profiled process
+        every ``stack_interval`` seconds while the context manager is active.
+        The ``StackSampler`` is kept in ``stacks``; see ``peak_stacks`` for
+        the code that was running when a resource peaked.
+    allocation_interval : float, optional
+        Also trace the Python memory allocations of the profiled process with
+        tracemalloc, taking a snapshot every ``allocation_interval`` seconds
+        and at new peaks of its RSS.  The ``AllocationTracer`` is kept in
+        ``allocations``.  See ``benchmark.allocations`` for the overhead.
+    per_process : bool, optional
+        Also record every sampled process separately.  The samples are kept
+        in ``process_results`` (a ``SampleBuffer`` of ``ProcessData``, one row
+        per process and sample) and ``processes`` maps each PID to its command
+        ``name`` and parent PID ``ppid``.  Streamed chunks passed to callbacks
+        only hold the summed samples.  Defaults to False, as a row per process
+        and sample makes the results, and the records stored from them, many
+        times larger.
+
+    After a run ``results`` is a ``SampleBuffer``: each metric of
+    ``ResourceData`` is available as a NumPy array (``prof.results.cpu``,
+    ``prof.results['rmem']``) and iterating it yields ``ResourceData`` rows.
 
     Examples
     --------
@@ -58,37 +199,208 @@ class ResourceProfiler(object):
     the duration of the enclosed block. In contrast, when registered globally
     data will only be collected while a dask scheduler is active.
     """
-    def __init__(self, dt=1):
+    # Maximum number of chunks waiting in each ``iter_chunks`` iterator, and
+    # seconds delivery waits for its consumer to make room before the iterator
+    # is detached from the profiler
+    max_pending_chunks = 64
+    chunk_timeout = 5.
+
+    def __init__(self, dt=1, cheap=False, stream=False, chunk_size=1024, flush_interval=10.,
+                 on_chunk=None, keep=True, trace_path=None, per_process=False, adaptive=False,
+                 dt_min=None, dt_max=None, threshold=0.1, backend='process', persistent=False,
+                 verbose=False, cgroup=False, stack_interval=None, allocation_interval=None):
 #         print("init rprof")
+        self._tracker = None
+        if backend not in _TRACKERS:
+            raise ValueError("Unknown backend '{}', use one of {}".format(backend, sorted(_TRACKERS)))
         self._dt = dt
+        self._backend = backend
+        self._persistent = persistent
+        self._verbose = verbose
+        self._adaptive = adaptive
+        self._dt_min = dt / 10. if dt_min is None else dt_min
+        self._dt_max = dt * 10. if dt_max is None else dt_max
+        self._threshold = threshold
+        self._trace_path = trace_path
+        self._runs = 0
+        self.trace_file = None
+        self._per_process = per_process
+        self._cgroup = cgroup
+        self._stack_interval = stack_interval
+        self._allocation_interval = allocation_interval
+        self._cheap = cheap
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._flush_interval = flush_interval
+        self._keep = keep
+        if on_chunk is None:
+            self._callbacks = []
+        elif callable(on_chunk):
+            self._callbacks = [on_chunk]
+        else:
+            self._callbacks = list(on_chunk)
+        self._queues = []
+        self._reader = None
         self._entered = False
-        self._tracker = None
-        self.results = []
+        self.clear()
+
+    def __getstate__(self):
+        # Threads, queues and callbacks only live for the duration of a run
+        state = self.__dict__.copy()
+        state.update(_tracker=None, _reader=None, _queues=[], _callbacks=[])
+        return state
 
     def _is_running(self):
         return self._tracker is not None and self._tracker.is_alive()
 
     def _start_collect(self):
         if not self._is_running():
-            self._tracker = _Tracker(self._dt)
+            chunk_size = self._chunk_size if self._stream else None
+            tracker = _TRACKERS[self._backend]
+            self._tracker = tracker(self._dt, cheap=self._cheap, chunk_size=chunk_size,
+                                    flush_interval=self._flush_interval,
+                                    per_process=self._per_process,
+                                    verbose=self._verbose, cgroup=self._cgroup)
+            if self._adaptive:
+                self._tracker.interval = _AdaptiveInterval(self._dt, self._dt_min, self._dt_max,
+                                                           self._threshold)
             self._tracker.start()
+        if self._trace_path:
+            self.trace_file = (self._trace_path if not self._runs else
+                               '{}.{}'.format(self._trace_path, self._runs))
+        self._runs += 1
         self._tracker.parent_conn.send('collect')
+        self._tracker.parent_conn.send(self.trace_file)
+        if self._stream:
+            self._reader = Thread(target=self._read_chunks)
+            self._reader.daemon = True
+            self._reader.start()
 
     def _stop_collect(self):
         if self._is_running():
             self._tracker.parent_conn.send('send_data')
-            self.results.extend( starmap(ResourceData, self._tracker.parent_conn.recv()) )
+            if self._reader is not None:
+                self._reader.join()
+                self._reader = None
+            else:
+                self._read_chunks()
+
+    def _recv_chunks(self):
+        conn = self._tracker.parent_conn
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, IOError, OSError):
+                return
+            if msg == 'done':
+                return
+            chunk = SampleBuffer.recv(conn, row_type=ResourceData)
+            proc_chunk = SampleBuffer.recv(conn, row_type=ProcessData)
+            table = conn.recv()
+            core_chunk = SampleBuffer.recv(conn)
+            yield chunk, proc_chunk, table, core_chunk
+
+    def _read_chunks(self):
+        """Receive chunks from the tracker until the end of the run"""
+        try:
+            for chunk, proc_chunk, table, core_chunk in self._recv_chunks():
+                if self._keep:
+                    self.results.extend(chunk)
+                    self.process_results.extend(proc_chunk)
+                    if self.core_results is None:
+                        self.core_results = core_chunk
+                    else:
+                        self.core_results.extend(core_chunk)
+                self.processes.update(table)
+                for callback in self._callbacks:
+                    callback(chunk)
+                for queue in list(self._queues):
+                    self._deliver(queue, chunk)
+        finally:
+            for queue in list(self._queues):
+                self._deliver(queue, None)
+            self._queues = []
+
+    def _deliver(self, queue, chunk):
+        """Put chunk in the queue of an ``iter_chunks`` iterator, detaching the
+        iterator if its consumer is too slow or gone, rather than blocking the
+        run on it"""
+        try:
+            queue.put(chunk, timeout=self.chunk_timeout)
+            return
+        except Full:
+            pass
+        if queue in self._queues:
+            self._queues.remove(queue)
+        logger.warning("Chunk consumer made no room for %.1f s, detaching it: "
+                       "its pending chunks are dropped and its iterator stops",
+                       self.chunk_timeout)
+        # Only this thread puts, so once emptied the end marker fits
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
+            pass
+        queue.put_nowait(None)
+
+    def add_callback(self, callback):
+        """Call ``callback(chunk)`` for every chunk delivered from now on"""
+        self._callbacks.append(callback)
+
+    def iter_chunks(self):
+        """Iterate over chunks of samples as they are delivered.
+
+        The iterator only sees chunks delivered after it was created and stops
+        at the end of the current run.  Each chunk is a ``SampleBuffer`` with
+        the columns of ``ResourceData``.  An iterator whose consumer falls
+        ``max_pending_chunks`` behind for ``chunk_timeout`` seconds, e.g. one
+        that was abandoned, is detached: its pending chunks are dropped and it
+        stops early.
+
+        Examples
+        --------
+
+        >>> prof = ResourceProfiler(dt=0.1, stream=True, flush_interval=5)  # doctest: +SKIP
+        >>> chunks = prof.iter_chunks()  # doctest: +SKIP
+        >>> consumer = Thread(target=lambda: [store(c) for c in chunks])  # doctest: +SKIP
+        """
+        queue = Queue(self.max_pending_chunks)
+        self._queues.append(queue)
+
+        def chunks():
+            while True:
+                chunk = queue.get()
+                if chunk is None:
+                    return
+                yield chunk
+        return chunks()
 
     def __enter__(self):
         self._entered = True
         self.clear()
         self._start_collect()
+        if self.allocations is not None:
+            self.allocations.start()
+        if self.stacks is not None:
+            # Leave out the profiler's own threads, those of this run only: the
+            # threads of earlier runs of a persistent profiler are gone
+            threads = [self._tracker, self._reader]
+            if self.allocations is not None:
+                threads.append(self.allocations._thread)
+            self.stacks.exclude = set(thread.ident for thread in threads
+                                      if isinstance(thread, Thread))
+            self.stacks.start()
         return self
 
     def __exit__(self, *args):
         self._entered = False
+        if self.allocations is not None:
+            self.allocations.stop()
+        if self.stacks is not None:
+            self.stacks.stop()
         self._stop_collect()
-        self.close()
+        if not self._persistent:
+            self.close()
 #         super(ResourceProfiler, self).__exit__(*args)
 
     def _start(self, dsk):
@@ -107,11 +419,128 @@ class ResourceProfiler(object):
     __del__ = close
 
     def clear(self):
-        self.results = []
+        self.results = SampleBuffer(ResourceData._fields, row_type=ResourceData)
+        self.process_results = SampleBuffer(ProcessData._fields, row_type=ProcessData)
+        self.processes = {}
+        # Per-core utilisation (%): columns time, core0, core1, ...
+        self.core_results = None
+        # Last lines of output (LogLine) of a script run by benchmark.profile_script
+        self.log = []
+        # Phases marked during a run by benchmark.profile_function or profile_script
+        self.phases = []
+        self.stacks = StackSampler(self._stack_interval) if self._stack_interval else None
+        self.allocations = (AllocationTracer(self._allocation_interval)
+                            if self._allocation_interval else None)
+
+    @classmethod
+    def from_trace(cls, path):
+        """Create a profiler holding the samples recorded in a trace file.
+
+        Use this to recover the results of a run that was recorded with
+        ``trace_path`` but did not finish, e.g. because the task was killed.
+        """
+        prof = cls(dt=read_header(path)['dt'])
+        prof.results = _with_fields(read_trace(path), ResourceData)
+        if os.path.exists(path + '.procs'):
+            prof.process_results = _with_fields(read_trace(path + '.procs'), ProcessData)
+        if os.path.exists(path + '.cores'):
+            prof.core_results = read_trace(path + '.cores')
+        if os.path.exists(path + '.pids'):
+            with open(path + '.pids') as f:
+                for line in f:
+                    try:
+                        info = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash
+                        continue
+                    prof.processes[info.pop('pid')] = info
+        return prof
+
+    def top_processes(self, metric='rmem', n=5):
+        """Rank the processes by their use of a resource.
+
+        Parameters
+        ----------
+        metric : str
+            ``'cpu'`` ranks by CPU seconds used during the run, ``'rmem'``,
+            ``'umem'`` and ``'smem'`` by peak memory (MB) and ``'rio'`` and
+            ``'wio'`` by the MB read or written during the run.
+        n : int, optional
+            Number of processes to return.
+
+        Returns
+        -------
+        list of dicts with the ``pid``, ``name``, ``ppid`` and ``value`` of the
+        top ``n`` processes, largest first.
+        """
+        procs = self.process_results
+        if not procs:
+            return []
+        pids, inverse = np.unique(procs.pid, return_inverse=True)
+        column = procs.cpu_time if metric == 'cpu' else procs.column(metric)
+        peak = np.full(len(pids), -np.inf)
+        np.maximum.at(peak, inverse, column)
+        if metric in ('cpu', 'rio', 'wio'):
+            # counters are cumulative, use what was added while profiling
+            first = np.full(len(pids), np.inf)
+            np.minimum.at(first, inverse, column)
+            value = peak - first
+        else:
+            value = peak
+        top = []
+        for i in np.argsort(-value)[:n]:
+            pid = int(pids[i])
+            info = self.processes.get(pid, {})
+            top.append({'pid': pid, 'name': info.get('name', ''), 'ppid': info.get('ppid'),
+                        'value': float(value[i])})
+        return top
+
+    def peak_stacks(self, metric='rmem', n=5):
+        """Return the Python stacks sampled while a resource rose to its peak.
+
+        Parameters
+        ----------
+        metric : str, optional
+            Column of ``ResourceData`` to find the peak of.
+        n : int, optional
+            Number of stacks to return.
+
+        Returns
+        -------
+        list of dicts with the collapsed ``stack`` (outermost frame first) and
+        the number of samples, ``count``, taken between the peak sample and the
+        sample before it, most frequent first.  Empty without stack samples.
+        """
+        if self.stacks is None or not self.results:
+            return []
+        values = self.results.column(metric)
+        if np.all(np.isnan(values)):
+            return []
+        i = int(np.nanargmax(values))
+        time = self.results.time
+        start = time[i - 1] if i > 0 else time[i] - self._dt
+        return [{'stack': stack, 'count': count}
+                for stack, count in self.stacks.collapsed(start, time[i])[:n]]
+
+    def sampling_stats(self):
+        """Summarise the cost of sampling.
+
+        Returns
+        -------
+        dict with the achieved sampling ``rate`` (Hz) and the ``mean_cost`` and
+        ``max_cost`` of a single sample (s).
+        """
+        if len(self.results) < 2:
+            return {'rate': 0.0, 'mean_cost': 0.0, 'max_cost': 0.0}
+        costs = self.results.cost
+        span = self.results.time[-1] - self.results.time[0]
+        return {'rate': float((len(self.results) - 1) / span) if span > 0 else 0.0,
+                'mean_cost': float(costs.mean()),
+                'max_cost': float(costs.max())}
 
     def _plot(self, **kwargs):
         from .profile_visualize import plot_resources
-        return plot_resources(self.results, **kwargs)
+        return plot_resources(self.results, profiler=self, **kwargs)
 
     def visualize(self, **kwargs):
         """Visualize the profiling run in a bokeh plot.
@@ -124,17 +553,172 @@ class ResourceProfiler(object):
         return visualize(self, **kwargs)
 
 
-class _Tracker(Process):
-    """Background process for tracking resource usage"""
-    def __init__(self, dt=1):
+class _TreeSampler(object):
+    """Sample a process and its descendants into ``ResourceData`` rows"""
+    def __init__(self, root, exclude=(), cheap=False, cgroup=None):
+        self.root = root
+        self.exclude = set(exclude)
+        self.sampler = get_sampler(cheap)
+        # CgroupSampler of the cgroup to sample alongside the processes, or None
+        self.cgroup = cgroup
+        self.last_cost = 0.0
+        # Samples of the previous tick and the final counters of exited processes
+        self._last = {}
+        self._exited = dict.fromkeys(_CUMULATIVE, 0)
+        # pid -> I/O of exited descendants that its own counters have not
+        # absorbed yet
+        self._pending = {}
+        self._known = {}
+        # System-wide utilisation of each core at the last sample; the first call
+        # also sets the baseline for the first sample
+        self.last_cores = self.sampler.system_cpu()[1]
+
+    def reset(self):
+        """Start a new run: report every process as new again"""
+        self._known = {}
+
+    def process_rows(self, time):
+        """Return a ``ProcessData`` row for every process of the last sample"""
+        return [(time, p.pid, p.cpu, p.cpu_time, p.rss / 1e6, p.uss / 1e6, p.pss / 1e6,
+                 p.rio / 1e6, p.wio / 1e6, p.utime, p.stime, p.ctx_vol, p.ctx_invol, p.threads)
+                for p in self._last.values()]
+
+    def new_processes(self):
+        """Return ``{pid: {'name', 'ppid'}}`` for processes first seen, or renamed by an
+        exec, since the last call"""
+        new = {}
+        for pid, p in self._last.items():
+            if self._known.get(pid) != p.name:
+                self._known[pid] = p.name
+                new[pid] = {'name': p.name, 'ppid': p.ppid}
+        return new
+
+    def _carry_exited(self, current):
+        """Carry over the counters of the processes that exited since the last tick.
+
+        When a child is reaped the kernel adds its I/O to its parent's, so the
+        I/O of an exited process is kept pending on its nearest live ancestor
+        in the tree until that ancestor's counters have grown by as much, and
+        only carried over for good when no such ancestor is left.
+        """
+        for pid, p in self._last.items():
+            if pid in current:
+                continue
+            ancestor = p.ppid
+            while ancestor in self._last and ancestor not in current:
+                ancestor = self._last[ancestor].ppid
+            pending = self._pending.pop(pid, dict.fromkeys(_REAPED, 0))
+            for field in _CUMULATIVE:
+                value = getattr(p, field) + pending.get(field, 0)
+                if field in _REAPED and ancestor in current:
+                    self._pending.setdefault(ancestor, dict.fromkeys(_REAPED, 0))[field] += value
+                else:
+                    self._exited[field] += value
+        for pid, pending in list(self._pending.items()):
+            p, last = current[pid], self._last.get(pid)
+            if last is None:
+                continue
+            for field in _REAPED:
+                pending[field] -= min(pending[field], max(getattr(p, field) - getattr(last, field), 0))
+            if not any(pending.values()):
+                del self._pending[pid]
+
+    def sample(self):
+        """Take one sample of the process tree, summed into a single row"""
+        tic = default_timer()
+        pids = self.sampler.descendants(self.root, self.exclude)
+        procs, (nio1, nio2) = self.sampler.sample(pids)
+        iowait, self.last_cores = self.sampler.system_cpu()
+        cg = self.cgroup.sample() if self.cgroup is not None else _NO_CGROUP
+        current = dict((p.pid, p) for p in procs)
+        self._carry_exited(current)
+        self._last = current
+
+        cpu = pmem = rmem = umem = smem = threads = 0
+        total = dict(self._exited)
+        for pending in self._pending.values():
+            for field in _REAPED:
+                total[field] += pending[field]
+        for p in procs:
+            cpu += p.cpu
+            pmem += p.pmem
+            rmem += p.rss
+            umem += p.uss
+            smem += p.pss
+            threads += p.threads
+            for field in _CUMULATIVE:
+                total[field] += getattr(p, field)
+        self.last_cost = default_timer() - tic
+        return (tic, cpu, pmem, rmem / 1e6, umem / 1e6, smem / 1e6, total['rio'] / 1e6,
+                total['wio'] / 1e6, nio1 / 1e6, nio2 / 1e6, self.last_cost, len(procs),
+                total['utime'], total['stime'], total['ctx_vol'], total['ctx_invol'], threads,
+                iowait, cg.mem / 1e6, cg.limit / 1e6, cg.file / 1e6, cg.anon / 1e6, cg.cpu_time,
+                cg.nr_periods, cg.nr_throttled, cg.throttled_time, cg.rio / 1e6, cg.wio / 1e6)
+
+
+class _AdaptiveInterval(object):
+    """Choose the time to the next sample from how fast the metrics change"""
+    def __init__(self, dt, dt_min, dt_max, threshold=0.1, backoff=1.5):
+        self.dt = dt
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        self.threshold = threshold
+        self.backoff = backoff
+        self._last = None
+
+    def next(self, row):
+        """Return the interval to wait after the sample ``row``"""
+        if self._last is not None:
+            cpu, rmem = self._last
+            change = max(abs(row.cpu - cpu) / 100., abs(row.rmem - rmem) / max(rmem, 1.))
+            if change > self.threshold:
+                self.dt = max(self.dt_min, self.dt / 2.)
+            elif change < self.threshold / 4.:
+                self.dt = min(self.dt_max, self.dt * self.backoff)
+        self._last = (row.cpu, row.rmem)
+        return self.dt
+
+
+def _with_fields(samples, row_type):
+    """Samples read from a trace with the columns of row_type; columns added to
+    row_type after the trace was written are NaN"""
+    return SampleBuffer.from_rows(
+        row_type._fields,
+        np.column_stack([samples.column(c) if c in samples.columns else np.full(len(samples), np.nan)
+                         for c in row_type._fields]),
+        row_type=row_type)
+
+
+def _core_columns(ncores):
+    """Columns of the per-core utilisation samples: time, core0, core1, ..."""
+    return ('time',) + tuple('core{}'.format(i) for i in range(ncores))
+
+
+class _TrackerBase(object):
+    """Sampling loop shared by the tracker backends.
+
+    The owner talks to the tracker through ``parent_conn`` in the same way
+    whether it runs in a separate process or in a thread.
+    """
+    def __init__(self, dt=1, cheap=False, chunk_size=None, flush_interval=10.,
+                 per_process=False, verbose=False, cgroup=False):
         psutil = import_required("psutil", "Tracking resource usage requires "
                                            "`psutil` to be installed")
-        print("psutil version: " + psutil.__version__)
-        Process.__init__(self)
+        if verbose:
+            print("psutil version: " + psutil.__version__)
         self.daemon = True
         self.dt = dt
-        self.parent = psutil.Process(current_process().pid)
-        print( "Tracker PID: " + str( current_process().pid ) )
+        self.cheap = cheap
+        # Stream chunks of at most chunk_size samples, None sends at the end only
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.per_process = per_process
+        self.cgroup = cgroup
+        # Replaced by an _AdaptiveInterval for adaptive sampling
+        self.interval = None
+        self.parent_pid = current_process().pid
+        if verbose:
+            print( "Tracker PID: " + str( current_process().pid ) )
         self.parent_conn, self.child_conn = Pipe()
 
     def shutdown(self):
@@ -143,50 +727,146 @@ class _Tracker(Process):
             self.parent_conn.close()
         self.join()
 
-    def _update_pids(self, pid):
-        return [self.parent] + [p for p in self.parent.children()
-                                if p.pid != pid and p.status() != 'zombie']
+    def _exclude(self):
+        """PIDs to leave out of the sampled process tree"""
+        return ()
+
+    def _detach(self):
+        """Called first in ``run``"""
+
+    def _owner_alive(self):
+        """Whether the process that started the tracker is still running"""
+        return True
+
+    def _cgroup_sampler(self):
+        if not self.cgroup:
+            return None
+        root = self.cgroup if isinstance(self.cgroup, string_types) else '/sys/fs/cgroup'
+        if not CgroupSampler.available(root):
+            return None
+        return CgroupSampler(root, pid=self.parent_pid)
+
+    def _flush(self, data, proc_data, table, core_data):
+        if data:
+            self.child_conn.send('chunk')
+            data.send(self.child_conn)
+            proc_data.send(self.child_conn)
+            self.child_conn.send(table)
+            core_data.send(self.child_conn)
+            data.clear()
+            proc_data.clear()
+            table.clear()
+            core_data.clear()
+
+    def _open_traces(self, path, ncores):
+        return (TraceWriter(path, ResourceData._fields, self.dt),
+                TraceWriter(path + '.procs', ProcessData._fields, self.dt),
+                open(path + '.pids', 'w'),
+                TraceWriter(path + '.cores', _core_columns(ncores), self.dt))
+
+    def _close_traces(self, traces):
+        for trace in traces:
+            trace.close()
 
     def run(self):
-        pid = current_process()
-        data = []
+        self._detach()
+        sampler = _TreeSampler(self.parent_pid, exclude=self._exclude(), cheap=self.cheap,
+                               cgroup=self._cgroup_sampler())
+        data = SampleBuffer(ResourceData._fields)
+        proc_data = SampleBuffer(ProcessData._fields)
+        core_data = SampleBuffer(_core_columns(len(sampler.last_cores)))
+        table = {}
+        trace = None
         while True:
             try:
                 msg = self.child_conn.recv()
             except KeyboardInterrupt:
                 continue
+            except EOFError:
+                # The owner closed its end of the pipe or died
+                break
             if msg == 'shutdown':
                 break
             elif msg == 'collect':
-                ps = self._update_pids(pid)
-                while not data or not self.child_conn.poll():
-                    tic = default_timer()
-                    cpu = pmem = rmem = umem = smem = ior = iow = 0
-                    for p in ps:
-                        try:
-                            cpu1 = p.cpu_percent()
-                            mem1 = p.memory_percent()
-                            mem2 = p.memory_full_info().rss  
-                            mem3 = p.memory_full_info().uss
-                            mem4 = p.memory_full_info().pss
-                            io1 = p.io_counters().read_bytes
-                            io2 = p.io_counters().write_bytes
-                        except Exception: # could be a few different exceptions
-                            pass
-                        else:
-                            # Only increment if both were successful
-                            cpu += cpu1
-                            pmem += mem1
-                            rmem += mem2
-                            umem += mem3
-                            smem += mem4
-                            ior += io1
-                            iow += io2
-                    nio1 = psutil.net_io_counters().bytes_recv
-                    nio2 = psutil.net_io_counters().bytes_sent
-                    data.append((tic, cpu, pmem, rmem / 1e6 , umem / 1e6, smem / 1e6, ior / 1e6, iow / 1e6, nio1 / 1e6, nio2 / 1e6))
-                    sleep(self.dt)
+                # followed by the trace file of the run, or None
+                trace_path = self.child_conn.recv()
+                sampler.reset()
+                if trace_path and trace is None:
+                    trace, proc_trace, pid_trace, core_trace = traces = self._open_traces(
+                        trace_path, len(sampler.last_cores))
+                last_flush = default_timer()
+                sampled = False
+                while self._owner_alive() and (not sampled or not self.child_conn.poll()):
+                    row = sampler.sample()
+                    data.append(row)
+                    core_row = [row[0]] + sampler.last_cores
+                    core_data.append(core_row)
+                    if trace is not None:
+                        trace.append(row)
+                        core_trace.append(core_row)
+                    if self.per_process:
+                        new = sampler.new_processes()
+                        table.update(new)
+                        for proc_row in sampler.process_rows(row[0]):
+                            proc_data.append(proc_row)
+                            if trace is not None:
+                                proc_trace.append(proc_row)
+                        if trace is not None and new:
+                            for pid, info in new.items():
+                                pid_trace.write(json.dumps(dict(info, pid=pid)) + '\n')
+                            pid_trace.flush()
+                    sampled = True
+                    if self.chunk_size and (len(data) >= self.chunk_size or
+                                            default_timer() - last_flush >= self.flush_interval):
+                        self._flush(data, proc_data, table, core_data)
+                        last_flush = default_timer()
+                    dt = self.interval.next(ResourceData(*row)) if self.interval else self.dt
+                    # Wait for the next sample, waking up early for a message
+                    self.child_conn.poll(max(0, dt - sampler.last_cost))
+                if not self._owner_alive():
+                    break
             elif msg == 'send_data':
-                self.child_conn.send(data)
-                data = []
-        self.child_conn.close()
\ No newline at end of file
+                self._flush(data, proc_data, table, core_data)
+                self.child_conn.send('done')
+                if trace is not None:
+                    self._close_traces(traces)
+                    trace = None
+        if trace is not None:
+            self._close_traces(traces)
+        self.child_conn.close()
+
+
+class _Tracker(_TrackerBase, Process):
+    """Background process for tracking resource usage"""
+    def __init__(self, *args, **kwargs):
+        Process.__init__(self)
+        _TrackerBase.__init__(self, *args, **kwargs)
+
+    def _exclude(self):
+        # Called in the tracker process, which must not measure itself
+        return (current_process().pid,)
+
+    def _detach(self):
+        # Close the inherited copy of the owner's end, so that recv sees EOF
+        # when the owner dies
+        self.parent_conn.close()
+
+    def _owner_alive(self):
+        # The tracker is adopted by init or a subreaper when the owner dies
+        # without shutting it down, e.g. when it is killed
+        from psutil import pid_exists
+        return os.getppid() == self.parent_pid and pid_exists(self.parent_pid)
+
+
+class _ThreadTracker(_TrackerBase, Thread):
+    """Background thread for tracking resource usage of the current process.
+
+    Starting a thread is much cheaper than starting a process, but the
+    tracker's own CPU time is included in the samples (see ``cost``).
+    """
+    def __init__(self, *args, **kwargs):
+        Thread.__init__(self)
+        _TrackerBase.__init__(self, *args, **kwargs)
+
+
+_TRACKERS = {'process': _Tracker, 'thread': _ThreadTracker}
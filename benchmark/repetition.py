@@ -0,0 +1,167 @@
+""" Repeated runs with robust statistics
+
+A single run of a benchmark says little: the first runs pay for cold caches
+and imports, and later runs are disturbed by whatever else the machine does.
+``Repetition`` runs an execution a number of times, discards warm-up runs,
+rejects outliers by their distance from the median in units of the median
+absolute deviation (MAD), and summarises the run time and every numeric
+statistic of ``Profiler.compute_stats`` with the median, MAD and a bootstrap
+confidence interval of the median.  It can keep adding runs until the
+confidence interval of the run time is tight enough.
+
+Example:
+    rep = Repetition(myprofile, warmup=1, runs=5, max_runs=30, rel_ci=0.02)
+    result = rep.run(myprofile.execute_function, test_function)
+    print(result['RunTime']['median'], result['RunTime']['ci'])
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numbers
+
+import numpy as np
+
+# Scales the MAD to the standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+# Scales the mean absolute deviation in the same way
+MEANAD_SCALE = 1.2533
+
+
+def mad(values):
+    """Median absolute deviation, scaled to estimate the standard deviation"""
+    values = np.asarray(values, dtype=float)
+    return MAD_SCALE * np.median(np.abs(values - np.median(values)))
+
+
+def inliers(values, k=3.):
+    """Return a mask of the values within ``k`` scaled MADs of the median.
+
+    When more than half of the values are equal the MAD is zero, and the
+    scaled mean absolute deviation is used instead.  All values are kept when
+    both are zero.
+    """
+    values = np.asarray(values, dtype=float)
+    deviation = np.abs(values - np.median(values))
+    spread = mad(values)
+    if spread == 0:
+        spread = MEANAD_SCALE * np.mean(deviation)
+    if spread == 0:
+        return np.ones(len(values), dtype=bool)
+    return deviation <= k * spread
+
+
+def bootstrap_ci(values, confidence=0.95, resamples=1000, statistic=np.median, seed=0):
+    """Percentile bootstrap confidence interval of a statistic.
+
+    Returns:
+        tuple: (low, high)
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return (float(values[0]), float(values[0])) if len(values) else (np.nan, np.nan)
+    rng = np.random.RandomState(seed)
+    samples = values[rng.randint(0, len(values), size=(resamples, len(values)))]
+    estimates = statistic(samples, axis=1)
+    alpha = (1 - confidence) / 2.
+    return (float(np.percentile(estimates, 100 * alpha)),
+            float(np.percentile(estimates, 100 * (1 - alpha))))
+
+
+def summarize(values, k=3., confidence=0.95, resamples=1000):
+    """Robust summary of repeated measurements of one metric.
+
+    Returns:
+        dict: with the 'median', 'mad', 'mean' and 'std' of the inliers, the
+        bootstrap confidence interval 'ci' of their median, the number of
+        inliers 'n' and the indices of the rejected 'outliers'.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {'median': np.nan, 'mad': np.nan, 'mean': np.nan, 'std': np.nan,
+                'ci': (np.nan, np.nan), 'n': 0, 'outliers': []}
+    mask = inliers(values, k)
+    kept = values[mask]
+    return {'median': float(np.median(kept)),
+            'mad': float(mad(kept)),
+            'mean': float(np.mean(kept)),
+            'std': float(np.std(kept, ddof=1)) if len(kept) > 1 else 0.,
+            'ci': bootstrap_ci(kept, confidence, resamples),
+            'n': int(len(kept)),
+            'outliers': np.flatnonzero(~mask).tolist()}
+
+
+def _metrics(stats):
+    """The numeric, scalar statistics of a run"""
+    return dict((key, float(value)) for key, value in stats.items()
+                if isinstance(value, numbers.Number) and not isinstance(value, bool))
+
+
+class Repetition(object):
+    """Run an execution repeatedly and summarise the results.
+
+    Args:
+        profiler (Profiler): The profiler whose execute_* method is repeated.
+        warmup (int, optional): Runs discarded before measuring.  Defaults to 1.
+        runs (int, optional): Measured runs.  Defaults to 5.
+        max_runs (int, optional): Keep adding measured runs, up to this many,
+            until the confidence interval of the median run time is within
+            ``rel_ci`` of the median.  Defaults to ``runs`` (no adaptive stop).
+        rel_ci (float, optional): Target width of the confidence interval
+            relative to the median.  Defaults to 0.05.
+        confidence (float, optional): Confidence level of the intervals.
+            Defaults to 0.95.
+        k (float, optional): Runs further than ``k`` scaled MADs from the median
+            are rejected as outliers.  Defaults to 3.
+    """
+
+    def __init__(self, profiler, warmup=1, runs=5, max_runs=None, rel_ci=0.05, confidence=0.95,
+                 k=3.):
+        self.profiler = profiler
+        self.warmup = warmup
+        self.runs = runs
+        self.max_runs = runs if max_runs is None else max(max_runs, runs)
+        self.rel_ci = rel_ci
+        self.confidence = confidence
+        self.k = k
+
+    def _run_time(self):
+        return float(self.profiler.bench_dict['RunTime'])
+
+    def converged(self, run_times):
+        """Whether the confidence interval of the median run time is tight enough"""
+        summary = summarize(run_times, self.k, self.confidence)
+        low, high = summary['ci']
+        return summary['median'] > 0 and (high - low) / summary['median'] <= self.rel_ci
+
+    def run(self, execute, *args):
+        """Repeat ``execute(*args)``, e.g. ``profiler.execute_function``.
+
+        Returns:
+            dict: The grouped result: the number of 'Warmup' and measured
+            'Runs', whether the run time 'Converged', the 'RunTime' summary
+            (see summarize), a summary per numeric statistic in 'Metrics' and
+            the raw values of every run in 'Values'.
+        """
+        for i in range(self.warmup):
+            execute(*args)
+
+        run_times = []
+        values = {}
+        while len(run_times) < self.max_runs:
+            execute(*args)
+            run_times.append(self._run_time())
+            for key, value in _metrics(self.profiler.stats).items():
+                values.setdefault(key, []).append(value)
+            if len(run_times) >= self.runs and (len(run_times) == self.max_runs or
+                                                self.converged(run_times)):
+                break
+
+        return {'Warmup': self.warmup,
+                'Runs': len(run_times),
+                'Converged': self.converged(run_times),
+                'RunTime': summarize(run_times, self.k, self.confidence),
+                'Metrics': dict((key, summarize(v, self.k, self.confidence))
+                                for key, v in values.items()),
+                'Values': dict(values, RunTime=run_times)}
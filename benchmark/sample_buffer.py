@@ -0,0 +1,151 @@
+""" Columnar storage for resource samples
+
+``SampleBuffer`` keeps samples in a preallocated 2D NumPy array with one
+contiguous row per column (metric), doubling its capacity when it fills up.
+Appending a sample is a single slice assignment and reading a metric is a view,
+so no per-sample Python objects are kept.
+
+Buffers can be moved between processes over a ``multiprocessing`` connection
+with ``send`` and ``recv``: the receiving side allocates the final array once
+and the payload is read straight into it with ``recv_bytes_into``.
+
+Example:
+    buf = SampleBuffer(('time', 'cpu'))
+    buf.append((0.0, 12.5))
+    buf.append((0.1, 80.0))
+    buf.cpu          # array([12.5, 80. ])
+    buf[-1]          # (0.1, 80.0)
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class SampleBuffer(object):
+    """A growable columnar buffer of float64 samples.
+
+    Args:
+        columns (sequence of str): Names of the columns, in row order.
+        capacity (int, optional): Number of samples to preallocate.  Defaults
+            to 1024.
+        row_type (callable, optional): Factory used to build a row when the
+            buffer is indexed or iterated, e.g. a namedtuple.  Defaults to tuple.
+    """
+
+    def __init__(self, columns, capacity=1024, row_type=None):
+        self.columns = tuple(columns)
+        self.row_type = row_type
+        self._index = dict((c, i) for i, c in enumerate(self.columns))
+        self._data = np.empty((len(self.columns), max(int(capacity), 1)))
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def __bool__(self):
+        return self._n > 0
+
+    __nonzero__ = __bool__
+
+    def _reserve(self, n):
+        capacity = self._data.shape[1]
+        if n <= capacity:
+            return
+        while capacity < n:
+            capacity *= 2
+        data = np.empty((len(self.columns), capacity))
+        data[:, :self._n] = self._data[:, :self._n]
+        self._data = data
+
+    def append(self, row):
+        """Append a single sample, ordered as ``columns``"""
+        self._reserve(self._n + 1)
+        self._data[:, self._n] = row
+        self._n += 1
+
+    def extend(self, other):
+        """Append all samples of another buffer with the same columns"""
+        if other.columns != self.columns:
+            raise ValueError("Cannot extend a buffer with columns {} by one with columns {}"
+                             .format(self.columns, other.columns))
+        n = len(other)
+        self._reserve(self._n + n)
+        self._data[:, self._n:self._n + n] = other.array
+        self._n += n
+
+    def clear(self):
+        self._n = 0
+
+    @property
+    def array(self):
+        """View of the stored samples with shape (columns, samples)"""
+        return self._data[:, :self._n]
+
+    def column(self, name):
+        """View of a single column"""
+        return self._data[self._index[name], :self._n]
+
+    def __getattr__(self, name):
+        index = self.__dict__.get('_index')
+        if index is not None and name in index:
+            return self.column(name)
+        raise AttributeError(name)
+
+    def _row(self, i):
+        row = tuple(self._data[:, i].tolist())
+        return self.row_type(*row) if self.row_type else row
+
+    def __getitem__(self, key):
+        if isinstance(key, string_types):
+            return self.column(key)
+        if isinstance(key, slice):
+            return [self._row(i) for i in range(self._n)[key]]
+        if key < 0:
+            key += self._n
+        if not 0 <= key < self._n:
+            raise IndexError("sample index out of range")
+        return self._row(key)
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._row(i)
+
+    def keys(self):
+        return self.columns
+
+    def to_dict(self):
+        """Return the samples as a dictionary of lists, e.g. for storage in a database"""
+        return dict((c, self.column(c).tolist()) for c in self.columns)
+
+    def send(self, conn):
+        """Send the samples over a multiprocessing connection"""
+        conn.send((self.columns, self._n))
+        if self._n:
+            conn.send_bytes(np.ascontiguousarray(self.array))
+
+    @classmethod
+    def recv(cls, conn, row_type=None):
+        """Receive a buffer sent with ``send``"""
+        columns, n = conn.recv()
+        buf = cls(columns, capacity=n, row_type=row_type)
+        if n:
+            # the connection sizes the target by its first dimension, so flatten it
+            conn.recv_bytes_into(buf._data.reshape(-1))
+            buf._n = n
+        return buf
+
+    @classmethod
+    def from_rows(cls, columns, rows, row_type=None):
+        """Build a buffer from a 2D array with one row per sample"""
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(columns))
+        buf = cls(columns, capacity=len(rows), row_type=row_type)
+        buf._data[:, :len(rows)] = rows.T
+        buf._n = len(rows)
+        return buf
@@ -0,0 +1,155 @@
+""" Strong and weak scaling studies
+
+``ScalingStudy`` runs the same benchmark with an increasing number of threads
+and derives how well it scales:
+
+    speedup      S(p) = p0 T(p0) / T(p) for strong scaling (fixed problem
+                 size), p T(p0) / T(p) for weak scaling (problem size grows
+                 with p), with p0 the smallest count run
+    efficiency   E(p) = S(p) / p
+    serial fraction (Karp-Flatt)
+                 e(p) = (1 / S(p) - 1 / p) / (1 - 1 / p)
+
+A serial fraction that stays constant as p grows points to a serial part of
+the code, one that grows to overheads of the parallelisation itself (locking,
+communication, imbalance).
+
+For each count the OpenMP threads are set in this process and, through
+OMP_NUM_THREADS, in the processes it starts, and this process is pinned to
+the first p of its cores so that scripts and worker processes cannot use more.
+Both, and OMP_NUM_THREADS, are restored when the study ends.
+
+Example:
+    study = ScalingStudy(myprofile, counts=[1, 2, 4, 8], runs=3)
+    result = study.run('image_script_tclean.py --threads {threads}')
+    plot_scaling(result)
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from .repetition import Repetition
+from .utils import get_num_threads, restore_num_threads, set_num_threads
+
+
+def efficiency(counts, times, mode='strong'):
+    """Parallel efficiency of each count relative to the first"""
+    counts = np.asarray(counts, dtype=float)
+    times = np.asarray(times, dtype=float)
+    if mode == 'strong':
+        return counts[0] * times[0] / (counts * times)
+    elif mode == 'weak':
+        return times[0] / times
+    raise ValueError("Unknown scaling mode {!r}, use 'strong' or 'weak'".format(mode))
+
+
+def speedup(counts, times, mode='strong'):
+    """Speedup of each count, scaled speedup for weak scaling"""
+    return efficiency(counts, times, mode) * np.asarray(counts, dtype=float)
+
+
+def karp_flatt(counts, speedups):
+    """Experimentally determined serial fraction, NaN for a single thread"""
+    counts = np.asarray(counts, dtype=float)
+    speedups = np.asarray(speedups, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        serial = (1 / speedups - 1 / counts) / (1 - 1 / counts)
+    return np.where(counts > 1, serial, np.nan)
+
+
+def _available_cores():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(multiprocessing.cpu_count()))
+
+
+def default_counts(cores=None):
+    """Powers of two up to the number of cores, and the number of cores"""
+    cores = cores or len(_available_cores())
+    counts = [1]
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+class ScalingStudy(object):
+    """Run a benchmark over thread counts and compute its scaling.
+
+    Args:
+        profiler (Profiler): Runs and profiles each count.  Worker processes
+            of a running session do not see the thread count, end the session
+            first.
+        counts (list of int, optional): Thread counts.  Defaults to powers of
+            two up to the cores available.
+        mode (str, optional): 'strong' (fixed problem size) or 'weak' (problem
+            size proportional to the count).  Defaults to 'strong'.
+        pin (bool, optional): Pin this process, and so the processes it starts,
+            to as many cores as threads.  Defaults to True.
+        **options: Keyword arguments of Repetition, e.g. warmup=1, runs=3.
+            Defaults to a single run per count.
+    """
+
+    def __init__(self, profiler, counts=None, mode='strong', pin=True, **options):
+        self.profiler = profiler
+        self.counts = sorted(counts or default_counts())
+        if mode not in ('strong', 'weak'):
+            raise ValueError("Unknown scaling mode {!r}, use 'strong' or 'weak'".format(mode))
+        self.mode = mode
+        self.pin = pin and hasattr(os, 'sched_setaffinity')
+        self.options = dict({'warmup': 0, 'runs': 1}, **options)
+
+    def _execute(self, run, threads):
+        prof = self.profiler
+        if callable(run):
+            return prof.execute_function, (run, threads)
+        return prof.execute_script, (run.format(threads=threads),)
+
+    def run(self, run):
+        """Run every count.
+
+        Args:
+            run (str or callable): A script command line, formatted with the
+                count as ``{threads}`` and run with execute_script, or a
+                function run with execute_function as ``run(threads)``.
+
+        Returns:
+            dict: The 'Mode', the thread 'Counts' and for each count the median
+            'RunTime', 'Speedup', 'Efficiency', 'SerialFraction' (Karp-Flatt)
+            and the 'Repetitions' (see Repetition.run).
+        """
+        cores = _available_cores()
+        if self.pin and self.counts[-1] > len(cores):
+            raise ValueError("{} threads requested but only {} cores available".format(
+                self.counts[-1], len(cores)))
+        omp_threads = os.environ.get('OMP_NUM_THREADS')
+        runtime_threads = get_num_threads()
+        repetitions = []
+        try:
+            for threads in self.counts:
+                if self.pin:
+                    os.sched_setaffinity(0, cores[:threads])
+                set_num_threads(threads)
+                execute, args = self._execute(run, threads)
+                repetitions.append(Repetition(self.profiler, **self.options).run(execute, *args))
+        finally:
+            if self.pin:
+                os.sched_setaffinity(0, cores)
+            restore_num_threads(omp_threads, runtime_threads)
+
+        times = [r['RunTime']['median'] for r in repetitions]
+        speedups = speedup(self.counts, times, self.mode)
+        return {'Mode': self.mode,
+                'Counts': list(self.counts),
+                'RunTime': times,
+                'Speedup': speedups.tolist(),
+                'Efficiency': efficiency(self.counts, times, self.mode).tolist(),
+                'SerialFraction': karp_flatt(self.counts, speedups).tolist(),
+                'Repetitions': repetitions}
@@ -0,0 +1,156 @@
+""" Statistical sampling of Python stacks
+
+``StackSampler`` runs a daemon thread that takes the Python stack of every
+other thread of the process at a fixed interval, using
+``sys._current_frames``.  Each sample is stamped with
+``timeit.default_timer``, the clock of the resource samples, so the frames
+that were active during, say, a memory spike can be looked up afterwards.
+
+Stacks are stored once and samples refer to them by number, so a long run
+costs three floats per thread and sample.  ``collapsed`` folds the samples of
+a time window into the collapsed-stack format read by flame graph tools
+(``flamegraph.pl``, speedscope): one ``frame;frame;frame count`` line per
+distinct stack, outermost frame first.
+
+Example:
+    with StackSampler(interval=0.005) as stacks:
+        run()
+    stacks.write_collapsed('run.folded')
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import threading
+from timeit import default_timer
+
+import numpy as np
+
+from .sample_buffer import SampleBuffer
+
+
+def _label(code):
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+class StackSampler(object):
+    """Sample the Python stacks of the threads of this process.
+
+    Args:
+        interval (float, optional): Time between samples in seconds.  Defaults
+            to 0.01.
+        max_depth (int, optional): Keep at most this many innermost frames of
+            a stack.  Defaults to 128.
+        exclude (iterable of int, optional): Thread identifiers not to sample,
+            in addition to the sampler's own thread.
+    """
+
+    def __init__(self, interval=0.01, max_depth=128, exclude=()):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.exclude = set(exclude)
+        # Distinct stacks, as tuples of frame labels from the outermost frame
+        self.stacks = []
+        self.samples = SampleBuffer(('time', 'thread', 'stack'))
+        self._index = {}
+        self._labels = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Code objects cannot be pickled, the label cache is rebuilt as needed
+        state.update(_thread=None, _stop=None, _labels={})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._stop = threading.Event()
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _label(code)
+            labels.append(label)
+            frame = frame.f_back
+        stack = tuple(reversed(labels))
+        i = self._index.get(stack)
+        if i is None:
+            i = self._index[stack] = len(self.stacks)
+            self.stacks.append(stack)
+        return i
+
+    def sample(self):
+        """Take one sample of every thread"""
+        now = default_timer()
+        own = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident != own and ident not in self.exclude:
+                self.samples.append((now, ident, self._stack(frame)))
+
+    def _run(self):
+        while not self._stop.is_set():
+            tic = default_timer()
+            self.sample()
+            self._stop.wait(max(0, self.interval - (default_timer() - tic)))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def clear(self):
+        self.stacks = []
+        self.samples.clear()
+        self._index = {}
+
+    def collapsed(self, start=None, end=None, thread=None):
+        """Count the samples of each stack.
+
+        Args:
+            start, end (float, optional): Only count samples in this time window.
+            thread (int, optional): Only count samples of this thread.
+
+        Returns:
+            list of (stack, count) with the stack as a ';'-joined string, most
+            frequent first.
+        """
+        if not self.samples:
+            return []
+        mask = np.ones(len(self.samples), dtype=bool)
+        if start is not None:
+            mask &= self.samples.time >= start
+        if end is not None:
+            mask &= self.samples.time <= end
+        if thread is not None:
+            mask &= self.samples.thread == thread
+        ids, counts = np.unique(self.samples.stack[mask].astype(int), return_counts=True)
+        order = np.argsort(-counts, kind='mergesort')
+        return [(';'.join(self.stacks[ids[i]]), int(counts[i])) for i in order]
+
+    def write_collapsed(self, path, start=None, end=None):
+        """Write the collapsed stacks of a time window for a flame graph tool"""
+        with open(path, 'w') as f:
+            for stack, count in self.collapsed(start, end):
+                f.write('{} {}\n'.format(stack, count))
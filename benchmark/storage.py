@@ -0,0 +1,334 @@
+""" Storage backends for benchmark records
+
+A record is a dict: the fields of ``Profiler.fieldnames`` and the nested
+results (graphs, processes, phases, ...).  ``Profiler`` and
+``BenchmarkDataManager`` write and query records through a ``StorageBackend``,
+so the same code works with:
+
+    MongoBackend   the shared MongoDB collection, reached through an SSH
+                   tunnel (connected on first use)
+    SQLiteBackend  a local SQLite file, for nodes without network access;
+                   records are stored as JSON, with the common query fields
+                   in indexed columns
+    CSVBackend     the flat fields only, one row per record, as written by
+                   ``Profiler.write_to_csv``
+
+Every record written gets a unique ``RecordID``, so ``sync`` can copy the
+records of a local store to another backend, e.g. the shared database, as
+many times as needed without duplicating any.
+
+Backends are chosen with a spec string: 'mongo', 'sqlite' or 'sqlite:<path>',
+'csv' or 'csv:<path>'.  The default is $BENCHMARK_STORAGE, or 'mongo'.
+
+Queries match fields for equality, e.g. {'TestID': 'tclean', 'Date':
+'2019-05-02'}, as MongoDB does.
+
+Example:
+    local = get_backend('sqlite:/scratch/user/results.db')
+    Profiler(storage=local).execute_script('image.py')  # then write_to_database
+    sync(local, get_backend('mongo'))
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+import uuid
+
+DEFAULT_SQLITE_PATH = 'benchmark.db'
+DEFAULT_CSV_PATH = 'sysinfo.csv'
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+def _jsonable(value):
+    if hasattr(value, 'tolist'):
+        # NumPy arrays and scalars
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def to_json(record):
+    return json.dumps(record, default=_jsonable)
+
+
+def plain(record):
+    """A copy of a record with only JSON types, e.g. tuples as lists and NumPy
+    numbers as Python numbers"""
+    return json.loads(to_json(record))
+
+
+def _matches(record, query):
+    return all(record.get(key) == value for key, value in (query or {}).items())
+
+
+def _sort_key(sortby):
+    # Numbers before strings before anything else, so that fields of mixed
+    # types, e.g. numbers and the 'nan' strings of compute_stats, can be sorted;
+    # missing values last
+    def key(record):
+        value = record.get(sortby)
+        if value is None:
+            return (1, 0, 0)
+        if isinstance(value, (int, float)):
+            return (0, 0, value)
+        if isinstance(value, string_types):
+            return (0, 1, value)
+        return (0, 2, to_json(value))
+    return key
+
+
+def _select(records, query=None, columns=None, sortby=None, ascending=False, limit=0):
+    """Filter, sort, limit and project records in Python"""
+    records = [r for r in records if _matches(r, query)]
+    if sortby:
+        records.sort(key=_sort_key(sortby), reverse=not ascending)
+    if limit:
+        records = records[:limit]
+    if columns:
+        records = [dict((c, r[c]) for c in columns if c in r) for r in records]
+    return records
+
+
+class StorageBackend(object):
+    """Interface of a store of records"""
+
+    def write(self, record):
+        """Store a record, adding a RecordID if it has none.
+
+        Returns:
+            str: The RecordID.
+        """
+        raise NotImplementedError
+
+    def query(self, query=None, columns=None, sortby=None, ascending=False, limit=0):
+        """Return the records matching query.
+
+        Args:
+            query (dict, optional): Fields and the values they must equal.
+            columns (list, optional): Only return these fields.
+            sortby (str, optional): Sort by this field.  Defaults to the order
+                the records were written.
+            ascending (bool, optional): Sort order.  Defaults to False.
+            limit (int, optional): Return at most this many records, 0 for all.
+
+        Returns:
+            list of dicts
+        """
+        raise NotImplementedError
+
+    def distinct(self, key, query=None):
+        """Return the distinct values of a field"""
+        values = []
+        for record in self.query(query, columns=[key]):
+            value = record.get(key)
+            if value is not None and value not in values:
+                values.append(value)
+        return values
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _record_id(record):
+        record = dict(record)
+        record.setdefault('RecordID', uuid.uuid4().hex)
+        return record
+
+
+class MongoBackend(StorageBackend):
+    """Records in a MongoDB collection.
+
+    Args:
+        collection (optional): A pymongo collection.  Defaults to the results
+            collection of utils.dbclient_tunnel, connected on first use.
+    """
+
+    def __init__(self, collection=None):
+        if collection is None:
+            from .utils import LazyCollection, dbclient_tunnel
+            collection = LazyCollection(dbclient_tunnel)
+        self.collection = collection
+
+    def write(self, record):
+        record = plain(self._record_id(record))
+        self.collection.insert_one(record)
+        return record['RecordID']
+
+    def query(self, query=None, columns=None, sortby=None, ascending=False, limit=0):
+        projection = dict((c, 1) for c in columns or ())
+        projection['_id'] = 0
+        cursor = self.collection.find(query or {}, projection)
+        if sortby:
+            cursor = cursor.sort([(sortby, 1 if ascending else -1)])
+        return list(cursor.limit(limit))
+
+    def distinct(self, key, query=None):
+        return self.collection.distinct(key, query or {})
+
+
+class SQLiteBackend(StorageBackend):
+    """Records in a local SQLite file.
+
+    Args:
+        path (str, optional): The database file, created if needed.  Defaults
+            to 'benchmark.db'.
+    """
+
+    # Record fields stored in indexed columns, for fast queries
+    indexed = (('RecordID', 'record_id'), ('TestID', 'test_id'), ('Date', 'date'),
+               ('HostID', 'host_id'), ('SweepID', 'sweep_id'))
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        self.path = path
+        self._connection = None
+
+    def __getstate__(self):
+        return {'path': self.path, '_connection': None}
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            columns = ''.join(', {} TEXT'.format(c) for f, c in self.indexed[1:])
+            with self._connection:
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY, '
+                    'record_id TEXT UNIQUE{}, data TEXT NOT NULL)'.format(columns))
+                for field, column in self.indexed[1:]:
+                    self._connection.execute(
+                        'CREATE INDEX IF NOT EXISTS records_{0} ON records ({0})'.format(column))
+        return self._connection
+
+    def write(self, record):
+        record = self._record_id(record)
+        values = [None if record.get(f) is None else str(record[f]) for f, c in self.indexed]
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO records ({}, data) VALUES ({}?)'.format(
+                    ', '.join(c for f, c in self.indexed), '?, ' * len(self.indexed)),
+                values + [to_json(record)])
+        return record['RecordID']
+
+    def query(self, query=None, columns=None, sortby=None, ascending=False, limit=0):
+        query = dict(query or {})
+        where, args = [], []
+        for field, column in self.indexed:
+            if field in query and isinstance(query[field], string_types):
+                where.append('{} = ?'.format(column))
+                args.append(query.pop(field))
+        sql = 'SELECT data FROM records'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY id'
+        if limit and not query and not sortby:
+            sql += ' LIMIT {:d}'.format(limit)
+        records = (json.loads(data) for data, in self.connection.execute(sql, args))
+        return _select(records, query, columns, sortby, ascending, limit)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+def _open_csv(path, mode):
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return open(path, mode, newline='')
+
+
+class CSVBackend(StorageBackend):
+    """The flat fields of records, one CSV row per record.
+
+    Nested results are not stored.  An existing file keeps its columns, new
+    files get fieldnames and RecordID.  Values read back are strings.
+
+    Args:
+        path (str, optional): The CSV file.  Defaults to 'sysinfo.csv'.
+        fieldnames (list, optional): The columns of a new file.  Defaults to
+            Profiler.fieldnames.
+    """
+
+    def __init__(self, path=DEFAULT_CSV_PATH, fieldnames=None):
+        self.path = path
+        self.fieldnames = fieldnames
+
+    def _header(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with _open_csv(self.path, 'r') as f:
+                return next(csv.reader(f))
+        return None
+
+    def write(self, record):
+        record = self._record_id(record)
+        header = self._header()
+        if header is None:
+            fieldnames = self.fieldnames
+            if fieldnames is None:
+                from .benchmark import Profiler
+                fieldnames = Profiler.fieldnames
+            fieldnames = list(fieldnames) + ['RecordID']
+        else:
+            fieldnames = header
+        with _open_csv(self.path, 'a') as out_file:
+            writer = csv.DictWriter(out_file, delimiter=',', fieldnames=fieldnames,
+                                    extrasaction='ignore')
+            if header is None:
+                writer.writeheader()
+            writer.writerow(record)
+        return record['RecordID']
+
+    def query(self, query=None, columns=None, sortby=None, ascending=False, limit=0):
+        if self._header() is None:
+            return []
+        with _open_csv(self.path, 'r') as f:
+            records = [dict(row) for row in csv.DictReader(f)]
+        return _select(records, query, columns, sortby, ascending, limit)
+
+
+def get_backend(spec=None):
+    """Return the backend of a spec: a StorageBackend, 'mongo', 'sqlite',
+    'sqlite:<path>', 'csv' or 'csv:<path>'.  Defaults to $BENCHMARK_STORAGE,
+    or 'mongo'."""
+    if isinstance(spec, StorageBackend):
+        return spec
+    spec = spec or os.environ.get('BENCHMARK_STORAGE', 'mongo')
+    kind, _, path = spec.partition(':')
+    if kind == 'mongo':
+        return MongoBackend()
+    elif kind == 'sqlite':
+        return SQLiteBackend(path or DEFAULT_SQLITE_PATH)
+    elif kind == 'csv':
+        return CSVBackend(path or DEFAULT_CSV_PATH)
+    raise ValueError("Unknown storage {!r}, use 'mongo', 'sqlite[:path]' or "
+                     "'csv[:path]'".format(spec))
+
+
+def sync(source, target, query=None):
+    """Copy the records of source that target does not have yet.
+
+    Args:
+        source, target (StorageBackend or str): Backends or their specs.
+        query (dict, optional): Only copy the records matching query.
+
+    Returns:
+        int: The number of records copied.
+    """
+    source, target = get_backend(source), get_backend(target)
+    known = set(target.distinct('RecordID'))
+    copied = 0
+    for record in source.query(query):
+        if record.get('RecordID') not in known:
+            target.write(record)
+            copied += 1
+    return copied
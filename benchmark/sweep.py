@@ -0,0 +1,223 @@
+""" Parameter sweeps over containers, thread counts and task parameters
+
+``Sweep`` runs a benchmark once for every point of a parameter grid, each
+point with its own ``Profiler``, and writes one record per point tagged with
+the sweep and the point's parameters.  Completed points are appended to a
+state file as they finish, so an interrupted sweep started again with the same
+state file skips them and only runs the rest.  Points that failed, including
+scripts that exited with a non-zero code, are run again.
+
+Points can run concurrently, each pinned to its own set of cores (and with
+``OMP_NUM_THREADS`` set to the number of cores unless the point sets
+``omp_threads``), so that the runs do not compete for the same cores.  The
+CPU affinity, ``OMP_NUM_THREADS`` and OpenMP thread count of the calling
+process are restored after each point.
+
+Grid keys with a special meaning:
+    container_path, exec_path, container_runtime, backend, dt_profile
+                    passed to the Profiler of the point
+    omp_threads     OpenMP threads, set with OMP_NUM_THREADS and, for
+                    functions, through the OpenMP runtime
+
+Example:
+    sweep = Sweep({'container_path': ['casa-5.4.simg', 'casa-5.6.simg'],
+                   'omp_threads': [1, 2, 4],
+                   'niter': [100, 1000]},
+                  'image_script_tclean.py --niter {niter}',
+                  name='tclean-sweep', state_path='tclean-sweep.json')
+    records = sweep.run()
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import traceback
+from itertools import product
+
+from .utils import get_num_threads, restore_num_threads, set_num_threads
+
+# Grid keys passed on to the Profiler of a point
+PROFILER_KEYS = ('container_path', 'exec_path', 'container_runtime', 'backend', 'dt_profile')
+
+
+def grid(params):
+    """Return every combination of a dict of parameter lists as a list of dicts"""
+    keys = sorted(params)
+    return [dict(zip(keys, values)) for values in product(*(params[k] for k in keys))]
+
+
+def point_id(point):
+    """A stable identifier of a point"""
+    return json.dumps(point, sort_keys=True)
+
+
+def core_sets(cores_per_run, cores=None):
+    """Split the cores available to this process into disjoint sets.
+
+    Args:
+        cores_per_run (int): Cores per set.
+        cores (iterable of int, optional): Cores to split.  Defaults to the CPU
+            affinity of this process.
+
+    Returns:
+        list of tuples of core numbers.  Leftover cores are not used.
+    """
+    if cores is None:
+        cores = os.sched_getaffinity(0)
+    cores = sorted(cores)
+    return [tuple(cores[i:i + cores_per_run])
+            for i in range(0, len(cores) - cores_per_run + 1, cores_per_run)]
+
+
+def _make_profiler(point, profiler_options):
+    from .benchmark import Profiler
+    options = dict(profiler_options)
+    options.update((k, point[k]) for k in PROFILER_KEYS if k in point)
+    return Profiler(**options)
+
+
+def _run_point(name, point, run, profiler_options, write, cores):
+    """Run one point of a sweep and return its record"""
+    # Restored afterwards, a sequential sweep runs the points in this process
+    affinity = os.sched_getaffinity(0) if cores is not None else None
+    omp_threads = os.environ.get('OMP_NUM_THREADS')
+    runtime_threads = get_num_threads()
+    record = {'id': point_id(point), 'point': point, 'cores': list(cores or ())}
+    try:
+        if cores is not None:
+            os.sched_setaffinity(0, cores)
+            profiler_options = dict(profiler_options, cores=len(cores))
+        threads = point.get('omp_threads', len(cores) if cores is not None else None)
+        if threads is not None:
+            set_num_threads(threads)
+
+        prof = _make_profiler(point, profiler_options)
+        prof.update_bench_dict({'SweepID': name, 'SweepPoint': record['id']})
+        if callable(run):
+            run(prof, point)
+            ok = True
+        else:
+            ok = prof.execute_script(run.format(**point))
+        # Failed runs are written too, with their ExitCode, but are run again
+        # when the sweep is resumed
+        if write == 'database':
+            prof.write_to_database()
+        elif write == 'csv':
+            prof.write_to_csv()
+        elif callable(write):
+            write(prof, point)
+        if not ok or prof.exit_code not in (None, 0):
+            raise RuntimeError("The script failed with exit code {}".format(prof.exit_code))
+        record['status'] = 'done'
+        record['RunTime'] = prof.bench_dict.get('RunTime')
+        record['stats'] = dict((k, v) for k, v in prof.stats.items() if isinstance(v, (int, float)))
+    except Exception:
+        record['status'] = 'failed'
+        record['error'] = traceback.format_exc()
+    finally:
+        if affinity is not None:
+            os.sched_setaffinity(0, affinity)
+        restore_num_threads(omp_threads, runtime_threads)
+    return record
+
+
+class Sweep(object):
+    """Run a benchmark for every point of a parameter grid.
+
+    Args:
+        params (dict): Maps each parameter to the list of values to sweep.
+        run (str or callable): A script command line, formatted with the point
+            (e.g. 'image.py --niter {niter}') and run with execute_script, or
+            ``run(profiler, point)`` which executes the point on the given
+            Profiler.  For concurrent sweeps it must be picklable (a module
+            level function, not a lambda).
+        name (str, optional): Identifies the sweep in the records (SweepID).
+            Defaults to 'sweep'.
+        state_path (str, optional): JSON-lines file of finished points, used to
+            resume the sweep.  Defaults to None (no resume).
+        cores_per_run (int, optional): Run points concurrently, each on its own
+            set of this many cores.  Defaults to None, one point at a time on
+            all cores.
+        write (str or callable, optional): 'database' (write_to_database),
+            'csv' (write_to_csv), ``write(profiler, point)`` or None.  Defaults
+            to 'database'.
+        profiler_options (dict, optional): Keyword arguments of the Profiler
+            of every point, e.g. {'testid': 'tclean', 'profile_options': {...}}.
+    """
+
+    def __init__(self, params, run, name='sweep', state_path=None, cores_per_run=None,
+                 write='database', profiler_options=None):
+        self.points = grid(params)
+        self.run_point = run
+        self.name = name
+        self.state_path = state_path
+        self.cores_per_run = cores_per_run
+        self.write = write
+        self.profiler_options = profiler_options or {}
+
+    def completed(self):
+        """Return the ids of the points finished in earlier runs of the sweep"""
+        done = set()
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a line cut short by an interruption
+                        continue
+                    if record.get('status') == 'done':
+                        done.add(record['id'])
+        return done
+
+    def pending(self):
+        """Return the points still to run"""
+        done = self.completed()
+        return [p for p in self.points if point_id(p) not in done]
+
+    def _save(self, record):
+        if self.state_path:
+            with open(self.state_path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def run(self):
+        """Run the pending points.
+
+        Returns:
+            list of dicts, one record per point run: its 'id', 'point', 'cores',
+            'status' ('done' or 'failed' with the 'error'), 'RunTime' and
+            numeric 'stats'.
+        """
+        points = self.pending()
+        options = (self.run_point, self.profiler_options, self.write)
+        records = []
+        if not self.cores_per_run:
+            for point in points:
+                record = _run_point(self.name, point, *(options + (None,)))
+                self._save(record)
+                records.append(record)
+            return records
+
+        # Python 3, or the futures backport on Python 2
+        import concurrent.futures
+        free = core_sets(self.cores_per_run)
+        if not free:
+            raise ValueError("Not enough cores for runs of {} cores".format(self.cores_per_run))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(free)) as executor:
+            running = {}
+            while points or running:
+                while points and free:
+                    cores = free.pop(0)
+                    future = executor.submit(_run_point, self.name, points.pop(0),
+                                             *(options + (cores,)))
+                    running[future] = cores
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    free.append(running.pop(future))
+                    record = future.result()
+                    self._save(record)
+                    records.append(record)
+        return records
@@ -0,0 +1,144 @@
+""" Crash-resilient trace files for resource samples
+
+A trace file is a small header followed by fixed-width records, one per
+sample, each holding one little-endian float64 per column.  ``TraceWriter``
+appends records through a shared memory map and updates the record count in
+the header after every record, so whatever was written before the profiled
+task (or the notebook kernel) died is still on disk and readable.
+
+Header layout:
+    magic           8 bytes     b'BMTRACE1'
+    header size     uint32      bytes before the first record
+    columns         uint32      number of columns
+    dt              float64     requested sampling interval in seconds
+    records         uint64      number of complete records
+    names           JSON list of column names, padded to the header size
+
+Example:
+    with TraceWriter('run.trace', ResourceData._fields, dt=0.1) as trace:
+        trace.append(row)
+    samples = read_trace('run.trace')
+
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .sample_buffer import SampleBuffer
+
+MAGIC = b'BMTRACE1'
+_FIXED = struct.Struct('<8sIIdQ')
+_COUNT_OFFSET = 24
+
+
+class TraceWriter(object):
+    """Append fixed-width sample records to a memory-mapped trace file.
+
+    Args:
+        path (str): Trace file to create.  An existing file is overwritten.
+        columns (sequence of str): Names of the columns of each record.
+        dt (float, optional): Sampling interval stored in the header.
+        grow (int, optional): Number of records to extend the file by whenever
+            the mapping is full.  Defaults to 4096.
+    """
+
+    def __init__(self, path, columns, dt=0., grow=4096):
+        self.path = path
+        self.columns = tuple(columns)
+        self.dt = dt
+        self.grow = grow
+        names = json.dumps(list(self.columns)).encode('utf-8')
+        # Keep records 8-byte aligned
+        self.header_size = (_FIXED.size + len(names) + 7) // 8 * 8
+        self._record = struct.Struct('<%dd' % len(self.columns))
+        self._n = 0
+        self._capacity = 0
+
+        self._file = open(path, 'w+b')
+        header = _FIXED.pack(MAGIC, self.header_size, len(self.columns), dt, 0) + names
+        self._file.write(header.ljust(self.header_size, b'\0'))
+        self._map = None
+        self._remap(grow)
+
+    def _remap(self, capacity):
+        if self._map is not None:
+            self._map.close()
+        self._file.truncate(self.header_size + capacity * self._record.size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._capacity = capacity
+
+    def __len__(self):
+        return self._n
+
+    def append(self, row):
+        """Write one record and then publish it in the header"""
+        if self._n == self._capacity:
+            self._remap(self._capacity + self.grow)
+        self._record.pack_into(self._map, self.header_size + self._n * self._record.size, *row)
+        self._n += 1
+        struct.pack_into('<Q', self._map, _COUNT_OFFSET, self._n)
+
+    def flush(self):
+        """Force the mapped records to disk"""
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        """Trim the preallocated space and close the file"""
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(self.header_size + self._n * self._record.size)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_header(path):
+    """Read the header of a trace file.
+
+    Returns:
+        dict: with the ``columns``, ``dt``, number of ``records`` and
+        ``header_size``.
+
+    Raises:
+        ValueError: If the file is not a trace file.
+    """
+    with open(path, 'rb') as f:
+        fixed = f.read(_FIXED.size)
+        if len(fixed) < _FIXED.size:
+            raise ValueError("{} is too short to be a trace file".format(path))
+        magic, header_size, ncols, dt, records = _FIXED.unpack(fixed)
+        if magic != MAGIC:
+            raise ValueError("{} is not a trace file".format(path))
+        names = f.read(header_size - _FIXED.size).rstrip(b'\0')
+    return {'columns': tuple(json.loads(names.decode('utf-8'))), 'dt': dt,
+            'records': records, 'header_size': header_size}
+
+
+def read_trace(path, row_type=None):
+    """Load the complete records of a trace file into a ``SampleBuffer``.
+
+    Records beyond the count in the header (a sample that was being written
+    when the writer died) are ignored.
+    """
+    header = read_header(path)
+    ncols = len(header['columns'])
+    available = (os.path.getsize(path) - header['header_size']) // (8 * ncols)
+    n = min(header['records'], available)
+    with open(path, 'rb') as f:
+        f.seek(header['header_size'])
+        rows = np.fromfile(f, dtype='<f8', count=n * ncols)
+    return SampleBuffer.from_rows(header['columns'], rows, row_type=row_type)
@@ -5,7 +5,7 @@ This module contains utility functions used for benchmarking and testing.
 Example: 
 	import utils
 	omp = utils.OpenMPRuntime()
-	print "OMP max threads: {}".format( omp.omp_get_max_threads() )
+	print("OMP max threads: {}".format( omp.omp_get_max_threads() ))
 	# Set the OMP threads to 2
 	omp.omp_set_num_threads(2)
 
@@ -15,10 +15,16 @@ Example:
 # openmp_lib = ctypes.cdll.LoadLibrary(libpath)
 # openmp_lib.omp_set_num_threads(int(1))
 
+from __future__ import print_function
+
 import ctypes 
+import os
 from ctypes.util import find_library
 
-mongodb_ip_address = "10.102.26.82" # "10.0.0.169"
+# The results database, configured with environment variables
+mongodb_ip_address = os.environ.get('BENCHMARK_DB_HOST', "10.102.26.82") # "10.0.0.169"
+ssh_username = os.environ.get('BENCHMARK_DB_SSH_USER', "ubuntu")
+ssh_pkey = os.environ.get('BENCHMARK_DB_SSH_KEY', "/users/jbochenek/.ssh/htc-compute_keypair_2")
 
 class OpenMPRuntime(object):
     '''
@@ -37,7 +43,7 @@ class OpenMPRuntime(object):
                 self.libname = libname
                 self.lib = ctypes.cdll.LoadLibrary(self.libname)
             except OSError:
-                print "lib not found"
+                print("lib not found")
         else:
             self.libname = find_library('gomp')
             self.lib = ctypes.cdll.LoadLibrary(self.libname)
@@ -49,19 +55,57 @@ class OpenMPRuntime(object):
         return self.lib.omp_get_max_threads()
 
 
-from sshtunnel import SSHTunnelForwarder
-from pymongo import MongoClient
+def set_num_threads(nthreads):
+    '''
+    Set the number of OpenMP threads of this process, through the OpenMP runtime 
+    if one is loaded, and of the processes it starts, through OMP_NUM_THREADS.
+    '''
+    os.environ['OMP_NUM_THREADS'] = str(nthreads)
+    try:
+        OpenMPRuntime().omp_set_num_threads(nthreads)
+    except (OSError, TypeError, AttributeError):
+        # no OpenMP runtime
+        pass
+
+
+def get_num_threads():
+    '''
+    Number of OpenMP threads of this process, as reported by the OpenMP runtime, or 
+    None without one.
+    '''
+    try:
+        return OpenMPRuntime().omp_get_max_threads()
+    except (OSError, TypeError, AttributeError):
+        return None
+
+
+def restore_num_threads(omp_threads, runtime_threads):
+    '''
+    Undo set_num_threads: restore OMP_NUM_THREADS (unset if omp_threads is None) and 
+    the thread count of the OpenMP runtime, as returned by get_num_threads before.
+    '''
+    if omp_threads is None:
+        os.environ.pop('OMP_NUM_THREADS', None)
+    else:
+        os.environ['OMP_NUM_THREADS'] = omp_threads
+    if runtime_threads is not None:
+        try:
+            OpenMPRuntime().omp_set_num_threads(runtime_threads)
+        except (OSError, TypeError, AttributeError):
+            pass
 
 
 def dbclient_tunnel():
     '''
     Set up the sshtunnel connection authenticating with a private key pair.
     '''
+    from sshtunnel import SSHTunnelForwarder
+    from pymongo import MongoClient
 
     server = SSHTunnelForwarder(
         mongodb_ip_address,     # IP address of the database server
-        ssh_username="ubuntu",
-        ssh_pkey="/users/jbochenek/.ssh/htc-compute_keypair_2",
+        ssh_username=ssh_username,
+        ssh_pkey=ssh_pkey,
         ssh_private_key_password="",
         remote_bind_address=('127.0.0.1', 27017)   # local address, does not need to be changed
     )
@@ -74,7 +118,35 @@ def dbclient_tunnel():
     return collection
 
 def dbclient():
+    from pymongo import MongoClient
+
     client = MongoClient( mongodb_ip_address )
     db = client['local']
     collection = db['results']
     return collection
+
+
+class LazyCollection(object):
+    '''
+    A database collection that is only connected to when it is first used, so 
+    that creating a Profiler does not open a connection (or fail on a node 
+    without network access) before there is anything to write.
+
+    collection = LazyCollection(dbclient_tunnel)
+    collection.insert_one(record)   # connects here
+    '''
+
+    def __init__(self, connect=dbclient_tunnel):
+        self._connect = connect
+        self._collection = None
+
+    @property
+    def connected(self):
+        return self._collection is not None
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self._collection is None:
+            self._collection = self._connect()
+        return getattr(self._collection, attr)
@@ -0,0 +1,48 @@
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+import unittest
+
+from benchmark.allocations import AllocationTracer
+
+
+def allocate():
+    data = b'x' * (100 * 1024 ** 2)  # allocating line
+    time.sleep(0.5)
+    return len(data)
+
+
+@unittest.skipIf(sys.version_info < (3, 4), "needs tracemalloc")
+class GrowthTest(unittest.TestCase):
+
+    def test_allocating_line_first(self):
+        with AllocationTracer(interval=0.1) as tracer:
+            allocate()
+        with open(__file__.replace('.pyc', '.py')) as f:
+            line = [i for i, text in enumerate(f, 1) if text.endswith('# allocating line\n')][0]
+        site = tracer.growth[0]
+        self.assertTrue(site['site'].endswith('test_allocations.py:{}'.format(line)), site)
+        self.assertGreater(site['growth'], 90)
+
+
+@unittest.skipIf(sys.version_info < (3, 4), "needs tracemalloc")
+class OverheadTest(unittest.TestCase):
+
+    def test_short_run(self):
+        # Many small blocks make snapshots slow
+        start = time.time()
+        with AllocationTracer(interval=0.05, peak_check=0.01) as tracer:
+            data = []
+            end = time.time() + 0.3
+            while time.time() < end:
+                data.append([str(i) for i in range(1000)])
+        elapsed = time.time() - start
+        self.assertEqual(tracer.snapshots[0]['reason'], 'start')
+        self.assertIsNotNone(tracer.peak)
+        # max_overhead of the run time, with room for the error of the estimate
+        self.assertLessEqual(tracer.cost, 2 * tracer.max_overhead * elapsed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from benchmark.benchmark import Profiler
+
+
+class ExitCodeTest(unittest.TestCase):
+
+    def run_script(self, code, **options):
+        prof = Profiler(exec_path=sys.executable, dt_profile=0.05, backend='thread', **options)
+        return prof, prof.execute_script('-c "{}"'.format(code))
+
+    def test_failed_script(self):
+        prof, ok = self.run_script('import sys; sys.exit(3)')
+        self.assertFalse(ok)
+        self.assertEqual(prof.exit_code, 3)
+        self.assertEqual(prof.bench_dict['ExitCode'], 3)
+
+    def test_successful_script(self):
+        prof, ok = self.run_script('pass')
+        self.assertTrue(ok)
+        self.assertEqual(prof.bench_dict['ExitCode'], 0)
+
+    def test_not_profiled(self):
+        prof, ok = self.run_script('import sys; sys.exit(2)', profile=False)
+        self.assertFalse(ok)
+        self.assertEqual(prof.exit_code, 2)
+
+    def test_function_not_profiled(self):
+        calls = []
+        prof = Profiler(profile=False)
+        self.assertTrue(prof.execute_function(calls.append, 1))
+        self.assertEqual(calls, [1])
+        self.assertIsNone(prof.results)
+
+
+class RecordTest(unittest.TestCase):
+    """What a run stores, by default and when asked for more"""
+
+    def run_script(self, **profile_options):
+        prof = Profiler(exec_path=sys.executable, dt_profile=0.05, backend='thread',
+                        profile_options=profile_options)
+        prof.execute_script('-c "import time; time.sleep(0.2)"')
+        return prof
+
+    def test_default(self):
+        prof = self.run_script()
+        self.assertEqual(len(prof.results.process_results), 0)
+        self.assertEqual(prof.top_processes['cpu'], [])
+        self.assertIn('t', prof.graphs)
+        self.assertIn('rmem', prof.graphs)
+        self.assertFalse([c for c in prof.graphs if c.startswith('cg_')])
+
+    def test_per_process(self):
+        prof = self.run_script(per_process=True)
+        self.assertGreater(len(prof.results.process_results), 0)
+        self.assertTrue(prof.top_processes['cpu'])
+
+
+# Records its command line, then runs the command as 'singularity exec' would,
+# without the image
+SINGULARITY = """#!/bin/sh
+echo "$*" >> "$SINGULARITY_LOG"
+shift 2
+exec "$@"
+"""
+
+
+class ContainerTest(unittest.TestCase):
+    """Scripts run in a container through the container runtime"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.dir, 'bin')
+        os.mkdir(bin_dir)
+        singularity = os.path.join(bin_dir, 'singularity')
+        with open(singularity, 'w') as f:
+            f.write(SINGULARITY)
+        os.chmod(singularity, os.stat(singularity).st_mode | stat.S_IEXEC)
+        self.image = os.path.join(self.dir, 'casa.sif')
+        with open(self.image, 'wb') as f:
+            f.write(b'not really an image')
+        self.log = os.path.join(self.dir, 'singularity.log')
+        self.environ = dict(os.environ)
+        os.environ.update(PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                          SINGULARITY_LOG=self.log,
+                          BENCHMARK_CACHE_DIR=os.path.join(self.dir, 'cache'))
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.dir)
+
+    def test_singularity(self):
+        prof = Profiler(container_path=self.image, exec_path=sys.executable, dt_profile=0.05,
+                        backend='thread')
+        self.assertTrue(prof.execute_script('-c "print(42)"'))
+        with open(self.log) as f:
+            commands = f.read().splitlines()
+        # the start-up of an empty container, then the script
+        self.assertEqual(commands, ['exec {} true'.format(self.image),
+                                    'exec {} {} -c print(42)'.format(self.image, sys.executable)])
+        self.assertEqual([line.text for line in prof.log], ['42'])
+        self.assertEqual(prof.bench_dict['Container'], 'casa.sif')
+        digest = 'sha256:' + hashlib.sha256(b'not really an image').hexdigest()
+        self.assertEqual(prof.bench_dict['ContainerDigest'], digest)
+        self.assertGreaterEqual(float(prof.bench_dict['ContainerStartup']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, print_function
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmark.cgroup import CgroupSampler, process_cgroups
+
+PID = 1234
+
+V2 = {
+    'cgroup.controllers': 'cpu io memory\n',
+    'job/memory.current': '104857600\n',
+    'job/memory.max': 'max\n',
+    'job/memory.stat': 'anon 62914560\nfile 41943040\nkernel 1048576\n',
+    'job/cpu.stat': 'usage_usec 2500000\nuser_usec 2000000\nsystem_usec 500000\n'
+                    'nr_periods 40\nnr_throttled 3\nthrottled_usec 150000\n',
+    'job/cpu.max': '150000 100000\n',
+    'job/io.stat': '8:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0\n'
+                   '8:16 rbytes=1000 wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n',
+}
+
+V1 = {
+    'memory/job/memory.usage_in_bytes': '209715200\n',
+    'memory/job/memory.limit_in_bytes': '9223372036854771712\n',
+    'memory/job/memory.stat': 'cache 1\nrss 2\ntotal_cache 83886080\ntotal_rss 125829120\n',
+    'cpu/job/cpu.stat': 'nr_periods 10\nnr_throttled 1\nthrottled_time 250000000\n',
+    'cpu/job/cpu.cfs_quota_us': '-1\n',
+    'cpu/job/cpu.cfs_period_us': '100000\n',
+    'cpuacct/job/cpuacct.usage': '3500000000\n',
+    'blkio/job/blkio.throttle.io_service_bytes': '8:0 Read 4096\n8:0 Write 512\n'
+                                                 '8:0 Sync 4608\n8:0 Total 4608\n'
+                                                 '8:16 Read 100\nTotal 4708\n',
+}
+
+
+class CgroupTest(unittest.TestCase):
+    """Counters parsed from fake cgroup and proc filesystems"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, 'cgroup')
+        self.procfs = os.path.join(self.dir, 'proc')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def tree(self, files, cgroup):
+        for name, content in files.items():
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        os.makedirs(os.path.join(self.procfs, str(PID)))
+        with open(os.path.join(self.procfs, str(PID), 'cgroup'), 'w') as f:
+            f.write(cgroup)
+        return CgroupSampler(self.root, pid=PID, procfs=self.procfs)
+
+    def assertNaN(self, *values):
+        for value in values:
+            self.assertTrue(math.isnan(value), value)
+
+    def test_process_cgroups(self):
+        self.tree({}, '12:memory:/job\n4:cpu,cpuacct:/job/step\n0::/user\n')
+        self.assertEqual(process_cgroups(PID, self.procfs),
+                         {'memory': '/job', 'cpu': '/job/step', 'cpuacct': '/job/step',
+                          '': '/user'})
+
+    def test_v2(self):
+        sampler = self.tree(V2, '0::/job\n')
+        self.assertEqual(sampler.version, 2)
+        sample = sampler.sample()
+        self.assertEqual(sample.mem, 104857600)
+        self.assertEqual(sample.limit, float('inf'))
+        self.assertEqual((sample.file, sample.anon), (41943040, 62914560))
+        self.assertAlmostEqual(sample.cpu_time, 2.5)
+        self.assertEqual((sample.nr_periods, sample.nr_throttled), (40, 3))
+        self.assertAlmostEqual(sample.throttled_time, 0.15)
+        self.assertEqual((sample.rio, sample.wio), (5096, 8192))
+        self.assertAlmostEqual(sampler.cpu_quota(), 1.5)
+
+    def test_v2_missing_files(self):
+        files = dict((name, V2[name]) for name in ('cgroup.controllers', 'job/memory.current'))
+        sampler = self.tree(files, '0::/job\n')
+        sample = sampler.sample()
+        self.assertEqual(sample.mem, 104857600)
+        self.assertNaN(sample.limit, sample.file, sample.anon, sample.cpu_time,
+                       sample.nr_periods, sample.nr_throttled, sample.throttled_time,
+                       sample.rio, sample.wio)
+        self.assertIsNone(sampler.cpu_quota())
+
+    def test_v2_hidden_path(self):
+        # e.g. inside a container, whose own cgroup is mounted as the root
+        files = dict((name.replace('job/', ''), content) for name, content in V2.items())
+        sample = self.tree(files, '0::/system.slice/job\n').sample()
+        self.assertEqual(sample.mem, 104857600)
+
+    def test_v1(self):
+        sampler = self.tree(V1, '5:memory:/job\n4:cpu,cpuacct:/job\n3:blkio:/job\n')
+        self.assertEqual(sampler.version, 1)
+        sample = sampler.sample()
+        self.assertEqual(sample.mem, 209715200)
+        self.assertEqual(sample.limit, float('inf'))
+        # the hierarchical total_ counters
+        self.assertEqual((sample.file, sample.anon), (83886080, 125829120))
+        self.assertAlmostEqual(sample.cpu_time, 3.5)
+        self.assertEqual((sample.nr_periods, sample.nr_throttled), (10, 1))
+        self.assertAlmostEqual(sample.throttled_time, 0.25)
+        self.assertEqual((sample.rio, sample.wio), (4196, 512))
+        self.assertIsNone(sampler.cpu_quota())
+
+    def test_v1_limit_and_quota(self):
+        files = dict(V1)
+        files['memory/job/memory.limit_in_bytes'] = '4294967296\n'
+        files['cpu/job/cpu.cfs_quota_us'] = '200000\n'
+        sampler = self.tree(files, '5:memory:/job\n4:cpu,cpuacct:/job\n3:blkio:/job\n')
+        self.assertEqual(sampler.sample().limit, 4294967296)
+        self.assertAlmostEqual(sampler.cpu_quota(), 2.0)
+
+    def test_v1_missing_files(self):
+        # no blkio or cpu controller, and only the usage of the memory controller
+        files = {'memory/job/memory.usage_in_bytes': V1['memory/job/memory.usage_in_bytes']}
+        sample = self.tree(files, '5:memory:/job\n').sample()
+        self.assertEqual(sample.mem, 209715200)
+        self.assertNaN(sample.limit, sample.file, sample.anon, sample.cpu_time,
+                       sample.nr_periods, sample.nr_throttled, sample.throttled_time,
+                       sample.rio, sample.wio)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code):
+    return subprocess.check_output([sys.executable, '-c', code], cwd=ROOT).decode().strip()
+
+
+class LazyImportTest(unittest.TestCase):
+    """Names and submodules are available after 'import benchmark'"""
+
+    def test_submodule(self):
+        self.assertEqual(run('import benchmark; print(benchmark.profiler.ResourceProfiler.__name__)'),
+                         'ResourceProfiler')
+        self.assertEqual(run('import benchmark; print(benchmark.utils.__name__)'), 'benchmark.utils')
+
+    def test_export(self):
+        self.assertEqual(run('import benchmark; print(benchmark.Profiler.__name__)'), 'Profiler')
+
+    def test_missing(self):
+        code = 'import benchmark\ntry:\n    benchmark.nothing\nexcept AttributeError:\n    print("ok")'
+        self.assertEqual(run(code), 'ok')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from benchmark.logcapture import LogCapture, read_log
+
+
+class LogCaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_log_file(self):
+        capture = LogCapture(self.path, echo=False)
+        env = dict(os.environ, GREETING='hello')
+        code = 'import os; print(os.environ[\\"GREETING\\"])'
+        self.assertEqual(capture.run('{} -c "{}"'.format(sys.executable, code), env=env), 0)
+        lines = read_log(self.path)
+        self.assertEqual([(line.stream, line.text) for line in lines], [('stdout', 'hello')])
+        # Back on the sample clock of the capture
+        self.assertAlmostEqual(lines[0].time, capture.tail[0].time, places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
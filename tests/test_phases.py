@@ -0,0 +1,65 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from timeit import default_timer
+
+from benchmark.phases import ENV_VAR, mark, recording
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.phases')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reused_file(self):
+        with recording(self.path):
+            mark('begin', 'left open')
+        with recording(self.path) as phases:
+            mark('begin', 'grid')
+            mark('end', 'grid')
+        self.assertEqual([p.name for p in phases], ['grid'])
+
+    def test_sample_clock(self):
+        start = default_timer()
+        with recording() as phases:
+            mark('begin', 'grid')
+            mark('end', 'grid')
+        end = default_timer()
+        # Written on the wall clock, read back on the clock of the samples
+        self.assertGreater(phases[0].start, start - 0.01)
+        self.assertLess(phases[0].end, end + 0.01)
+
+    def test_child_environment(self):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        with recording(self.path, env) as phases:
+            self.assertNotIn(ENV_VAR, os.environ)
+            subprocess.check_call([sys.executable, '-m', 'benchmark.phases', 'begin', 'grid'],
+                                  env=env)
+        self.assertEqual([p.name for p in phases], ['grid'])
+        self.assertEqual(env[ENV_VAR], self.path)
+
+    def test_threads(self):
+        with recording() as phases:
+            thread = threading.Thread(target=mark, args=('begin', 'worker'))
+            thread.start()
+            thread.join()
+        with recording() as others:
+            pass
+        self.assertEqual([p.name for p in phases], ['worker'])
+        self.assertEqual(others, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import threading
+import time
+import unittest
+
+from benchmark.procfs import ProcSampler
+
+
+@unittest.skipUnless(ProcSampler.available(), "needs a Linux /proc")
+class ContextSwitchTest(unittest.TestCase):
+
+    def test_all_threads_counted(self):
+        done = threading.Event()
+
+        def work():
+            while not done.is_set():
+                time.sleep(0.0005)
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        try:
+            time.sleep(0.3)
+            sampler = ProcSampler(cheap=True)
+            vol, invol = sampler._read_status(os.getpid())
+            with open('/proc/self/status') as f:
+                main = [int(line.split()[1]) for line in f
+                        if line.startswith('voluntary_ctxt_switches:')][0]
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        # Each sleeping thread switches about 600 times in 0.3 s
+        self.assertGreater(vol, main + 4 * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
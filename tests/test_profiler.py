@@ -0,0 +1,203 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+import psutil
+
+from benchmark.profiler import ProcessData, ResourceProfiler
+from benchmark.trace import TraceWriter, read_header, read_trace
+
+PAYLOAD = 32 * 1024 ** 2
+
+# Sleeps around the write so the writer is sampled before and after it
+WRITE = """
+import os, sys, time
+time.sleep(0.2)
+with open(sys.argv[1], 'wb') as f:
+    f.write(b'x' * {})
+    f.flush()
+    os.fsync(f.fileno())
+time.sleep(0.2)
+""".format(PAYLOAD)
+
+
+class ExitedChildIOTest(unittest.TestCase):
+    """The I/O of a child that exits is counted once, not again by its parent"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'payload')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def written(self, cmd):
+        with ResourceProfiler(dt=0.05, backend='thread') as prof:
+            subprocess.check_call(cmd)
+        # The counters are cumulative, and include what this process wrote before
+        written = (prof.results.wio.max() - prof.results.wio[0]) * 1e6
+        if written == 0:
+            self.skipTest("no write_bytes accounting for " + self.dir)
+        return written
+
+    def test_parent_waits(self):
+        written = self.written([sys.executable, '-c', WRITE, self.path])
+        self.assertGreaterEqual(written, 0.95 * PAYLOAD)
+        self.assertLess(written, 1.5 * PAYLOAD)
+
+    def test_shell_stays_alive(self):
+        script = '"{}" -c "$0" "$1"; sleep 0.5'.format(sys.executable)
+        written = self.written(['sh', '-c', script, WRITE, self.path])
+        self.assertGreaterEqual(written, 0.95 * PAYLOAD)
+        self.assertLess(written, 1.5 * PAYLOAD)
+
+
+class StackExcludeTest(unittest.TestCase):
+    """The profiler's own threads are left out of the stack samples"""
+
+    def test_allocation_tracer_excluded(self):
+        with ResourceProfiler(dt=0.05, backend='thread', stack_interval=0.005,
+                              allocation_interval=0.01) as prof:
+            end = time.time() + 0.5
+            while time.time() < end:
+                [str(i) for i in range(1000)]
+        stacks = [stack for stack, count in prof.stacks.collapsed()]
+        self.assertTrue(stacks)
+        self.assertFalse([stack for stack in stacks if '_run (allocations.py' in stack])
+
+    def test_persistent_runs(self):
+        prof = ResourceProfiler(dt=0.05, backend='thread', persistent=True, stack_interval=0.01,
+                                allocation_interval=0.05)
+        try:
+            for i in range(3):
+                with prof:
+                    threads = set([prof._tracker.ident, prof.allocations._thread.ident])
+                    time.sleep(0.1)
+                self.assertEqual(prof.stacks.exclude, threads)
+        finally:
+            prof.close()
+
+
+class AbandonedIteratorTest(unittest.TestCase):
+    """A chunk iterator nobody reads does not block the run"""
+
+    def test_abandoned(self):
+        prof = ResourceProfiler(dt=0.01, stream=True, chunk_size=1, flush_interval=0.01)
+        prof.max_pending_chunks = 2
+        prof.chunk_timeout = 0.2
+        chunks = prof.iter_chunks()
+        read = []
+        consumer = Thread(target=lambda: read.extend(prof.iter_chunks()))
+        consumer.start()
+        start = time.time()
+        with self.assertLogs('benchmark.profiler', 'WARNING'):
+            with prof:
+                self.assertIsNotNone(next(chunks))
+                time.sleep(1)
+        consumer.join(10)
+        self.assertFalse(consumer.is_alive())
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(prof._queues, [])
+        # Detached, the abandoned iterator stops instead of waiting forever
+        self.assertEqual(list(chunks), [])
+        self.assertGreater(len(read), 2)
+
+
+# Starts a profiler writing a trace and waits to be killed
+OWNER = """
+import sys, time
+from benchmark.profiler import ResourceProfiler
+prof = ResourceProfiler(dt=0.02, trace_path=sys.argv[1])
+prof.__enter__()
+print(prof._tracker.pid)
+sys.stdout.flush()
+time.sleep(60)
+"""
+
+
+class OrphanedTrackerTest(unittest.TestCase):
+    """The tracker process stops when its owner is killed"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def records(self):
+        try:
+            return read_header(self.path)['records']
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def test_owner_killed(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        owner = subprocess.Popen([sys.executable, '-c', OWNER, self.path],
+                                 stdout=subprocess.PIPE, env=env)
+        tracker = psutil.Process(int(owner.stdout.readline()))
+        owner.stdout.close()
+        deadline = time.time() + 30
+        while self.records() < 5:
+            if time.time() > deadline or owner.poll() is not None:
+                owner.kill()
+                self.fail("the tracker did not write the trace")
+            time.sleep(0.01)
+        owner.send_signal(signal.SIGKILL)
+        owner.wait()
+        try:
+            tracker.wait(timeout=10)
+        except psutil.TimeoutExpired:
+            tracker.kill()
+            self.fail("the tracker kept running after its owner was killed")
+        header = read_header(self.path)
+        self.assertEqual(os.path.getsize(self.path),
+                         header['header_size'] + header['records'] * 8 * len(header['columns']))
+
+
+class TraceFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.trace')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_persistent_runs(self):
+        prof = ResourceProfiler(dt=0.01, backend='thread', persistent=True, trace_path=self.path)
+        try:
+            files = []
+            for i in range(2):
+                with prof:
+                    time.sleep(0.1)
+                files.append(prof.trace_file)
+                self.assertEqual(len(read_trace(prof.trace_file)), len(prof.results))
+        finally:
+            prof.close()
+        self.assertEqual(files, [self.path, self.path + '.1'])
+
+    def test_old_process_trace(self):
+        # A trace of per-process samples written before the last columns existed
+        with TraceWriter(self.path, ('time', 'cpu')) as trace:
+            trace.append((1., 50.))
+        with TraceWriter(self.path + '.procs', ProcessData._fields[:-2]) as trace:
+            trace.append(range(len(ProcessData._fields) - 2))
+        prof = ResourceProfiler.from_trace(self.path)
+        self.assertEqual(prof.process_results.columns, ProcessData._fields)
+        row = prof.process_results[0]
+        self.assertEqual(row.pid, 1)
+        self.assertTrue(all(v != v for v in row[-2:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
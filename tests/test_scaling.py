@@ -0,0 +1,25 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import unittest
+
+from benchmark.benchmark import Profiler
+from benchmark.scaling import ScalingStudy
+from benchmark.utils import get_num_threads
+
+
+class ScalingStudyTest(unittest.TestCase):
+
+    def test_settings_restored(self):
+        omp_threads = os.environ.get('OMP_NUM_THREADS')
+        runtime_threads = get_num_threads()
+        prof = Profiler(exec_path=sys.executable, backend='thread')
+        result = ScalingStudy(prof, counts=[1, 3], pin=False).run('-c "pass"')
+        self.assertEqual(result['Counts'], [1, 3])
+        self.assertEqual(os.environ.get('OMP_NUM_THREADS'), omp_threads)
+        self.assertEqual(get_num_threads(), runtime_threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmark.benchmark_data import BenchmarkDataManager
+from benchmark.storage import SQLiteBackend
+
+
+class SQLiteBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.storage = SQLiteBackend(os.path.join(self.dir, 'results.db'))
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dir)
+
+    def test_sort_mixed_types(self):
+        for value in (2.5, 'nan', 1, None, '10'):
+            self.storage.write({'TestID': 'mixed', 'MemMax': value})
+        records = self.storage.query({'TestID': 'mixed'}, sortby='MemMax', ascending=True)
+        self.assertEqual([r['MemMax'] for r in records], [1, 2.5, '10', 'nan', None])
+
+    def test_empty_colnames(self):
+        manager = BenchmarkDataManager(self.storage)
+        self.assertEqual(manager.getcolnames(), [])
+        self.assertEqual(manager.colnames, [])
+        self.storage.write({'TestID': 'first'})
+        self.assertEqual(manager.colnames, ['RecordID', 'TestID'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import unittest
+
+from benchmark.sweep import Sweep
+from benchmark.utils import get_num_threads
+
+SCRIPT = '-c "import sys; sys.exit({code})"'
+
+
+class SweepTest(unittest.TestCase):
+
+    def sweep(self, params, **options):
+        profiles = []
+        options.setdefault('profiler_options', {'exec_path': sys.executable, 'backend': 'thread'})
+        sweep = Sweep(params, SCRIPT, write=lambda prof, point: profiles.append(prof), **options)
+        return sweep.run(), profiles
+
+    def test_failed_script(self):
+        records, profiles = self.sweep({'code': [0, 4]})
+        status = dict((r['point']['code'], r['status']) for r in records)
+        self.assertEqual(status, {0: 'done', 4: 'failed'})
+        self.assertEqual([p.bench_dict['ExitCode'] for p in profiles], [0, 4])
+
+    def test_settings_restored(self):
+        omp_threads = os.environ.get('OMP_NUM_THREADS')
+        runtime_threads = get_num_threads()
+        affinity = os.sched_getaffinity(0)
+        self.sweep({'code': [0], 'omp_threads': [1, 3]})
+        self.assertEqual(os.environ.get('OMP_NUM_THREADS'), omp_threads)
+        self.assertEqual(get_num_threads(), runtime_threads)
+        self.assertEqual(os.sched_getaffinity(0), affinity)
+
+    def test_dt_profile(self):
+        records, profiles = self.sweep({'code': [0], 'dt_profile': [0.02, 0.2]})
+        self.assertEqual([p.results._dt for p in profiles], [0.02, 0.2])
+
+
+if __name__ == '__main__':
+    unittest.main()